@@ -0,0 +1,106 @@
+"""
+Request ids and sampled access logging.
+
+Every request gets an id, taken from a well-formed incoming X-Request-ID or
+generated, which is echoed in the response and attached (with the route) to
+everything logged while serving it. One access line per request is written
+to the "marketplace.access" logger for a sample of requests:
+ACCESS_LOG_SAMPLE_RATE overall, or per route with ACCESS_LOG_ROUTE_RATES
+("GET /api/listings=0.01,GET /health=0"). Server errors and requests slower
+than ACCESS_LOG_SLOW_MS are always logged. Each line records the rate it was
+sampled at, so counts can be scaled back up.
+"""
+import os
+import random
+import re
+import time
+import uuid
+from dotenv import load_dotenv
+from logger import get_logger, log_context
+from sql_metrics import route_label
+
+load_dotenv()
+
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "0.01"))
+ACCESS_LOG_SLOW_MS = float(os.getenv("ACCESS_LOG_SLOW_MS", "1000"))
+ACCESS_LOG_ROUTE_RATES = {
+    route.strip(): float(rate)
+    for route, _, rate in (item.rpartition("=") for item in os.getenv("ACCESS_LOG_ROUTE_RATES", "").split(","))
+    if route.strip()
+}
+
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+access_logger = get_logger("marketplace.access")
+
+
+class _RequestLogContext:
+    __slots__ = ("request_id", "scope")
+
+    def __init__(self, request_id: str, scope):
+        self.request_id = request_id
+        self.scope = scope
+
+    @property
+    def route(self) -> str:
+        return route_label(self.scope)
+
+
+class AccessLogMiddleware:
+    """Assigns request ids and writes sampled access lines"""
+
+    def __init__(self, app, sample_rate: float = ACCESS_LOG_SAMPLE_RATE, route_rates: dict = ACCESS_LOG_ROUTE_RATES):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.route_rates = route_rates
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")
+                break
+        if request_id is None or not _REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        context = _RequestLogContext(request_id, scope)
+        token = log_context.set(context)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self._log(context, status, (time.perf_counter() - started) * 1000)
+            log_context.reset(token)
+
+    def _log(self, context: _RequestLogContext, status: int, duration_ms: float):
+        route = context.route
+        rate = self.route_rates.get(route, self.sample_rate)
+        if status < 500 and duration_ms < ACCESS_LOG_SLOW_MS:
+            if rate <= 0 or (rate < 1 and random.random() >= rate):
+                return
+        else:
+            rate = 1.0
+        scope = context.scope
+        access_logger.info(
+            f"{scope['method']} {scope['path']} {status} {duration_ms:.1f}ms",
+            extra={
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "duration_ms": round(duration_ms, 2),
+                "client": scope["client"][0] if scope.get("client") else None,
+                "sample_rate": rate,
+            }
+        )
@@ -7,8 +7,8 @@ from sqladmin.authentication import AuthenticationBackend
 from starlette.requests import Request
 from starlette.responses import RedirectResponse
 import models
-from auth_utils import verify_password, get_user_by_username
-from database import SessionLocal
+from auth_utils import check_password, get_user_by_username
+from database import AsyncSessionLocal
 
 
 from logger import logger
@@ -23,13 +23,13 @@ class AdminAuth(AuthenticationBackend):
         
         logger.info(f"Admin login attempt for user: {username}")
         
-        # Verify credentials
-        db = SessionLocal()
+        # Verify credentials (bcrypt runs on its own pool)
+        db = AsyncSessionLocal()
         try:
-            user = get_user_by_username(db, username)
+            user = await get_user_by_username(db, username)
             if user:
                 is_admin = user.role == "admin"
-                is_valid_pw = verify_password(password, user.password_hash)
+                is_valid_pw = await check_password(password, user.password_hash)
                 
                 if is_admin and is_valid_pw:
                     # Store admin session
@@ -43,7 +43,7 @@ class AdminAuth(AuthenticationBackend):
         except Exception as e:
             logger.error(f"Admin login error: {e}")
         finally:
-            db.close()
+            await db.close()
         
         return False
     
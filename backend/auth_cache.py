@@ -0,0 +1,102 @@
+"""
+Cache for get_current_user: decoded tokens and the users they name.
+
+Tokens map to their subject (username) until they expire or AUTH_CACHE_TTL
+passes; users are cached by username as a snapshot of their columns
+(password_hash excluded - the rare paths that need it refresh it explicitly)
+and re-attached to the request's session without a SELECT. Committed
+changes to a User (profile and password updates, admin edits, deletes)
+drop its entries via session events. Other workers keep their own copies
+until AUTH_CACHE_TTL runs out, so keep it short.
+"""
+import os
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+from dotenv import load_dotenv
+import models
+from cache import MemoryCacheBackend
+
+load_dotenv()
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+USER_COLUMNS = [column.key for column in models.User.__table__.columns if column.key != "password_hash"]
+
+
+class AuthCache:
+    """Token and user caches with per-user invalidation"""
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, max_entries: int = AUTH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.tokens = MemoryCacheBackend(max_entries)
+        self.users = MemoryCacheBackend(max_entries)
+
+    def get_subject(self, token: str):
+        return self.tokens.get(token)
+
+    def set_subject(self, token: str, username: str, expires_at):
+        ttl = self.ttl if expires_at is None else min(self.ttl, expires_at - time.time())
+        if ttl > 0:
+            self.tokens.set(token, username, ttl, set())
+
+    async def get_user(self, db, username: str):
+        """The cached user attached to the async session `db`, or None on a miss"""
+        snapshot = self.users.get(username)
+        if snapshot is None:
+            return None
+        user = models.User(**snapshot)
+        make_transient_to_detached(user)
+        return await db.merge(user, load=False)
+
+    def set_user(self, user: models.User):
+        snapshot = {key: getattr(user, key) for key in USER_COLUMNS}
+        self.users.set(user.username, snapshot, self.ttl, {f"user:{user.user_id}"})
+
+    def invalidate(self, *user_ids: int):
+        self.users.invalidate_tags({f"user:{user_id}" for user_id in user_ids})
+
+    def clear(self):
+        self.tokens.clear()
+        self.users.clear()
+
+    def stats(self) -> dict:
+        users = self.users.stats()
+        lookups = users["hits"] + users["misses"]
+        return {
+            "ttl": self.ttl,
+            "tokens": self.tokens.stats(),
+            "users": users,
+            # One user SELECT per authenticated request without the cache
+            "user_queries_saved": users["hits"],
+            "queries_saved_per_request": round(users["hits"] / lookups, 3) if lookups else 0.0,
+        }
+
+
+auth_cache = AuthCache()
+
+
+# ============== Invalidation on commit ==============
+
+@event.listens_for(Session, "after_flush")
+def _collect_users(session, flush_context):
+    changed = session.info.setdefault("auth_users", set())
+    for obj in session.dirty:
+        if isinstance(obj, models.User) and session.is_modified(obj, include_collections=False):
+            changed.add(obj.user_id)
+    for obj in session.deleted:
+        if isinstance(obj, models.User):
+            changed.add(obj.user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_users(session):
+    changed = session.info.pop("auth_users", None)
+    if changed:
+        auth_cache.invalidate(*changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_users(session):
+    session.info.pop("auth_users", None)
@@ -4,10 +4,13 @@ from jose import JWTError, jwt
 import bcrypt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import models
 import schemas
 from database import get_db
+from auth_cache import auth_cache
+from hashing_pool import hashing_pool
 import os
 from dotenv import load_dotenv
 
@@ -18,6 +21,9 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# bcrypt work factor for new hashes; logins upgrade hashes made with another cost
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
@@ -30,10 +36,25 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     """Hash a password"""
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed.decode('utf-8')
 
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True if the hash was made with a different work factor ("$2b$<cost>$...")"""
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the bcrypt pool (503 when it is saturated)"""
+    return await hashing_pool.run(verify_password, plain_password, hashed_password)
+
+async def hash_password(password: str) -> str:
+    """get_password_hash on the bcrypt pool (503 when it is saturated)"""
+    return await hashing_pool.run(get_password_hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token"""
     to_encode = data.copy()
@@ -46,26 +67,65 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[models.User]:
     """Get user by username"""
-    return db.query(models.User).filter(models.User.username == username).first()
+    return (await db.execute(select(models.User).where(models.User.username == username))).scalars().first()
 
-def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[models.User]:
     """Get user by email"""
-    return db.query(models.User).filter(models.User.email == email).first()
+    return (await db.execute(select(models.User).where(models.User.email == email))).scalars().first()
 
-def authenticate_user(db: Session, username: str, password: str) -> Optional[models.User]:
-    """Authenticate a user"""
-    user = get_user_by_username(db, username)
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> Optional[models.User]:
+    """Authenticate a user, upgrading their hash to the current work factor"""
+    user = await get_user_by_username(db, username)
     if not user:
         return None
-    if not verify_password(password, user.password_hash):
+    if not await check_password(password, user.password_hash):
+        return None
+    
+    if password_needs_rehash(user.password_hash):
+        try:
+            user.password_hash = await hash_password(password)
+        except HTTPException:
+            # Pool saturated: keep the old hash and upgrade on a later login
+            return user
+        await db.commit()
+    return user
+
+def _token_subject(token: str) -> Optional[str]:
+    """Username a valid token was issued for (decoded once, then cached)"""
+    username = auth_cache.get_subject(token)
+    if username is not None:
+        return username
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        username: str = payload.get("sub")
+        if username is None:
+            return None
+        token_data = schemas.TokenData(username=username)
+    except JWTError:
+        return None
+    
+    auth_cache.set_subject(token, token_data.username, payload.get("exp"))
+    return token_data.username
+
+async def get_user_from_token(db: AsyncSession, token: str) -> Optional[models.User]:
+    """Resolve a JWT access token to its user, or None if invalid"""
+    username = _token_subject(token)
+    if username is None:
         return None
+    
+    # Cached users are re-attached to `db` without a query
+    user = await auth_cache.get_user(db, username)
+    if user is None:
+        user = await get_user_by_username(db, username=username)
+        if user is not None:
+            auth_cache.set_user(user)
     return user
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> models.User:
     """Get current authenticated user from JWT token"""
     credentials_exception = HTTPException(
@@ -74,16 +134,7 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = schemas.TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    
-    user = get_user_by_username(db, username=token_data.username)
+    user = await get_user_from_token(db, token)
     if user is None:
         raise credentials_exception
     
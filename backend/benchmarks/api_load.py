@@ -0,0 +1,147 @@
+"""
+Mixed read/write API load.
+
+Seeds a seller with --listings listings, then runs --requests requests,
+--concurrency at a time, over a mix of the feed, listing detail, search,
+/api/auth/me, favorites, conversations and message sends, and reports
+requests/s with latency percentiles per endpoint.
+
+To compare two versions of the backend, start each one and point the
+benchmark at it:
+
+    python -m benchmarks.api_load                          # in-process server, temp SQLite DB
+    python -m benchmarks.api_load --url http://localhost:8000
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.upload_throughput import start_local_server, percentile
+
+PASSWORD = "benchmark-password"
+
+
+def register(url: str, prefix: str) -> tuple:
+    name = f"{prefix}_{uuid.uuid4().hex[:8]}"
+    r = httpx.post(f"{url}/api/auth/register", json={
+        "username": name, "email": f"{name}@example.com", "password": PASSWORD
+    })
+    r.raise_for_status()
+    body = r.json()
+    return body["user"]["user_id"], {"Authorization": f"Bearer {body['access_token']}"}
+
+
+def seed(url: str, listings: int) -> dict:
+    """A seller with listings and a buyer who favorites and messages them"""
+    seller_id, seller = register(url, "seller")
+    buyer_id, buyer = register(url, "buyer")
+    listing_ids = []
+    with httpx.Client(base_url=url) as client:
+        for i in range(listings):
+            r = client.post("/api/listings", headers=seller, json={
+                "title": f"Benchmark textbook {i}", "description": "Lightly used, some notes",
+                "price": 10 + i, "condition": "good", "quantity": 1, "status": "published"
+            })
+            r.raise_for_status()
+            listing_ids.append(r.json()["listing_id"])
+        for listing_id in listing_ids[:10]:
+            client.post("/api/favorites", headers=buyer, json={"listing_id": listing_id})
+            client.post("/api/messages", headers=buyer, json={
+                "receiver_id": seller_id, "listing_id": listing_id, "body": "Is this still available?"
+            })
+    return {"seller_id": seller_id, "seller": seller, "buyer": buyer, "listing_ids": listing_ids}
+
+
+def request_mix(data: dict):
+    """(name, method, path, kwargs) weighted roughly like browsing traffic"""
+    listing_id = random.choice(data["listing_ids"])
+    buyer = data["buyer"]
+    return random.choices([
+        ("feed", "GET", "/api/listings", {"params": {"limit": 20}}),
+        ("feed (page 2)", "GET", "/api/listings", {"params": {"limit": 20, "offset": 20}}),
+        ("detail", "GET", f"/api/listings/{listing_id}", {}),
+        ("search", "GET", "/api/listings", {"params": {"search": random.choice(["textbook", "notes", "used"])}}),
+        ("me", "GET", "/api/auth/me", {"headers": buyer}),
+        ("favorites", "GET", "/api/favorites", {"headers": buyer}),
+        ("conversations", "GET", "/api/messages/conversations", {"headers": buyer}),
+        ("send message", "POST", "/api/messages", {"headers": buyer, "json": {
+            "receiver_id": data["seller_id"], "listing_id": listing_id, "body": "Would you take less?"
+        }}),
+    ], weights=[25, 5, 25, 10, 10, 10, 10, 5])[0]
+
+
+async def run(args, data: dict, mix=request_mix) -> dict:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=120, limits=limits) as client:
+        async def one():
+            name, method, path, kwargs = mix(data)
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    r = await client.request(method, path, **kwargs)
+                    ok = r.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies[name].append(time.perf_counter() - started)
+                else:
+                    errors[name] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    return {"elapsed": elapsed, "latencies": latencies, "errors": errors}
+
+
+def report(args, result: dict):
+    """Print overall and per-endpoint throughput and latency"""
+    everything = [value for values in result["latencies"].values() for value in values]
+    errors = sum(result["errors"].values())
+    print(
+        f"{args.requests} requests, concurrency {args.concurrency}: "
+        f"{len(everything) / result['elapsed']:.0f} req/s, {errors} errors, "
+        f"p50 {percentile(everything, 50) * 1000:.0f} ms  p95 {percentile(everything, 95) * 1000:.0f} ms  "
+        f"p99 {percentile(everything, 99) * 1000:.0f} ms"
+    )
+    for name in sorted(set(result["latencies"]) | set(result["errors"])):
+        values = result["latencies"][name]
+        print(
+            f"  {name:>14}: {len(values):5d} ok {result['errors'][name]:4d} errors  "
+            f"p50 {percentile(values, 50) * 1000:6.0f} ms  p95 {percentile(values, 95) * 1000:6.0f} ms  "
+            f"p99 {percentile(values, 99) * 1000:6.0f} ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a mixed API workload")
+    parser.add_argument("--url", help="Server to test (default: start one in-process)")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--listings", type=int, default=60)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    local = args.url is None
+    if local:
+        server = start_local_server(args.port)
+        args.url = f"http://127.0.0.1:{args.port}"
+
+    data = seed(args.url, args.listings)
+    report(args, asyncio.run(run(args, data)))
+
+    if local:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Login throughput against the bcrypt pool.
+
+Fires --logins logins, --concurrency at a time, while probing GET
+/api/listings, once per --pool-sizes value (in-process server only; against
+--url the server's own HASH_WORKERS applies). Reports logins/s, login
+latency, 503s from a saturated pool and what browsing users see meanwhile.
+
+    python -m benchmarks.login_throughput --pool-sizes 1,2,4 --rounds 10
+    python -m benchmarks.login_throughput --url http://localhost:8000
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+
+import httpx
+
+from benchmarks.upload_throughput import start_local_server, percentile
+
+PASSWORD = "benchmark-password"
+
+
+async def run(args, username: str) -> dict:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, probes = [], []
+    outcomes = {"ok": 0, "rejected": 0, "failed": 0}
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=120) as client:
+        async def login():
+            async with semaphore:
+                started = time.perf_counter()
+                r = await client.post("/api/auth/login", data={"username": username, "password": PASSWORD})
+                if r.status_code == 200:
+                    outcomes["ok"] += 1
+                    latencies.append(time.perf_counter() - started)
+                elif r.status_code == 503:
+                    outcomes["rejected"] += 1
+                else:
+                    outcomes["failed"] += 1
+
+        async def probe():
+            while not done.is_set():
+                started = time.perf_counter()
+                await client.get("/api/listings")
+                probes.append(time.perf_counter() - started)
+                await asyncio.sleep(0.02)
+
+        probe_task = asyncio.create_task(probe())
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(login() for _ in range(args.logins)))
+        finally:
+            elapsed = time.perf_counter() - started
+            done.set()
+            await probe_task
+
+    return {
+        **outcomes, "elapsed": elapsed,
+        "logins_per_s": outcomes["ok"] / elapsed,
+        "login_p50": percentile(latencies, 50), "login_p95": percentile(latencies, 95),
+        "probe_p50": percentile(probes, 50), "probe_p99": percentile(probes, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent logins")
+    parser.add_argument("--url", help="Server to test (default: start one in-process)")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--pool-sizes", default="1,2,4", help="Comma-separated HASH_WORKERS values (in-process only)")
+    parser.add_argument("--queue-limit", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=10, help="BCRYPT_ROUNDS for the in-process server")
+    args = parser.parse_args()
+
+    local = args.url is None
+    if local:
+        os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+        server = start_local_server(args.port)
+        args.url = f"http://127.0.0.1:{args.port}"
+
+    username = f"bench_{uuid.uuid4().hex[:8]}"
+    r = httpx.post(f"{args.url}/api/auth/register", json={
+        "username": username, "email": f"{username}@example.com", "password": PASSWORD
+    })
+    r.raise_for_status()
+
+    print(f"{args.logins} logins, concurrency {args.concurrency}, {os.cpu_count()} CPUs")
+    for workers in ([int(size) for size in args.pool_sizes.split(",")] if local else [None]):
+        if workers is not None:
+            from hashing_pool import hashing_pool
+            hashing_pool.configure(workers, args.queue_limit)
+        result = asyncio.run(run(args, username))
+        print(
+            f"{'server' if workers is None else f'{workers} workers':>10}: "
+            f"{result['logins_per_s']:6.1f} logins/s  p50 {result['login_p50'] * 1000:6.0f} ms  "
+            f"p95 {result['login_p95'] * 1000:6.0f} ms  503s {result['rejected']:4d}  errors {result['failed']:3d}  |  "
+            f"/api/listings p50 {result['probe_p50'] * 1000:5.1f} ms  p99 {result['probe_p99'] * 1000:5.1f} ms"
+        )
+
+    if local:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
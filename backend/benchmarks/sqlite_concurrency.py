@@ -0,0 +1,106 @@
+"""
+SQLite under concurrent writes: production mode against SQLAlchemy defaults.
+
+For each SQLITE_MODE, starts uvicorn (--workers processes) on a fresh
+SQLite file, seeds it, and runs a write-heavy mix (message sends, listing
+creates and edits, listing views) alongside feed and detail reads. Reports
+throughput, errors ("database is locked" surfaces as 500s) and latency for
+reads and writes separately.
+
+    python -m benchmarks.sqlite_concurrency
+    python -m benchmarks.sqlite_concurrency --workers 2 --concurrency 128
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.api_load import seed, run, report
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ("default", "production")
+
+
+def write_heavy_mix(data: dict):
+    """(name, method, path, kwargs), about half of them writes"""
+    listing_id = random.choice(data["listing_ids"])
+    return random.choices([
+        ("feed", "GET", "/api/listings", {"params": {"limit": 20}}),
+        ("detail", "GET", f"/api/listings/{listing_id}", {}),
+        ("conversations", "GET", "/api/messages/conversations", {"headers": data["buyer"]}),
+        ("send message", "POST", "/api/messages", {"headers": data["buyer"], "json": {
+            "receiver_id": data["seller_id"], "listing_id": listing_id, "body": "Would you take less?"
+        }}),
+        ("create listing", "POST", "/api/listings", {"headers": data["seller"], "json": {
+            "title": "Benchmark lab coat", "description": "Worn once", "price": 15,
+            "condition": "good", "quantity": 1, "status": "published"
+        }}),
+        ("edit listing", "PUT", f"/api/listings/{listing_id}", {"headers": data["seller"], "json": {
+            "price": random.randint(5, 50)
+        }}),
+    ], weights=[20, 20, 10, 25, 10, 15])[0]
+
+
+def start_server(mode: str, port: int, workers: int) -> subprocess.Popen:
+    """Migrate a fresh SQLite file and serve it with SQLITE_MODE=mode"""
+    try:
+        httpx.get(f"http://127.0.0.1:{port}/health")
+        raise RuntimeError(f"Port {port} is already in use")
+    except httpx.ConnectError:
+        pass
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{tempfile.mkdtemp()}/bench.db",
+        SQLITE_MODE=mode,
+        SECRET_KEY=os.getenv("SECRET_KEY", "benchmark"),
+        QUERY_BUDGET_MODE="off",
+    )
+    subprocess.run([sys.executable, "-m", "migrations", "upgrade"], cwd=BACKEND_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                return server
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"Server for SQLITE_MODE={mode} did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SQLite production mode against the defaults")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--port", type=int, default=8768)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--listings", type=int, default=40)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+    args.url = f"http://127.0.0.1:{args.port}"
+
+    for mode in args.modes:
+        server = start_server(mode, args.port, args.workers)
+        try:
+            data = seed(args.url, args.listings)
+            print(f"\nSQLITE_MODE={mode}, {args.workers} worker(s)")
+            report(args, asyncio.run(run(args, data, mix=write_heavy_mix)))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Upload throughput under concurrent uploads.
+
+Sends --uploads photos of --size-kb each, --concurrency at a time, to the
+multipart and/or raw streaming endpoints while probing GET /health, and
+reports throughput plus how long the event loop kept other requests waiting.
+
+    python -m benchmarks.upload_throughput                 # in-process server, temp SQLite DB
+    python -m benchmarks.upload_throughput --url http://localhost:8000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import httpx
+
+CHUNK = 64 * 1024
+
+
+def start_local_server(port: int):
+    """Run the app with uvicorn in a background thread against a fresh SQLite DB"""
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import uvicorn
+    import migrations
+    from database import engine
+    from main import app
+
+    migrations.upgrade(engine)
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def unique_head(length: int) -> bytes:
+    """JPEG magic plus random bytes, so content-addressed storage cannot dedupe uploads"""
+    return b"\xff\xd8\xff\xe0" + os.urandom(16) + b"\0" * (length - 20)
+
+
+async def body_chunks(size: int):
+    yield unique_head(CHUNK)
+    sent = CHUNK
+    while sent < size:
+        yield b"\0" * min(CHUNK, size - sent)
+        sent += CHUNK
+
+
+async def run(args, mode: str, token: str) -> dict:
+    headers = {"Authorization": f"Bearer {token}"}
+    size = args.size_kb * 1024
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, probes, stored = [], [], []
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=120) as client:
+        async def upload():
+            async with semaphore:
+                started = time.perf_counter()
+                if mode == "stream":
+                    r = await client.post("/api/photos/upload/stream", content=body_chunks(size), headers=headers)
+                else:
+                    r = await client.post("/api/photos/upload", files={"file": ("bench.jpg", unique_head(size), "image/jpeg")}, headers=headers)
+                r.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+                stored.append(r.json()["filename"])
+
+        async def probe():
+            while not done.is_set():
+                started = time.perf_counter()
+                await client.get("/health")
+                probes.append(time.perf_counter() - started)
+                await asyncio.sleep(0.02)
+
+        probe_task = asyncio.create_task(probe())
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(upload() for _ in range(args.uploads)))
+        finally:
+            elapsed = time.perf_counter() - started
+            done.set()
+            await probe_task
+
+    return {
+        "mode": mode, "elapsed": elapsed, "stored": stored,
+        "mb_per_s": args.uploads * size / elapsed / (1024 * 1024),
+        "uploads_per_s": args.uploads / elapsed,
+        "upload_p50": percentile(latencies, 50), "upload_p95": percentile(latencies, 95),
+        "probe_p50": percentile(probes, 50), "probe_p99": percentile(probes, 99), "probe_max": max(probes, default=0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent photo uploads")
+    parser.add_argument("--url", help="Server to test (default: start one in-process)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--uploads", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--size-kb", type=int, default=2048)
+    parser.add_argument("--mode", choices=["stream", "multipart", "both"], default="both")
+    args = parser.parse_args()
+
+    local = args.url is None
+    if local:
+        server = start_local_server(args.port)
+        args.url = f"http://127.0.0.1:{args.port}"
+
+    name = f"bench_{uuid.uuid4().hex[:8]}"
+    r = httpx.post(f"{args.url}/api/auth/register", json={
+        "username": name, "email": f"{name}@example.com", "password": "benchmark-password"
+    })
+    r.raise_for_status()
+    token = r.json()["access_token"]
+
+    print(f"{args.uploads} uploads x {args.size_kb} KB, concurrency {args.concurrency}")
+    for mode in (["stream", "multipart"] if args.mode == "both" else [args.mode]):
+        result = asyncio.run(run(args, mode, token))
+        print(
+            f"{mode:>9}: {result['mb_per_s']:7.1f} MB/s  {result['uploads_per_s']:6.1f} uploads/s  "
+            f"upload p50 {result['upload_p50'] * 1000:6.0f} ms  p95 {result['upload_p95'] * 1000:6.0f} ms  |  "
+            f"/health p50 {result['probe_p50'] * 1000:5.1f} ms  p99 {result['probe_p99'] * 1000:5.1f} ms  "
+            f"max {result['probe_max'] * 1000:5.1f} ms"
+        )
+        if local:
+            from storage import UPLOAD_DIR
+            for filename in result["stored"]:
+                os.remove(os.path.join(UPLOAD_DIR, filename))
+
+    if local:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
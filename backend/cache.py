@@ -0,0 +1,319 @@
+"""
+Response cache for hot read endpoints (listing feed, listing detail,
+categories).
+
+Entries hold the already-serialized JSON content and are tagged with what
+they depend on ("feed", "listing:<id>", "seller:<id>", "categories").
+Committed changes to Listing/Photo/Category/User rows invalidate exactly the
+matching tags via SQLAlchemy session events, so admin edits are covered too.
+
+With read replicas (see replicas.py) a request right after a commit may
+still read the old rows from a lagging replica. Invalidated tags are
+therefore held for the replicas' staleness window, during which responses
+carrying them are served but not stored again.
+
+A response is also not stored if one of its tags was invalidated while it
+was being read: endpoints take version() before the query and pass it to
+store(), which skips the entry if a commit dropped any of its tags since.
+
+The in-process MemoryCacheBackend is the default; a shared cache only needs
+to implement CacheBackend and be passed to configure_cache(). With several
+workers and the memory backend, other workers' entries expire by TTL.
+"""
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from urllib.parse import urlencode
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+import models
+from replicas import replica_router
+
+load_dotenv()
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "30"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+
+CACHE_HEADER = "X-Cache"
+
+
+class CacheBackend(ABC):
+    """Interface for cache storage backends"""
+
+    @abstractmethod
+    def get(self, key: str):
+        """Return the stored value or None"""
+
+    @abstractmethod
+    def set(self, key: str, value, ttl: float, tags: set):
+        """Store a value for `ttl` seconds, tagged for invalidation"""
+
+    @abstractmethod
+    def invalidate_tags(self, tags: set):
+        """Drop every entry carrying any of `tags`"""
+
+    @abstractmethod
+    def clear(self):
+        """Drop every entry"""
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Thread-safe in-process LRU cache with per-entry TTL"""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tag_index = {}  # tag -> set of keys
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl, tags):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value, frozenset(tags))
+            for tag in tags:
+                self._tag_index.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_tags(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tag_index.pop(tag, ()):
+                    if key in self._entries:
+                        self._remove(key)
+                        self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tag_index.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_index[tag]
+
+
+class ResponseCache:
+    """Caches serialized endpoint responses on top of a CacheBackend"""
+
+    def __init__(self, backend: CacheBackend, ttl: float = RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._adapters = {}
+        self._held = {}  # tag ("*" for all) -> monotonic time until which it is not stored
+        self._held_lock = threading.Lock()
+        self.held_stores = 0
+        self._generation = 0  # bumped by every invalidation
+        self._versions = {}  # tag ("*" for all) -> generation of its last invalidation
+        self._versions_floor = 0  # versions older than this were pruned
+        self.raced_stores = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    @staticmethod
+    def key(namespace: str, **params) -> str:
+        """Normalized key: None values dropped, params sorted"""
+        items = sorted((k, str(v)) for k, v in params.items() if v is not None)
+        return f"{namespace}?{urlencode(items)}"
+
+    def get(self, key: str):
+        """Return (content, headers) or None"""
+        if not self.enabled:
+            return None
+        return self.backend.get(key)
+
+    def serialize(self, schema, obj):
+        """Validate ORM objects against a response schema and dump to JSON-able data"""
+        adapter = self._adapters.get(schema)
+        if adapter is None:
+            adapter = self._adapters[schema] = TypeAdapter(schema)
+        return adapter.dump_python(adapter.validate_python(obj, from_attributes=True), mode="json")
+
+    def version(self) -> int:
+        """Snapshot to take before reading the rows of a response, for store()"""
+        return self._generation
+
+    def store(self, key: str, content, tags: set, headers: dict = None, version: int = None):
+        """
+        Cache (content, headers) under `key`, unless one of its tags was just
+        invalidated, or was invalidated after `version` was taken.
+        """
+        if not self.enabled:
+            return
+        if self._is_held(tags):
+            with self._held_lock:
+                self.held_stores += 1
+            return
+        if version is not None and self._changed_since(tags, version):
+            with self._held_lock:
+                self.raced_stores += 1
+            return
+        self.backend.set(key, (content, headers or {}), self.ttl, tags)
+
+    def invalidate(self, *tags: str, hold: bool = True):
+        """
+        Drop entries carrying `tags`. With hold, they are not stored again
+        while a replica may still serve the rows from before the change.
+        """
+        self._bump(tags)
+        if hold:
+            self._hold(tags)
+        self.backend.invalidate_tags(set(tags))
+
+    def clear(self):
+        self._bump(("*",))
+        self._hold(("*",))
+        self.backend.clear()
+
+    def _bump(self, tags):
+        with self._held_lock:
+            self._generation += 1
+            if len(self._versions) >= 10000:
+                # Forget the tags; snapshots taken before now count as changed
+                self._versions = {}
+                self._versions_floor = self._generation
+            for tag in tags:
+                self._versions[tag] = self._generation
+
+    def _changed_since(self, tags, version: int) -> bool:
+        if version < self._versions_floor:
+            return True
+        return any(self._versions.get(tag, 0) > version for tag in (*tags, "*"))
+
+    def _hold(self, tags):
+        seconds = replica_router.staleness if replica_router.enabled else 0
+        if seconds <= 0:
+            return
+        now = time.monotonic()
+        with self._held_lock:
+            if len(self._held) >= 10000:
+                self._held = {tag: until for tag, until in self._held.items() if until > now}
+            for tag in tags:
+                self._held[tag] = now + seconds
+
+    def _is_held(self, tags) -> bool:
+        if not self._held:
+            return False
+        now = time.monotonic()
+        return any(self._held.get(tag, 0) > now for tag in (*tags, "*"))
+
+    def stats(self) -> dict:
+        return {
+            "ttl": self.ttl,
+            "held_stores": self.held_stores,
+            "raced_stores": self.raced_stores,
+            **self.backend.stats()
+        }
+
+
+def json_response(content, headers: dict = None, hit: bool = False) -> JSONResponse:
+    """Build the response for cached (or freshly cached) content"""
+    headers = dict(headers or {})
+    headers[CACHE_HEADER] = "HIT" if hit else "MISS"
+    return JSONResponse(content=content, headers=headers)
+
+
+response_cache = ResponseCache(MemoryCacheBackend())
+
+
+def configure_cache(backend: CacheBackend, ttl: float = RESPONSE_CACHE_TTL):
+    """Swap the cache backend (e.g. for a shared cache)"""
+    response_cache.backend = backend
+    response_cache.ttl = ttl
+
+
+# ============== Invalidation on commit ==============
+
+def _tags_for(obj, is_new: bool) -> set:
+    """Cache tags affected by a change to `obj`"""
+    if isinstance(obj, models.Listing):
+        if is_new:
+            return {"feed"}
+        return {"feed", f"listing:{obj.listing_id}"}
+    if isinstance(obj, models.Photo):
+        return {"feed", f"listing:{obj.listing_id}"}
+    if isinstance(obj, models.User):
+        return set() if is_new else {"feed", f"seller:{obj.user_id}"}
+    if isinstance(obj, models.Category):
+        # Categories are embedded in every listing response
+        return {"categories"} if is_new else {"categories", "feed", "*"}
+    return set()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_tags(session, flush_context):
+    tags = session.info.setdefault("cache_tags", set())
+    for obj in session.new:
+        tags |= _tags_for(obj, True)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            tags |= _tags_for(obj, False)
+    for obj in session.deleted:
+        tags |= _tags_for(obj, False)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    tags = session.info.pop("cache_tags", None)
+    if not tags:
+        return
+    if "*" in tags:
+        response_cache.clear()
+    else:
+        response_cache.invalidate(*tags)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_tags(session):
+    session.info.pop("cache_tags", None)
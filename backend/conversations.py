@@ -0,0 +1,280 @@
+"""
+Maintenance of the denormalized conversations table (the inbox summary).
+
+The messages router updates a thread's row in the same transaction as the
+message write, through the async helpers below. ORM deletes of messages,
+listings (whose messages move to the listing-less thread) and users
+recompute the affected users' threads in the same flush. rebuild()
+recomputes every row from the messages table in batches, to backfill the
+table or repair drift from changes made outside the ORM (raw SQL):
+
+    python conversations.py rebuild [--batch-size N]
+    python conversations.py verify  [--batch-size N]
+"""
+from sqlalchemy import event, select, case, func, delete, update, insert, bindparam, and_, or_, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import models
+
+Conversation = models.Conversation
+Message = models.Message
+conversations_table = Conversation.__table__
+
+
+def thread_key(user_a: int, user_b: int, listing_id) -> str:
+    """Stable key for the thread between two users about a listing"""
+    low, high = sorted((user_a, user_b))
+    return f"{low}:{high}:{listing_id or 0}"
+
+
+def _unread_column(conversation_user_low: int, reader_id: int):
+    return Conversation.unread_low if reader_id == conversation_user_low else Conversation.unread_high
+
+
+async def record_message(db, message: models.Message):
+    """Point the message's thread at it and bump the receiver's unread count (message must be flushed)"""
+    low, high = sorted((message.sender_id, message.receiver_id))
+    key = thread_key(low, high, message.listing_id)
+    unread = _unread_column(low, message.receiver_id)
+    sent_at = select(Message.sent_at).where(Message.message_id == message.message_id).scalar_subquery()
+    # Concurrent senders may commit out of order; never move back to an older message
+    is_newer = func.coalesce(Conversation.last_message_id, 0) < message.message_id
+    values = {
+        Conversation.last_message_id: case((is_newer, message.message_id), else_=Conversation.last_message_id),
+        Conversation.last_message_at: case((is_newer, sent_at), else_=Conversation.last_message_at),
+        unread: unread + 1,
+    }
+
+    bump = update(Conversation).where(Conversation.thread_key == key).values(values)
+    bump = bump.execution_options(synchronize_session=False)
+    if (await db.execute(bump)).rowcount:
+        return
+    try:
+        async with db.begin_nested():
+            db.add(Conversation(
+                thread_key=key,
+                user_low_id=low,
+                user_high_id=high,
+                listing_id=message.listing_id,
+                last_message_id=message.message_id,
+                last_message_at=sent_at,
+                unread_low=1 if message.receiver_id == low else 0,
+                unread_high=1 if message.receiver_id == high else 0
+            ))
+    except IntegrityError:
+        # Another request created the thread first
+        await db.execute(bump)
+
+
+async def record_read(db, reader_id: int, other_id: int, read_counts: dict):
+    """Lower the reader's unread counts by {listing_id: messages marked read}, in one UPDATE"""
+    counts = {
+        thread_key(reader_id, other_id, listing_id): count
+        for listing_id, count in read_counts.items() if count
+    }
+    if not counts:
+        return
+    low, _ = sorted((reader_id, other_id))
+    unread = _unread_column(low, reader_id)
+    marked = case(
+        *((Conversation.thread_key == key, count) for key, count in counts.items()),
+        else_=0
+    )
+    await db.execute(
+        update(Conversation).where(Conversation.thread_key.in_(counts))
+        .values({unread: case((unread > marked, unread - marked), else_=0)})
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def unread_counts(db, reader_id: int, other_id: int, listing_ids) -> dict:
+    """{listing_id: reader's unread count} for the reader's threads with other_id"""
+    low, _ = sorted((reader_id, other_id))
+    unread = _unread_column(low, reader_id)
+    keys = {thread_key(reader_id, other_id, listing_id): listing_id for listing_id in listing_ids}
+    rows = (await db.execute(
+        select(Conversation.thread_key, unread).where(Conversation.thread_key.in_(keys))
+    )).all()
+    counts = {listing_id: 0 for listing_id in listing_ids}
+    for key, count in rows:
+        counts[keys[key]] = count
+    return counts
+
+
+# ============== Rebuild / verify ==============
+
+_low = case((Message.sender_id < Message.receiver_id, Message.sender_id), else_=Message.receiver_id)
+_high = case((Message.sender_id < Message.receiver_id, Message.receiver_id), else_=Message.sender_id)
+COMPARED = ("last_message_id", "unread_low", "unread_high")
+
+
+def _expected_threads(where=None):
+    """Every thread's expected row (or those of messages matching `where`), aggregated with GROUP BY"""
+    unread = Message.is_read.is_not(True)
+    grouped = select(
+        _low.label("user_low_id"),
+        _high.label("user_high_id"),
+        Message.listing_id,
+        # Like record_message: the newest message is the one with the highest id
+        func.max(Message.message_id).label("last_message_id"),
+        func.sum(case((unread & (Message.receiver_id == _low), 1), else_=0)).label("unread_low"),
+        func.sum(case((unread & (Message.receiver_id != _low), 1), else_=0)).label("unread_high"),
+    ).group_by(_low, _high, Message.listing_id)
+    if where is not None:
+        grouped = grouped.where(where)
+    grouped = grouped.subquery()
+    return select(grouped, Message.sent_at.label("last_message_at")).join(
+        Message, Message.message_id == grouped.c.last_message_id
+    )
+
+
+def _expected_row(row) -> dict:
+    return {
+        "thread_key": thread_key(row.user_low_id, row.user_high_id, row.listing_id),
+        "user_low_id": row.user_low_id, "user_high_id": row.user_high_id,
+        "listing_id": row.listing_id, "last_message_id": row.last_message_id,
+        "last_message_at": row.last_message_at,
+        "unread_low": row.unread_low, "unread_high": row.unread_high,
+    }
+
+
+def _thread_batches(conn, batch_size: int):
+    """
+    Every thread's expected row, streamed batch_size threads at a time, so
+    memory does not grow with the number of conversations
+    """
+    result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(_expected_threads())
+    for rows in result.partitions():
+        yield [_expected_row(row) for row in rows]
+
+
+def _sync(conn, threads: list, existing: dict, report: dict, dry_run: bool = False):
+    """Insert the missing and update the stale rows among `threads` ({thread_key: row} in `existing`)"""
+    missing, stale = [], []
+    for expected in threads:
+        row = existing.get(expected["thread_key"])
+        if row is None:
+            missing.append(expected)
+        elif any(getattr(row, column) != expected[column] for column in COMPARED):
+            stale.append({"b_conversation_id": row.conversation_id, **expected})
+    report["threads"] += len(threads)
+    report["missing"] += len(missing)
+    report["stale"] += len(stale)
+    if dry_run:
+        return
+    if stale:
+        conn.execute(update(conversations_table).where(
+            conversations_table.c.conversation_id == bindparam("b_conversation_id")
+        ), stale)
+    if missing:
+        conn.execute(insert(conversations_table), missing)
+
+
+def _orphaned_batches(conn, batch_size: int):
+    """conversation_ids of rows whose thread has no messages left, batch_size rows scanned at a time"""
+    c = conversations_table.c
+    has_messages = select(Message.message_id).where(
+        or_(
+            and_(Message.sender_id == c.user_low_id, Message.receiver_id == c.user_high_id),
+            and_(Message.sender_id == c.user_high_id, Message.receiver_id == c.user_low_id),
+        ),
+        Message.listing_id.is_not_distinct_from(c.listing_id)
+    ).exists()
+    last_id = 0
+    while True:
+        ids = conn.execute(
+            select(c.conversation_id).where(c.conversation_id > last_id)
+            .order_by(c.conversation_id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return
+        yield conn.execute(
+            select(c.conversation_id).where(c.conversation_id.in_(ids), ~has_messages)
+        ).scalars().all()
+        last_id = ids[-1]
+
+
+def rebuild(conn, batch_size: int = 5000, dry_run: bool = False) -> dict:
+    """
+    Recompute the conversations table from messages.
+
+    With dry_run only reports how many rows are missing, stale or orphaned.
+    """
+    report = {"threads": 0, "missing": 0, "stale": 0, "orphaned": 0}
+
+    for orphaned in _orphaned_batches(conn, batch_size):
+        report["orphaned"] += len(orphaned)
+        if orphaned and not dry_run:
+            conn.execute(delete(conversations_table).where(conversations_table.c.conversation_id.in_(orphaned)))
+
+    for threads in _thread_batches(conn, batch_size):
+        existing = {
+            row.thread_key: row
+            for row in conn.execute(select(conversations_table).where(
+                conversations_table.c.thread_key.in_([thread["thread_key"] for thread in threads])
+            ))
+        }
+        _sync(conn, threads, existing, report, dry_run)
+    return report
+
+
+# ============== Deletes ==============
+
+def refresh_pairs(conn, pairs) -> dict:
+    """Recompute every thread between the given (low, high) user pairs from messages"""
+    pairs = sorted(pairs)
+    c = conversations_table.c
+    report = {"threads": 0, "missing": 0, "stale": 0, "orphaned": 0}
+    threads = [_expected_row(row) for row in conn.execute(_expected_threads(tuple_(_low, _high).in_(pairs)))]
+    existing = {
+        row.thread_key: row
+        for row in conn.execute(select(conversations_table).where(tuple_(c.user_low_id, c.user_high_id).in_(pairs)))
+    }
+    expected_keys = {thread["thread_key"] for thread in threads}
+    orphaned = [row.conversation_id for key, row in existing.items() if key not in expected_keys]
+    if orphaned:
+        report["orphaned"] = len(orphaned)
+        conn.execute(delete(conversations_table).where(c.conversation_id.in_(orphaned)))
+    _sync(conn, threads, existing, report)
+    return report
+
+
+@event.listens_for(Session, "after_flush")
+def _refresh_after_deletes(session, flush_context):
+    pairs, listing_ids, user_ids = set(), [], []
+    for obj in session.deleted:
+        if isinstance(obj, Message):
+            pairs.add(tuple(sorted((obj.sender_id, obj.receiver_id))))
+        elif isinstance(obj, models.Listing):
+            listing_ids.append(obj.listing_id)
+        elif isinstance(obj, models.User):
+            user_ids.append(obj.user_id)
+    if not (pairs or listing_ids or user_ids):
+        return
+    conn = session.connection()
+    c = conversations_table.c
+    # Threads about a deleted listing, or with a deleted user, whose messages
+    # were moved (listing_id SET NULL) or removed (CASCADE) by this flush
+    pairs.update(tuple(row) for row in conn.execute(select(c.user_low_id, c.user_high_id).where(or_(
+        c.listing_id.in_(listing_ids), c.user_low_id.in_(user_ids), c.user_high_id.in_(user_ids)
+    ))))
+    if pairs:
+        refresh_pairs(conn, pairs)
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Rebuild or verify the conversations table")
+    parser.add_argument("command", choices=["rebuild", "verify"])
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    with engine.begin() as conn:
+        result = rebuild(conn, batch_size=args.batch_size, dry_run=args.command == "verify")
+    print(
+        f"{result['threads']} threads: {result['missing']} missing, "
+        f"{result['stale']} stale, {result['orphaned']} orphaned"
+        + ("" if args.command == "verify" else " (fixed)")
+    )
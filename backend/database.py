@@ -1,20 +1,75 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from starlette.requests import Request
 import os
 from dotenv import load_dotenv
+from db_pool import pool_options, pool_telemetry
+from replicas import DATABASE_REPLICA_URLS, replica_router, ReplicaReadSession, last_write
+from sqlite_mode import configure_sqlite, sqlite_production, WriteQueuedSession
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+# Async drivers for the same database; override with ASYNC_DATABASE_URL
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def async_database_url(url: str) -> str:
+    """DATABASE_URL with its driver swapped for the async one"""
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()]).render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
+
+# Sync engine: admin panel, migrations, CLIs and background workers
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL))
+configure_sqlite(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine: every API request. Objects stay loaded after commit, since
+# an expired attribute cannot be lazily refreshed on the event loop
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL, is_async=True))
+configure_sqlite(async_engine.sync_engine)
+# SQLite production mode: writing sessions take turns (see sqlite_mode.py)
+session_class = WriteQueuedSession if sqlite_production(ASYNC_DATABASE_URL) else AsyncSession
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=session_class, autoflush=False, expire_on_commit=False)
+
+pool_telemetry.register("sync", engine)
+pool_telemetry.register("async", async_engine.sync_engine)
+
+# Reads of the primary: in SQLite production mode a separate query_only pool,
+# so read-only endpoints never wait for a connection held by a queued writer
+read_engine = async_engine
+if sqlite_production(ASYNC_DATABASE_URL):
+    read_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL, is_async=True))
+    configure_sqlite(read_engine.sync_engine, read_only=True)
+    pool_telemetry.register("async-read", read_engine.sync_engine)
+
+# Read replicas (DATABASE_REPLICA_URLS), used only through get_read_db
+replica_engines = {}
+for number, url in enumerate(DATABASE_REPLICA_URLS, start=1):
+    url = async_database_url(url)
+    replica_engines[f"replica-{number}"] = create_async_engine(url, **pool_options(url, is_async=True))
+    pool_telemetry.register(f"replica-{number}", replica_engines[f"replica-{number}"].sync_engine)
+replica_router.configure(read_engine, replica_engines)
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db(request: Request):
+    async with AsyncSessionLocal() as db:
+        # Commits keep this client's reads on the primary for a while (see replicas.py)
+        db.sync_session.info["client"] = request.headers.get("authorization")
+        db.sync_session.info["request_state"] = request.state
+        yield db
+
+async def get_read_db(request: Request):
+    """Session for safe read-only endpoints: a replica unless the client just wrote"""
+    async with AsyncSessionLocal(
+        bind=replica_router.pick(request.headers.get("authorization"), last_write(request.cookies)),
+        sync_session_class=ReplicaReadSession
+    ) as db:
         yield db
-    finally:
-        db.close()
-        
\ No newline at end of file
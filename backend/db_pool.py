@@ -0,0 +1,231 @@
+"""
+Connection pool settings and telemetry.
+
+Every engine gets the same DB_POOL_* settings and an instrumented pool that
+records how long each checkout waited (a histogram, so connection waits can
+be told apart from slow queries), how many checkouts timed out, and how long
+connections were held. A connection held longer than DB_HOLD_WARNING_SECONDS
+is logged with the request that held it. Gauges come from the pool itself.
+
+Stats are served by GET /internal/db-pool and logged every
+DB_POOL_LOG_INTERVAL seconds (0 disables).
+"""
+import asyncio
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from dotenv import load_dotenv
+from logger import logger
+
+load_dotenv()
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Seconds before a connection is replaced; -1 keeps connections forever
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_HOLD_WARNING_SECONDS = float(os.getenv("DB_HOLD_WARNING_SECONDS", "5"))
+DB_POOL_LOG_INTERVAL = float(os.getenv("DB_POOL_LOG_INTERVAL", "60"))
+
+# Upper bounds (ms) of the checkout wait histogram buckets; the last bucket is open
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# "GET /api/listings" for connections checked out while serving a request
+_request_label: ContextVar = ContextVar("db_pool_request", default=None)
+
+
+class PoolStats:
+    """Counters for one engine's pool"""
+
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self._lock = threading.Lock()
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+        self.long_holds = 0
+        self.hold_max = 0.0
+
+    def observe_wait(self, seconds: float):
+        bucket = bisect_left(WAIT_BUCKETS_MS, seconds * 1000)
+        with self._lock:
+            self.wait_buckets[bucket] += 1
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def observe_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def observe_hold(self, seconds: float, label):
+        with self._lock:
+            self.hold_max = max(self.hold_max, seconds)
+            if seconds <= DB_HOLD_WARNING_SECONDS:
+                return
+            self.long_holds += 1
+        logger.warning(f"DB connection ({self.name}) held for {seconds:.1f}s by {label or 'a background task'}")
+
+    def gauges(self) -> dict:
+        pool = self.engine.pool
+        if not isinstance(pool, QueuePool):
+            return {"pool": type(pool).__name__}
+        return {
+            "pool": type(pool).__name__,
+            "size": pool.size(),
+            "in_use": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,
+        }
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            buckets = list(self.wait_buckets)
+            stats = {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 2),
+                "long_holds": self.long_holds,
+                "hold_max_ms": round(self.hold_max * 1000, 2),
+            }
+        labels = [f"<={bound}ms" for bound in WAIT_BUCKETS_MS] + [f">{WAIT_BUCKETS_MS[-1]}ms"]
+        return {**self.gauges(), **stats, "wait_histogram": dict(zip(labels, buckets))}
+
+
+class _TimedCheckout:
+    """Pool mixin timing connect(): queue wait, new connections and pre-ping"""
+
+    stats = None
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            if self.stats is not None:
+                self.stats.observe_timeout()
+            raise
+        if self.stats is not None:
+            self.stats.observe_wait(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        # Engine.dispose() swaps in a fresh pool; keep counting into the same stats
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options(url: str, is_async: bool = False) -> dict:
+    """create_engine keyword arguments for the DB_POOL_* settings"""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # In-memory databases live in one connection; keep SQLAlchemy's default pool
+        return {}
+    return {
+        "poolclass": InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+class PoolTelemetry:
+    """Registry of instrumented engines"""
+
+    def __init__(self, interval: float = DB_POOL_LOG_INTERVAL):
+        self.interval = interval
+        self.engines = {}
+        self._task = None
+
+    def register(self, name: str, engine) -> PoolStats:
+        """Instrument a (sync) engine; pass async_engine.sync_engine for async ones"""
+        stats = self.engines[name] = PoolStats(name, engine)
+        if isinstance(engine.pool, _TimedCheckout):
+            engine.pool.stats = stats
+
+        @event.listens_for(engine, "checkout")
+        def _checked_out(dbapi_connection, connection_record, connection_proxy):
+            connection_record.info["checked_out_at"] = time.monotonic()
+            connection_record.info["checked_out_by"] = _request_label.get()
+
+        @event.listens_for(engine, "checkin")
+        def _checked_in(dbapi_connection, connection_record):
+            checked_out_at = connection_record.info.pop("checked_out_at", None)
+            if checked_out_at is not None:
+                stats.observe_hold(time.monotonic() - checked_out_at, connection_record.info.pop("checked_out_by", None))
+
+        return stats
+
+    def stats(self) -> dict:
+        return {name: stats.snapshot() for name, stats in self.engines.items()}
+
+    def log_stats(self):
+        for name, stats in self.engines.items():
+            snapshot = stats.snapshot()
+            logger.info(
+                f"DB pool {name}: {snapshot.get('in_use', '-')} in use, {snapshot.get('idle', '-')} idle, "
+                f"{snapshot.get('overflow', '-')} overflow, {snapshot['checkouts']} checkouts "
+                f"(avg wait {snapshot['wait_avg_ms']} ms, max {snapshot['wait_max_ms']} ms), "
+                f"{snapshot['timeouts']} timeouts, {snapshot['long_holds']} long holds"
+            )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.log_stats()
+
+    def start(self):
+        """Start periodic logging on the running event loop"""
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+pool_telemetry = PoolTelemetry()
+
+
+class PoolTelemetryMiddleware:
+    """Labels connections checked out during a request with its method and path"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        token = _request_label.set(f"{scope.get('method', 'WS')} {scope['path']}")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_label.reset(token)
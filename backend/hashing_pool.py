@@ -0,0 +1,81 @@
+"""
+Dedicated executor for bcrypt.
+
+Password hashing is CPU-bound and deliberately slow, so it gets its own
+HASH_WORKERS threads (bcrypt releases the GIL) instead of sharing the
+threadpool that serves every sync endpoint. At most HASH_QUEUE_LIMIT jobs
+wait behind the running ones; past that, callers get an immediate 503 with
+Retry-After rather than queueing until they time out.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, status
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", str(HASH_WORKERS * 8)))
+
+
+class HashingPool:
+    """Size- and queue-limited executor for password hashing"""
+
+    def __init__(self, workers: int = HASH_WORKERS, queue_limit: int = HASH_QUEUE_LIMIT):
+        self._lock = threading.Lock()
+        self._executor = None
+        self.configure(workers, queue_limit)
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def configure(self, workers: int, queue_limit: int):
+        """Replace the executor (running jobs finish on the old one)"""
+        old = self._executor
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        if old is not None:
+            old.shutdown(wait=False)
+
+    def _acquire(self):
+        with self._lock:
+            if self.in_flight >= self.workers + self.queue_limit:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Too many sign-in requests right now, please retry",
+                    headers={"Retry-After": "1"}
+                )
+            self.in_flight += 1
+
+    def _release(self, future):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+
+    def submit(self, fn, *args):
+        """Queue a job; raises 503 when the queue is full"""
+        self._acquire()
+        future = self._executor.submit(fn, *args)
+        # Released when the job finishes, even if the caller gave up waiting
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+
+hashing_pool = HashingPool()
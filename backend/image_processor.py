@@ -0,0 +1,258 @@
+"""
+Background generation of photo variants (thumb/card/full).
+
+New Photo rows are picked up when their transaction commits and rendered on
+a bounded process pool (IMAGE_WORKERS processes, at most IMAGE_QUEUE_SIZE
+photos queued); the resulting URLs are stored in photos.variants. Photos
+sharing a content hash share variants, so duplicates are rendered once, and
+a duplicate uploaded while its file is rendering waits for that render.
+Photos that were skipped (queue full, server stopped) keep variants = NULL
+and are handled by the backfill:
+
+    python image_processor.py backfill [--workers N] [--batch-size N] [--force]
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from importlib.util import find_spec
+from sqlalchemy import event, update, select
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+import models
+from cache import response_cache
+from storage import UPLOAD_DIR, upload_url, source_path, remove_files
+from thumbnails import render_variants
+from logger import logger
+
+load_dotenv()
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_QUEUE_SIZE = int(os.getenv("IMAGE_QUEUE_SIZE", "100"))
+
+photos_table = models.Photo.__table__
+
+
+def variant_urls(written: dict) -> dict:
+    return {
+        variant: {extension: upload_url(filename) for extension, filename in files.items()}
+        for variant, files in written.items()
+    }
+
+
+def variant_paths(variants) -> list:
+    """Files on disk behind a photo's variants"""
+    return [
+        source_path(url)
+        for files in (variants or {}).values()
+        for url in files.values()
+    ]
+
+
+def _same_file(photo_id: int, url: str, content_hash):
+    """Every photo backed by the same stored file"""
+    if content_hash:
+        return photos_table.c.content_hash == content_hash
+    return (photos_table.c.photo_id == photo_id) & (photos_table.c.url == url)
+
+
+def known_variants(bind, photo_id: int, url: str, content_hash):
+    """Variants already rendered for the same file, if any"""
+    with bind.connect() as conn:
+        return conn.execute(
+            select(photos_table.c.variants)
+            .where(_same_file(photo_id, url, content_hash), photos_table.c.variants.isnot(None))
+            .limit(1)
+        ).scalar()
+
+
+def record_variants(bind, photo_id: int, url: str, content_hash, variants: dict) -> bool:
+    """Store variants on every photo of the file; cleans up if none is left"""
+    with bind.begin() as conn:
+        listing_ids = conn.execute(
+            update(photos_table)
+            .where(_same_file(photo_id, url, content_hash))
+            .values(variants=variants)
+            .returning(photos_table.c.listing_id)
+        ).scalars().all()
+    if not listing_ids:
+        # Deleted or replaced while rendering
+        remove_files(variant_paths(variants))
+        return False
+    response_cache.invalidate("feed", *(f"listing:{listing_id}" for listing_id in set(listing_ids)))
+    return True
+
+
+def _create_pool(workers: int) -> ProcessPoolExecutor:
+    # spawn: forking a server process with live threads and connections is unsafe
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+class ImageProcessor:
+    """Renders variants for newly committed photos on a process pool"""
+
+    def __init__(self, workers: int = IMAGE_WORKERS, queue_size: int = IMAGE_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._pool = None
+        self._loop = None
+        self._tasks = set()
+        self._jobs = {}  # content hash (or url) -> task rendering and recording that file
+        self.processed = 0
+        self.shared = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def start(self, loop):
+        if find_spec("PIL") is None:
+            logger.warning("Pillow is not installed; photo variants are disabled")
+            return
+        self._loop = loop
+        self._pool = _create_pool(self.workers)
+
+    async def stop(self, timeout: float = 10):
+        """Let queued photos finish for up to `timeout` seconds, then shut the pool down"""
+        self._loop = None
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def submit(self, photo_id: int, url: str, content_hash=None):
+        """Queue a photo for rendering (safe to call from any thread)"""
+        loop = self._loop
+        if loop is not None and source_path(url):
+            loop.call_soon_threadsafe(self._enqueue, photo_id, url, content_hash)
+
+    def _enqueue(self, photo_id, url, content_hash):
+        if self._pool is None:
+            return
+        if len(self._tasks) >= self.queue_size:
+            # Left with variants = NULL for the backfill
+            self.skipped += 1
+            logger.warning(f"Image queue full, skipping variants for photo {photo_id}")
+            return
+        task = asyncio.create_task(self._process(photo_id, url, content_hash))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, photo_id, url, content_hash):
+        from database import engine
+
+        key = content_hash or url
+        try:
+            job = self._jobs.get(key)
+            if job is None:
+                job = self._jobs[key] = asyncio.ensure_future(self._render(engine, photo_id, url, content_hash))
+                job.add_done_callback(lambda _: self._jobs.pop(key, None))
+                await job
+            else:
+                # The same file is already rendering for another photo; its
+                # UPDATE may have run before this photo committed, so record again
+                variants = await asyncio.shield(job)
+                await asyncio.to_thread(record_variants, engine, photo_id, url, content_hash, variants)
+                self.shared += 1
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Rendering variants for photo {photo_id} failed: {e}")
+
+    async def _render(self, engine, photo_id, url, content_hash) -> dict:
+        """Variant URLs of one file, rendered unless a photo sharing it has them"""
+        variants = await asyncio.to_thread(known_variants, engine, photo_id, url, content_hash)
+        if variants is None:
+            loop = asyncio.get_running_loop()
+            written = await loop.run_in_executor(self._pool, render_variants, source_path(url), UPLOAD_DIR)
+            variants = variant_urls(written)
+        await asyncio.to_thread(record_variants, engine, photo_id, url, content_hash, variants)
+        return variants
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": len(self._tasks),
+            "processed": self.processed,
+            "shared": self.shared,
+            "failed": self.failed,
+            "skipped": self.skipped,
+        }
+
+
+image_processor = ImageProcessor()
+
+
+# ============== Pick up new photos on commit ==============
+
+@event.listens_for(Session, "after_flush")
+def _collect_photos(session, flush_context):
+    photos = session.info.setdefault("new_photos", {})
+    for obj in session.new:
+        if isinstance(obj, models.Photo) and obj.variants is None:
+            photos[obj.photo_id] = (obj.url, obj.content_hash)
+
+
+@event.listens_for(Session, "after_commit")
+def _submit_committed(session):
+    for photo_id, (url, content_hash) in session.info.pop("new_photos", {}).items():
+        image_processor.submit(photo_id, url, content_hash)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_photos(session):
+    session.info.pop("new_photos", None)
+
+
+# ============== Backfill ==============
+
+def backfill(bind, workers: int = IMAGE_WORKERS, batch_size: int = 100, force: bool = False) -> dict:
+    """Render variants for every photo that has none (all photos with force)"""
+    report = {"processed": 0, "failed": 0, "missing": 0}
+    last_id = 0
+    with _create_pool(workers) as pool:
+        while True:
+            query = select(
+                photos_table.c.photo_id, photos_table.c.url, photos_table.c.content_hash
+            ).where(
+                photos_table.c.photo_id > last_id,
+                photos_table.c.url.like("/uploads/%")
+            )
+            if not force:
+                query = query.where(photos_table.c.variants.is_(None))
+            with bind.connect() as conn:
+                rows = conn.execute(query.order_by(photos_table.c.photo_id).limit(batch_size)).all()
+            if not rows:
+                return report
+            last_id = rows[-1].photo_id
+
+            # One render per file; record_variants fills in every photo sharing it
+            jobs = {}
+            for row in rows:
+                path = source_path(row.url)
+                if not os.path.exists(path):
+                    report["missing"] += 1
+                    continue
+                if row.url not in jobs:
+                    jobs[row.url] = (row, pool.submit(render_variants, path, UPLOAD_DIR))
+            for row, future in jobs.values():
+                try:
+                    record_variants(bind, row.photo_id, row.url, row.content_hash, variant_urls(future.result()))
+                    report["processed"] += 1
+                except Exception as e:
+                    report["failed"] += 1
+                    logger.error(f"Rendering variants for photo {row.photo_id} failed: {e}")
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Generate photo variants")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--workers", type=int, default=IMAGE_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--force", action="store_true", help="Re-render photos that already have variants")
+    args = parser.parse_args()
+
+    result = backfill(engine, workers=args.workers, batch_size=args.batch_size, force=args.force)
+    print(f"{result['processed']} files processed, {result['failed']} failed, {result['missing']} missing files")
@@ -0,0 +1,61 @@
+"""
+Eager-loading strategies, declared once per response shape.
+
+Routers returning ORM objects for a nested response schema must load them
+with the matching options here: on the async session, a relationship left
+unloaded cannot be lazily fetched during serialization and fails instead.
+The load_* helpers run after a commit and refresh rows already in the
+session, as sessions no longer expire them on commit.
+"""
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload
+import models
+
+
+def listing_options():
+    """Options for schemas.ListingResponse (seller, category, photos)"""
+    return [
+        # many-to-one: joined into the main SELECT, no row multiplication
+        joinedload(models.Listing.seller),
+        joinedload(models.Listing.category),
+        # one-to-many: one extra SELECT ... WHERE listing_id IN (...)
+        selectinload(models.Listing.photos),
+    ]
+
+
+def favorite_options():
+    """Options for schemas.FavoriteResponse (a full ListingResponse per row)"""
+    return [
+        selectinload(models.Favorite.listing).options(*listing_options()),
+    ]
+
+
+def message_options():
+    """Options for schemas.MessageResponse (sender)"""
+    return [
+        joinedload(models.Message.sender),
+    ]
+
+
+async def load_listing(db, listing_id: int):
+    """Load a single listing ready for ListingResponse"""
+    return (await db.execute(
+        select(models.Listing).options(*listing_options()).where(models.Listing.listing_id == listing_id)
+        .execution_options(populate_existing=True)
+    )).scalars().first()
+
+
+async def load_favorite(db, favorite_id: int):
+    """Load a single favorite ready for FavoriteResponse"""
+    return (await db.execute(
+        select(models.Favorite).options(*favorite_options()).where(models.Favorite.favorite_id == favorite_id)
+        .execution_options(populate_existing=True)
+    )).scalars().first()
+
+
+async def load_message(db, message_id: int):
+    """Load a single message ready for MessageResponse"""
+    return (await db.execute(
+        select(models.Message).options(*message_options()).where(models.Message.message_id == message_id)
+        .execution_options(populate_existing=True)
+    )).scalars().first()
@@ -1,33 +1,143 @@
-
+import atexit
+import copy
+import json
 import logging
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+import threading
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 import os
+from dotenv import load_dotenv
+
+load_dotenv()
 
 # Create logs directory
 LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
 os.makedirs(LOG_DIR, exist_ok=True)
 LOG_FILE = os.path.join(LOG_DIR, "app.log")
 
+# "text" (default) or "json" (one object per line)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# Records waiting for the writer thread; when full, new records are dropped and counted
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Set per request by access_log.AccessLogMiddleware: an object with
+# request_id and route, copied onto every record logged while serving it
+log_context: ContextVar = ContextVar("log_context", default=None)
+
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, with request context and any `extra` fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _RequestContextFilter(logging.Filter):
+    """Adds request_id and route while the record is still on the request's context"""
+
+    def filter(self, record):
+        context = log_context.get()
+        if context is not None:
+            record.request_id = context.request_id
+            record.route = context.route
+        return True
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: records that do not fit in the queue are counted and dropped"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self._drop_lock = threading.Lock()
+        self.dropped = {}
+
+    def prepare(self, record):
+        # Render the message and traceback here, where args and exc_info are
+        # still valid; formatting itself happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped[record.levelname] = self.dropped.get(record.levelname, 0) + 1
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # The queue may be full at exit; wait for room instead of losing the stop signal
+        self.queue.put(self._sentinel)
+
+
+def _formatter():
+    if LOG_FORMAT == "json":
+        return JSONFormatter()
+    return logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+# File Handler
+_file_handler = RotatingFileHandler(LOG_FILE, maxBytes=10*1024*1024, backupCount=5, encoding='utf-8')
+_file_handler.setFormatter(_formatter())
+
+# Console Handler
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setFormatter(_formatter())
+
+# Callers only enqueue; file writes and rotation happen on the listener's thread
+_queue_handler = _DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+_queue_handler.addFilter(_RequestContextFilter())
+_listener = _Listener(_queue_handler.queue, _file_handler, _console_handler, respect_handler_level=True)
+_listener.start()
+# Write out whatever is still queued when the process exits
+atexit.register(_listener.stop)
+
+
 def get_logger(name):
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
-    
+
     # Check if handlers already exist to avoid duplicate logs
     if not logger.handlers:
-        # File Handler
-        file_handler = RotatingFileHandler(LOG_FILE, maxBytes=10*1024*1024, backupCount=5, encoding='utf-8')
-        file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
-        
-        # Console Handler
-        console_handler = logging.StreamHandler(sys.stdout)
-        console_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        console_handler.setFormatter(console_formatter)
-        logger.addHandler(console_handler)
-    
+        logger.addHandler(_queue_handler)
+        # Child loggers (e.g. marketplace.access) must not reach the queue twice
+        logger.propagate = False
+
     return logger
 
+
+def log_stats() -> dict:
+    """Queue depth and records dropped because the queue was full"""
+    with _queue_handler._drop_lock:
+        dropped = dict(_queue_handler.dropped)
+    return {
+        "format": LOG_FORMAT,
+        "queue_size": LOG_QUEUE_SIZE,
+        "queued": _queue_handler.queue.qsize(),
+        "dropped": dropped,
+    }
+
 # Create main application logger
 logger = get_logger("marketplace")
@@ -1,15 +1,32 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Depends, HTTPException, Response
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
-from routers import auth, listings, categories, messages, favorites, photos
-from database import engine
+from routers import auth, listings, categories, messages, favorites, photos, realtime
+from database import engine, async_engine, read_engine, replica_engines
 from admin import setup_admin
+from query_budget import setup_query_budget
+from view_counter import view_counter
+from realtime import broker
+from cache import response_cache
+from storage import UPLOAD_DIR, UploadSizeLimitMiddleware, usage_report
+from image_processor import image_processor
+from media import MediaFiles
+from auth_utils import get_current_active_admin
+from auth_cache import auth_cache
+from hashing_pool import hashing_pool
+from db_pool import pool_telemetry, PoolTelemetryMiddleware
+from replicas import replica_router, ReadYourWritesMiddleware
+from sqlite_mode import sqlite_writer
+from sql_metrics import setup_sql_metrics, sql_metrics, SQL_METRICS_TOP
+from access_log import AccessLogMiddleware
+from profiler import PROFILER_ENABLED, ProfilerMiddleware, profiler
+from logger import log_stats
+from metrics import METRICS_TOKEN, CONTENT_TYPE_LATEST, MetricsMiddleware, runtime_sampler, render_metrics
 import models
-import os
-
-# Create all tables
-models.Base.metadata.create_all(bind=engine)
+import migrations
+import asyncio
+import hmac
 
 app = FastAPI(
     title="Student Marketplace API",
@@ -25,6 +42,12 @@ app.add_middleware(
     max_age=3600
 )
 
+@app.on_event("startup")
+def check_migrations():
+    # Schema changes are applied by `python -m migrations upgrade`, not here
+    migrations.warn_if_pending(engine)
+
+
 @app.on_event("startup")
 async def startup_event():
     # log all routes
@@ -32,6 +55,79 @@ async def startup_event():
         print(f"DEBUG: Found route: {route.path}")
 
 
+@app.on_event("startup")
+async def start_view_counter():
+    view_counter.start()
+
+
+@app.on_event("shutdown")
+async def flush_view_counter():
+    await view_counter.stop()
+
+
+@app.on_event("startup")
+async def start_realtime_broker():
+    broker.start(asyncio.get_running_loop())
+
+
+@app.on_event("shutdown")
+def stop_realtime_broker():
+    broker.stop()
+
+
+@app.on_event("startup")
+async def start_image_processor():
+    image_processor.start(asyncio.get_running_loop())
+
+
+@app.on_event("shutdown")
+async def stop_image_processor():
+    await image_processor.stop()
+
+
+@app.on_event("startup")
+async def start_pool_telemetry():
+    pool_telemetry.start()
+
+
+@app.on_event("shutdown")
+async def stop_pool_telemetry():
+    await pool_telemetry.stop()
+
+
+@app.on_event("startup")
+async def start_replica_checks():
+    replica_router.start()
+
+
+@app.on_event("shutdown")
+async def stop_replica_checks():
+    await replica_router.stop()
+
+
+@app.on_event("startup")
+async def start_runtime_sampler():
+    runtime_sampler.start()
+
+
+@app.on_event("shutdown")
+async def stop_runtime_sampler():
+    await runtime_sampler.stop()
+
+
+@app.on_event("startup")
+async def start_sqlite_writer():
+    sqlite_writer.start()
+
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await async_engine.dispose()
+    await read_engine.dispose()
+    for replica in replica_engines.values():
+        await replica.dispose()
+
+
 # CORS Configuration
 app.add_middleware(
     CORSMiddleware,
@@ -50,10 +146,41 @@ app.add_middleware(
     max_age=600,
 )
 
-# Create uploads directory and mount static files
-UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+# Reject oversized photo uploads while the body is still arriving
+app.add_middleware(UploadSizeLimitMiddleware, path_prefix="/api/photos")
+
+# Uploaded files: cache headers, ranges, sendfile or proxy offload (MEDIA_SERVING)
+app.mount("/uploads", MediaFiles(directory=UPLOAD_DIR), name="uploads")
+
+# Name the request holding each DB connection in pool warnings
+app.add_middleware(PoolTelemetryMiddleware)
+
+# Last-write cookie that keeps a client reading the primary after it writes (see replicas.py)
+app.add_middleware(ReadYourWritesMiddleware)
+
+# Per-endpoint query budgets (QUERY_BUDGET_MODE=warn|raise)
+setup_query_budget(
+    app, engine, async_engine.sync_engine, read_engine.sync_engine,
+    *(replica.sync_engine for replica in replica_engines.values())
+)
+
+# Statements, DB time and rows per request: Server-Timing, slow query log, /internal/sql
+setup_sql_metrics(
+    app, engine, async_engine.sync_engine, read_engine.sync_engine,
+    *(replica.sync_engine for replica in replica_engines.values())
+)
+
+# Sampled or admin-requested (X-Profile: 1) request profiles, see /internal/profiles
+if PROFILER_ENABLED:
+    app.add_middleware(ProfilerMiddleware)
+
+# Request counts, latency and in-flight requests for /metrics. The last-added
+# middleware runs outermost, so this times the app and every middleware added
+# above; only the access log below runs outside it
+app.add_middleware(MetricsMiddleware)
+
+# Request ids and sampled access lines (outside metrics, so both see the same request)
+app.add_middleware(AccessLogMiddleware)
 
 # Setup Admin Panel - access at /admin
 setup_admin(app, engine)
@@ -65,6 +192,7 @@ app.include_router(categories.router, prefix="/api/categories", tags=["Categorie
 app.include_router(messages.router, prefix="/api/messages", tags=["Messages"])
 app.include_router(favorites.router, prefix="/api/favorites", tags=["Favorites"])
 app.include_router(photos.router, prefix="/api/photos", tags=["Photos"])
+app.include_router(realtime.router, prefix="/api/realtime", tags=["Realtime"])
 
 
 @app.get("/")
@@ -88,6 +216,102 @@ def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics", tags=["Internal"])
+def prometheus_metrics(request: Request):
+    """Prometheus metrics for all workers (Bearer METRICS_TOKEN; off when it is unset)"""
+    # Route names and pool state are not for the public: no token, no endpoint
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    # As a header: media_type would get a second charset appended
+    return Response(render_metrics(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+@app.get("/internal/cache", tags=["Internal"])
+def cache_stats(current_user: models.User = Depends(get_current_active_admin)):
+    """Response cache hit/miss/eviction counters (admin only)"""
+    return response_cache.stats()
+
+
+@app.get("/internal/db-pool", tags=["Internal"])
+def db_pool_stats(current_user: models.User = Depends(get_current_active_admin)):
+    """Connection pool gauges, checkout wait histogram and timeouts per engine (admin only)"""
+    return pool_telemetry.stats()
+
+
+@app.get("/internal/sql", tags=["Internal"])
+def sql_stats(top: int = SQL_METRICS_TOP, current_user: models.User = Depends(get_current_active_admin)):
+    """Per-route query counts, DB time and top statements (admin only)"""
+    return sql_metrics.stats(top)
+
+
+@app.get("/internal/logging", tags=["Internal"])
+def logging_stats(current_user: models.User = Depends(get_current_active_admin)):
+    """Log queue depth and records dropped because it was full (admin only)"""
+    return log_stats()
+
+
+@app.get("/internal/profiles", tags=["Internal"])
+def profile_list(current_user: models.User = Depends(get_current_active_admin)):
+    """Recent request profiles, newest first (admin only)"""
+    return profiler.stats()
+
+
+@app.get("/internal/profiles/{profile_id}", tags=["Internal"])
+def profile_download(profile_id: str, current_user: models.User = Depends(get_current_active_admin)):
+    """Collapsed stacks of one profile, for flamegraph.pl, inferno or speedscope (admin only)"""
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(
+        profile.folded(),
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"'}
+    )
+
+
+@app.get("/internal/replicas", tags=["Internal"])
+def replica_stats(current_user: models.User = Depends(get_current_active_admin)):
+    """Read replica health, lag and routed reads (admin only)"""
+    return replica_router.stats()
+
+
+@app.get("/internal/sqlite", tags=["Internal"])
+def sqlite_stats(current_user: models.User = Depends(get_current_active_admin)):
+    """SQLite write queue counters and pragmas (admin only)"""
+    return sqlite_writer.stats()
+
+
+@app.get("/internal/realtime", tags=["Internal"])
+def realtime_stats(current_user: models.User = Depends(get_current_active_admin)):
+    """Realtime broker connection and delivery counters (admin only)"""
+    return broker.stats()
+
+
+@app.get("/internal/auth-cache", tags=["Internal"])
+def auth_cache_stats(current_user: models.User = Depends(get_current_active_admin)):
+    """Token/user cache counters and user lookups saved (admin only)"""
+    return auth_cache.stats()
+
+
+@app.get("/internal/hashing", tags=["Internal"])
+def hashing_stats(current_user: models.User = Depends(get_current_active_admin)):
+    """bcrypt pool size, backlog and rejections (admin only)"""
+    return hashing_pool.stats()
+
+
+@app.get("/internal/images", tags=["Internal"])
+def image_stats(current_user: models.User = Depends(get_current_active_admin)):
+    """Photo variant rendering counters (admin only)"""
+    return image_processor.stats()
+
+
+@app.get("/internal/storage", tags=["Internal"])
+def storage_stats(current_user: models.User = Depends(get_current_active_admin)):
+    """Upload storage used and saved by deduplication (admin only)"""
+    return usage_report(engine)
+
+
 # Seed default categories on startup
 @app.on_event("startup")
 def seed_categories():
@@ -0,0 +1,208 @@
+"""
+Serving of uploaded media from /uploads.
+
+Content-addressed files (see storage.py) never change under their name, so
+they and their variants are served as immutable for a year; legacy upload
+names get a shorter max-age. Every response carries a strong ETag (the
+SHA-256 for content-addressed originals), answers If-None-Match with 304
+and supports single byte ranges.
+
+MEDIA_SERVING picks who sends the bytes:
+    app              - this process, via the ASGI zero-copy sendfile extension
+                       when the server offers it, else in threadpool chunks
+    x-accel-redirect - nginx, from an internal location at MEDIA_ACCEL_PREFIX
+    x-sendfile       - Apache/lighttpd mod_xsendfile, by absolute path
+"""
+import mimetypes
+import os
+import re
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+import anyio
+from fastapi.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MEDIA_SERVING = os.getenv("MEDIA_SERVING", "app").lower()
+MEDIA_ACCEL_PREFIX = os.getenv("MEDIA_ACCEL_PREFIX", "/_protected_uploads/")
+MEDIA_MAX_AGE = int(os.getenv("MEDIA_MAX_AGE", "86400"))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+CHUNK_SIZE = 256 * 1024
+ZERO_COPY = "http.response.zerocopysend"
+
+# "<sha256>.<ext>" or "<sha256>.<variant>.<ext>"
+CONTENT_ADDRESSED = re.compile(r"^([0-9a-f]{64})(\.[a-z]+)?\.[a-z0-9]+$")
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def cache_control(filename: str) -> str:
+    if CONTENT_ADDRESSED.match(filename):
+        return IMMUTABLE_CACHE_CONTROL
+    return f"public, max-age={MEDIA_MAX_AGE}"
+
+
+def strong_etag(filename: str, stat_result) -> str:
+    match = CONTENT_ADDRESSED.match(filename)
+    if match and match.group(2) is None:
+        # An original's name is the hash of its bytes
+        return f'"{match.group(1)}"'
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match uses weak comparison"""
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def parse_range(header: str, size: int):
+    """
+    (start, end) for a single satisfiable "bytes=" range, None to ignore the
+    header (malformed or multi-range), or "unsatisfiable".
+    """
+    match = RANGE.match(header.strip())
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return "unsatisfiable"
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return "unsatisfiable"
+    return start, end
+
+
+class MediaFiles:
+    """ASGI app serving one flat upload directory"""
+
+    def __init__(self, directory: str, mode: str = MEDIA_SERVING, accel_prefix: str = MEDIA_ACCEL_PREFIX):
+        self.directory = os.path.abspath(directory)
+        self.mode = mode
+        self.accel_prefix = accel_prefix.rstrip("/") + "/"
+
+    async def __call__(self, scope, receive, send):
+        assert scope["type"] == "http"
+        method = scope["method"]
+        if method not in ("GET", "HEAD"):
+            await self._send_empty(send, 405, [(b"allow", b"GET, HEAD")])
+            return
+
+        relative = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and relative.startswith(root_path + "/"):
+            relative = relative[len(root_path):]
+        filename = relative.lstrip("/")
+        # Flat directory: no subpaths, no hidden temp files
+        if not filename or "/" in filename or "\\" in filename or filename.startswith("."):
+            await self._send_empty(send, 404)
+            return
+        path = os.path.join(self.directory, filename)
+        try:
+            stat_result = await run_in_threadpool(os.stat, path)
+        except (FileNotFoundError, NotADirectoryError):
+            stat_result = None
+        if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+            await self._send_empty(send, 404)
+            return
+
+        request_headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        etag = strong_etag(filename, stat_result)
+        headers = {
+            "etag": etag,
+            "cache-control": cache_control(filename),
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "accept-ranges": "bytes",
+        }
+
+        if self._not_modified(request_headers, etag, stat_result):
+            await self._send_empty(send, 304, self._encode(headers))
+            return
+
+        size = stat_result.st_size
+        headers["content-type"] = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+        if self.mode == "x-accel-redirect":
+            # nginx handles ranges and conditional requests from here on
+            headers["x-accel-redirect"] = self.accel_prefix + filename
+            await self._send_empty(send, 200, self._encode(headers))
+            return
+        if self.mode == "x-sendfile":
+            headers["x-sendfile"] = path
+            await self._send_empty(send, 200, self._encode(headers))
+            return
+
+        status_code, start, end = 200, 0, size - 1
+        range_header = request_headers.get("range")
+        if range_header and self._if_range_matches(request_headers, etag):
+            byte_range = parse_range(range_header, size)
+            if byte_range == "unsatisfiable":
+                headers["content-range"] = f"bytes */{size}"
+                await self._send_empty(send, 416, self._encode(headers))
+                return
+            if byte_range is not None:
+                status_code, (start, end) = 206, byte_range
+                headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+        count = end - start + 1 if size else 0
+        headers["content-length"] = str(count)
+        await send({"type": "http.response.start", "status": status_code, "headers": self._encode(headers)})
+        if method == "HEAD" or count == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await self._send_file(scope, send, path, start, count)
+
+    def _not_modified(self, request_headers: dict, etag: str, stat_result) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, etag)
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(stat_result.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _if_range_matches(self, request_headers: dict, etag: str) -> bool:
+        """A Range only applies if If-Range (when sent) still names this version"""
+        if_range = request_headers.get("if-range")
+        return if_range is None or if_range.strip() == etag
+
+    async def _send_file(self, scope, send, path: str, start: int, count: int):
+        if ZERO_COPY in scope.get("extensions", {}):
+            with open(path, "rb") as file:
+                await send({"type": ZERO_COPY, "file": file, "offset": start, "count": count, "more_body": False})
+            return
+        async with await anyio.open_file(path, "rb") as file:
+            await file.seek(start)
+            remaining = count
+            while remaining:
+                chunk = await file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining:
+                # File shrank under us; end the response anyway
+                await send({"type": "http.response.body", "body": b""})
+
+    @staticmethod
+    def _encode(headers: dict) -> list:
+        return [(key.encode("latin-1"), value.encode("latin-1")) for key, value in headers.items()]
+
+    @staticmethod
+    async def _send_empty(send, status_code: int, headers: list = None):
+        headers = list(headers or [])
+        if status_code != 304 and not any(key == b"content-length" for key, _ in headers):
+            headers.append((b"content-length", b"0"))
+        await send({"type": "http.response.start", "status": status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
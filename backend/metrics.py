@@ -0,0 +1,145 @@
+"""
+Prometheus metrics.
+
+Per-route request counts by status, latency histograms, in-flight requests,
+threadpool utilization and event-loop lag, served in the Prometheus text
+format at GET /metrics.
+
+Each uvicorn worker records into its own series; with
+PROMETHEUS_MULTIPROC_DIR pointing at an empty directory (cleared on each
+deploy) the workers write them to per-process files and a scrape of any
+worker adds them up. Recording a request only updates the series for its
+(method, route, status), looked up in a per-worker dict, so there are no
+shared locks or allocations beyond the first request of each route.
+
+/metrics requires "Authorization: Bearer <METRICS_TOKEN>" and answers 404
+while METRICS_TOKEN is unset, so it is never open by default.
+"""
+import asyncio
+import os
+import time
+import anyio.to_thread
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from dotenv import load_dotenv
+from sql_metrics import route_path
+
+load_dotenv()
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Seconds between event-loop lag and threadpool samples
+METRICS_SAMPLE_INTERVAL = float(os.getenv("METRICS_SAMPLE_INTERVAL", "0.5"))
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status", ["method", "route", "status"]
+)
+LATENCY = Histogram(
+    "http_request_duration_seconds", "Time to serve a request, by route", ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests being served", multiprocess_mode="livesum"
+)
+THREADPOOL_BUSY = Gauge(
+    "threadpool_busy_threads", "Threads running sync endpoints and to_thread calls", multiprocess_mode="livesum"
+)
+THREADPOOL_SIZE = Gauge(
+    "threadpool_max_threads", "Threadpool capacity", multiprocess_mode="livesum"
+)
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+LOOP_LAG_LAST = Gauge(
+    "event_loop_lag_last_seconds", "Most recent event loop lag sample", multiprocess_mode="livemax"
+)
+
+
+class MetricsMiddleware:
+    """Records count, status and latency of every HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+        self._series = {}  # (method, route, status) -> (counter child, histogram child)
+
+    def _observe(self, method: str, route: str, status: int, seconds: float):
+        key = (method, route, status)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = (
+                REQUESTS.labels(method, route, str(status)),
+                LATENCY.labels(method, route),
+            )
+        series[0].inc()
+        series[1].observe(seconds)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            IN_FLIGHT.dec()
+            self._observe(scope["method"], route_path(scope), status, time.perf_counter() - started)
+
+
+class RuntimeSampler:
+    """Samples event-loop lag and threadpool use on the running loop"""
+
+    def __init__(self, interval: float = METRICS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - started - self.interval, 0.0)
+            LOOP_LAG.observe(lag)
+            LOOP_LAG_LAST.set(lag)
+            THREADPOOL_BUSY.set(limiter.borrowed_tokens)
+            THREADPOOL_SIZE.set(limiter.total_tokens)
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if MULTIPROCESS:
+            # Drop this worker's live gauges from the aggregate
+            multiprocess.mark_process_dead(os.getpid())
+
+
+runtime_sampler = RuntimeSampler()
+
+
+def render_metrics() -> bytes:
+    """All workers' metrics in the Prometheus text format"""
+    if not MULTIPROCESS:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
@@ -0,0 +1,156 @@
+"""
+Versioned schema migrations.
+
+Each module in migrations/versions/ is named <version>_<name>.py and defines
+`upgrade(conn)`. Applied versions are recorded in the schema_migrations
+table. Modules with TRANSACTIONAL = False run on an autocommit connection
+(needed for CREATE INDEX CONCURRENTLY on Postgres).
+
+Versions are frozen: they spell out their own tables, columns, indexes and
+SQL instead of importing models.py or other app modules, so replaying them
+on a fresh database builds the same schema whatever models.py says today.
+
+Usage (from backend/):
+    python -m migrations upgrade   # apply pending migrations
+    python -m migrations status    # list applied / pending versions
+    python -m migrations check     # compare DB indexes against models.py
+"""
+import importlib
+import os
+from sqlalchemy import MetaData, Table, Column, String, DateTime, func, inspect, text
+from logger import logger
+
+VERSIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "versions")
+
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _metadata,
+    Column("version", String(32), primary_key=True),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+)
+
+
+def discover():
+    """Return [(version, module name)] for all migrations, in order"""
+    found = []
+    for filename in sorted(os.listdir(VERSIONS_DIR)):
+        if filename.endswith(".py") and filename[0].isdigit():
+            module = filename[:-3]
+            found.append((module.split("_", 1)[0], module))
+    return found
+
+
+def applied_versions(engine) -> set:
+    """Versions already recorded in schema_migrations"""
+    if not inspect(engine).has_table("schema_migrations"):
+        return set()
+    with engine.connect() as conn:
+        return set(conn.execute(schema_migrations.select().with_only_columns(schema_migrations.c.version)).scalars())
+
+
+def pending(engine):
+    """Migrations not applied yet, in order"""
+    applied = applied_versions(engine)
+    return [(version, module) for version, module in discover() if version not in applied]
+
+
+def upgrade(engine):
+    """Apply every pending migration"""
+    _metadata.create_all(engine)
+    for version, module_name in pending(engine):
+        module = importlib.import_module(f"migrations.versions.{module_name}")
+        logger.info(f"Applying migration {module_name}")
+        if getattr(module, "TRANSACTIONAL", True):
+            with engine.begin() as conn:
+                module.upgrade(conn)
+                conn.execute(schema_migrations.insert().values(version=version))
+        else:
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                module.upgrade(conn)
+                conn.execute(schema_migrations.insert().values(version=version))
+
+
+def warn_if_pending(engine):
+    """Log (instead of applying) pending migrations at startup"""
+    todo = pending(engine)
+    if todo:
+        logger.warning(
+            f"{len(todo)} pending migration(s): {', '.join(m for _, m in todo)} - "
+            "run `python -m migrations upgrade`"
+        )
+    return todo
+
+
+# ============== Helpers for migration modules ==============
+
+def drop_invalid_index(conn, name: str):
+    """
+    Drop an index that an interrupted CREATE INDEX CONCURRENTLY left INVALID
+    (Postgres), which IF NOT EXISTS would otherwise skip forever
+    """
+    if conn.dialect.name != "postgresql":
+        return
+    invalid = conn.execute(text(
+        "SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+    ), {"name": name}).scalar()
+    if invalid:
+        logger.warning(f"Index {name} is invalid (interrupted build), rebuilding it")
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+def create_index(conn, name: str, table: str, columns, unique: bool = False):
+    """
+    Create an index if it does not exist (or rebuild it if it is invalid).
+
+    Uses CREATE INDEX CONCURRENTLY on Postgres, so the calling migration
+    must set TRANSACTIONAL = False.
+    """
+    drop_invalid_index(conn, name)
+    concurrently = "CONCURRENTLY " if conn.dialect.name == "postgresql" else ""
+    conn.execute(text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX {concurrently}IF NOT EXISTS {name} "
+        f"ON {table} ({', '.join(columns)})"
+    ))
+
+
+def add_column(conn, table_name: str, column):
+    """Add a column to an existing table if it is missing"""
+    existing = {c["name"] for c in inspect(conn).get_columns(table_name)}
+    if column.name in existing:
+        return
+    column_type = column.type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}"))
+
+
+# ============== Index check ==============
+
+def check_indexes(engine, metadata) -> dict:
+    """
+    Compare indexes declared in `metadata` with the database.
+
+    Returns {"missing": [...], "undeclared": [...], "unused": [...]}; unused
+    indexes (never scanned) are only available on Postgres.
+    """
+    inspector = inspect(engine)
+    report = {"missing": [], "undeclared": [], "unused": []}
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            report["missing"].append(f"table {table.name}")
+            continue
+        in_db = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        declared = {ix.name for ix in table.indexes}
+        report["missing"] += sorted(f"{table.name}.{name}" for name in declared - in_db)
+        report["undeclared"] += sorted(f"{table.name}.{name}" for name in in_db - declared)
+
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT s.relname, s.indexrelname FROM pg_stat_user_indexes s "
+                "JOIN pg_index i ON i.indexrelid = s.indexrelid "
+                "WHERE s.idx_scan = 0 AND NOT i.indisunique AND NOT i.indisprimary "
+                "ORDER BY s.relname, s.indexrelname"
+            ))
+            report["unused"] = [f"{table}.{index}" for table, index in rows]
+    return report
@@ -0,0 +1,36 @@
+import argparse
+import sys
+import models
+from database import engine
+from search import SEARCH_INDEXES
+import migrations
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m migrations", description="Schema migrations")
+    parser.add_argument("command", choices=["upgrade", "status", "check"])
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        migrations.upgrade(engine)
+        print("Database is up to date")
+
+    elif args.command == "status":
+        applied = migrations.applied_versions(engine)
+        for version, module in migrations.discover():
+            print(f"[{'x' if version in applied else ' '}] {module}")
+
+    elif args.command == "check":
+        report = migrations.check_indexes(engine, models.Base.metadata)
+        # Indexes created by migrations outside models.py
+        report["undeclared"] = [name for name in report["undeclared"] if name not in SEARCH_INDEXES]
+        for kind in ("missing", "undeclared", "unused"):
+            for name in report[kind]:
+                print(f"{kind}: {name}")
+        if report["missing"]:
+            sys.exit(1)
+        print("Indexes match models.py" if not report["undeclared"] else "No missing indexes")
+
+
+if __name__ == "__main__":
+    main()
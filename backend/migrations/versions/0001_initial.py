@@ -0,0 +1,101 @@
+"""
+Initial schema: the tables that main.py used to create at import time.
+
+Frozen copy of models.py as it stood before migrations existed, so every
+database starts from the same baseline and later versions add their own
+tables, columns and indexes. Do not change it to follow models.py.
+"""
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, DateTime, ForeignKey, Text, Numeric, Boolean, SmallInteger, func
+)
+
+metadata = MetaData()
+
+Table(
+    "users", metadata,
+    Column("user_id", Integer, primary_key=True, index=True),
+    Column("username", String(50), unique=True, nullable=False, index=True),
+    Column("email", String(255), unique=True, nullable=False, index=True),
+    Column("password_hash", String(255), nullable=False),
+    Column("display_name", String(100)),
+    Column("role", String(20), nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+)
+
+Table(
+    "categories", metadata,
+    Column("category_id", Integer, primary_key=True, index=True),
+    Column("name", String(100), unique=True, nullable=False),
+    Column("description", Text),
+    Column("icon", String(50)),
+)
+
+Table(
+    "listings", metadata,
+    Column("listing_id", Integer, primary_key=True, index=True),
+    Column("seller_id", Integer, ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False),
+    Column("category_id", Integer, ForeignKey("categories.category_id"), nullable=True),
+    Column("title", String(200), nullable=False),
+    Column("description", Text),
+    Column("price", Numeric(10, 2), nullable=False),
+    Column("condition", String(20)),
+    Column("quantity", Integer),
+    Column("status", String(20)),
+    Column("created_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+    Column("view_count", Integer),
+)
+
+Table(
+    "photos", metadata,
+    Column("photo_id", Integer, primary_key=True, index=True),
+    Column("listing_id", Integer, ForeignKey("listings.listing_id", ondelete="CASCADE"), nullable=False),
+    Column("url", Text, nullable=False),
+    Column("alt_text", String(255)),
+    Column("sort_order", Integer),
+)
+
+Table(
+    "messages", metadata,
+    Column("message_id", Integer, primary_key=True, index=True),
+    Column("sender_id", Integer, ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False),
+    Column("receiver_id", Integer, ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False),
+    Column("listing_id", Integer, ForeignKey("listings.listing_id", ondelete="SET NULL"), nullable=True),
+    Column("body", Text, nullable=False),
+    Column("sent_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Column("read_at", DateTime(timezone=True)),
+    Column("is_read", Boolean),
+)
+
+Table(
+    "favorites", metadata,
+    Column("favorite_id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False),
+    Column("listing_id", Integer, ForeignKey("listings.listing_id", ondelete="CASCADE"), nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+)
+
+Table(
+    "orders", metadata,
+    Column("order_id", Integer, primary_key=True, index=True),
+    Column("buyer_id", Integer, ForeignKey("users.user_id"), nullable=False),
+    Column("total_amount", Numeric(12, 2), nullable=False),
+    Column("status", String(30)),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("paid_at", DateTime(timezone=True)),
+)
+
+Table(
+    "reviews", metadata,
+    Column("review_id", Integer, primary_key=True, index=True),
+    Column("author_id", Integer, ForeignKey("users.user_id"), nullable=False),
+    Column("listing_id", Integer, ForeignKey("listings.listing_id"), nullable=False),
+    Column("rating", SmallInteger, nullable=False),
+    Column("comment", Text),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+def upgrade(conn):
+    # checkfirst keeps this a no-op on databases created by the old create_all
+    metadata.create_all(conn, checkfirst=True)
@@ -0,0 +1,50 @@
+"""Full-text search index for listings (GIN on Postgres, FTS5 on SQLite)"""
+from sqlalchemy import text
+from migrations import drop_invalid_index
+
+TRANSACTIONAL = False
+
+PG_INDEX_DDL = (
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_listings_search ON listings "
+    "USING GIN (to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, '')))"
+)
+
+SQLITE_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS listings_fts USING fts5(
+        title, description,
+        content='listings', content_rowid='listing_id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS listings_fts_ai AFTER INSERT ON listings BEGIN
+        INSERT INTO listings_fts(rowid, title, description)
+        VALUES (new.listing_id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS listings_fts_ad AFTER DELETE ON listings BEGIN
+        INSERT INTO listings_fts(listings_fts, rowid, title, description)
+        VALUES ('delete', old.listing_id, old.title, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS listings_fts_au AFTER UPDATE OF title, description ON listings BEGIN
+        INSERT INTO listings_fts(listings_fts, rowid, title, description)
+        VALUES ('delete', old.listing_id, old.title, old.description);
+        INSERT INTO listings_fts(rowid, title, description)
+        VALUES (new.listing_id, new.title, new.description);
+    END""",
+]
+
+
+def upgrade(conn):
+    if conn.dialect.name == "postgresql":
+        drop_invalid_index(conn, "ix_listings_search")
+        conn.execute(text(PG_INDEX_DDL))
+    elif conn.dialect.name == "sqlite":
+        # SQLite builds without FTS5 fall back to LIKE matching (search.py)
+        if "ENABLE_FTS5" not in conn.execute(text("PRAGMA compile_options")).scalars().all():
+            return
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'listings_fts'")
+        ).first()
+        for ddl in SQLITE_FTS_DDL:
+            conn.execute(text(ddl))
+        # Index rows that existed before the FTS table was created
+        if not exists:
+            conn.execute(text("INSERT INTO listings_fts(listings_fts) VALUES ('rebuild')"))
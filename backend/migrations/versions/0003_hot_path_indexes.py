@@ -0,0 +1,20 @@
+"""Composite indexes for the feed, per-seller, message, favorite and photo queries"""
+from migrations import create_index
+
+TRANSACTIONAL = False
+
+# (name, table, columns)
+INDEXES = [
+    ("ix_listings_status_created_at", "listings", ("status", "created_at", "listing_id")),
+    ("ix_listings_status_price", "listings", ("status", "price", "listing_id")),
+    ("ix_listings_category_id_status", "listings", ("category_id", "status")),
+    ("ix_listings_seller_id_created_at", "listings", ("seller_id", "created_at", "listing_id")),
+    ("ix_messages_sender_receiver_sent_at", "messages", ("sender_id", "receiver_id", "sent_at")),
+    ("ix_favorites_user_id_listing_id", "favorites", ("user_id", "listing_id")),
+    ("ix_photos_listing_id_sort_order", "photos", ("listing_id", "sort_order")),
+]
+
+
+def upgrade(conn):
+    for name, table, columns in INDEXES:
+        create_index(conn, name, table, columns)
@@ -0,0 +1,8 @@
+"""Index for cursor-paginated message history"""
+from migrations import create_index
+
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    create_index(conn, "ix_messages_sender_receiver_message_id", "messages", ("sender_id", "receiver_id", "message_id"))
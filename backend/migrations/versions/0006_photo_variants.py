@@ -0,0 +1,7 @@
+"""Rendered variant URLs on photos"""
+from sqlalchemy import Column, JSON
+from migrations import add_column
+
+
+def upgrade(conn):
+    add_column(conn, "photos", Column("variants", JSON))
@@ -0,0 +1,21 @@
+"""Content-addressed upload storage: stored_files refcounts and photos.content_hash"""
+from sqlalchemy import MetaData, Table, Column, Integer, BigInteger, String, DateTime, func
+from migrations import add_column, create_index
+
+TRANSACTIONAL = False
+
+metadata = MetaData()
+
+stored_files = Table(
+    "stored_files", metadata,
+    Column("content_hash", String(64), primary_key=True),
+    Column("size", BigInteger, nullable=False),
+    Column("refcount", Integer, nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+def upgrade(conn):
+    stored_files.create(conn, checkfirst=True)
+    add_column(conn, "photos", Column("content_hash", String(64)))
+    create_index(conn, "ix_photos_content_hash", "photos", ("content_hash",))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Numeric, Boolean, SmallInteger, func
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Numeric, Boolean, SmallInteger, BigInteger, Index, JSON, func
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -66,6 +66,15 @@ class Listing(Base):
     messages = relationship("Message", back_populates="listing")
     photos = relationship("Photo", back_populates="listing", cascade="all, delete-orphan")
 
+    # Hot-path indexes: feed sorts (with listing_id as keyset tie-break),
+    # category filter and per-seller listings
+    __table_args__ = (
+        Index("ix_listings_status_created_at", "status", "created_at", "listing_id"),
+        Index("ix_listings_status_price", "status", "price", "listing_id"),
+        Index("ix_listings_category_id_status", "category_id", "status"),
+        Index("ix_listings_seller_id_created_at", "seller_id", "created_at", "listing_id"),
+    )
+
 
 class Photo(Base):
     __tablename__ = "photos"
@@ -75,10 +84,34 @@ class Photo(Base):
     url = Column(Text, nullable=False)
     alt_text = Column(String(255))
     sort_order = Column(Integer, default=0)
+    # SHA-256 of the file; NULL for uploads stored before content addressing
+    content_hash = Column(String(64), nullable=True)
+    # {"thumb"|"card"|"full": {"webp": url, "jpg"|"png": url}}, filled in by image_processor
+    variants = Column(JSON)
     
     # Relationships
     listing = relationship("Listing", back_populates="photos")
 
+    __table_args__ = (
+        Index("ix_photos_listing_id_sort_order", "listing_id", "sort_order"),
+        Index("ix_photos_content_hash", "content_hash"),
+    )
+
+
+class StoredFile(Base):
+    """
+    One content-addressed upload, shared by every Photo with the same bytes.
+
+    refcount is maintained by session events in storage.py and recomputed by
+    `python storage.py recount`.
+    """
+    __tablename__ = "stored_files"
+
+    content_hash = Column(String(64), primary_key=True)  # SHA-256 hex
+    size = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 
 class Message(Base):
     __tablename__ = "messages"
@@ -97,6 +130,37 @@ class Message(Base):
     receiver = relationship("User", foreign_keys=[receiver_id], back_populates="received_messages")
     listing = relationship("Listing", back_populates="messages")
 
+    __table_args__ = (
+        Index("ix_messages_sender_receiver_sent_at", "sender_id", "receiver_id", "sent_at"),
+        # Keyset paging of a thread's history by message_id
+        Index("ix_messages_sender_receiver_message_id", "sender_id", "receiver_id", "message_id"),
+    )
+
+
+class Conversation(Base):
+    """
+    Denormalized inbox summary, one row per thread (user pair + listing).
+
+    Maintained by the messages router and rebuilt from messages by
+    `python conversations.py rebuild`.
+    """
+    __tablename__ = "conversations"
+
+    conversation_id = Column(Integer, primary_key=True, index=True)
+    thread_key = Column(String(64), unique=True, nullable=False)  # "<low>:<high>:<listing_id or 0>"
+    user_low_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False)
+    user_high_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False)
+    listing_id = Column(Integer, nullable=True)
+    last_message_id = Column(Integer, ForeignKey("messages.message_id", ondelete="SET NULL"), nullable=True)
+    last_message_at = Column(DateTime(timezone=True), nullable=False)
+    unread_low = Column(Integer, nullable=False, default=0)  # unread by user_low_id
+    unread_high = Column(Integer, nullable=False, default=0)  # unread by user_high_id
+
+    __table_args__ = (
+        Index("ix_conversations_user_low_last", "user_low_id", "last_message_at"),
+        Index("ix_conversations_user_high_last", "user_high_id", "last_message_at"),
+    )
+
 
 class Favorite(Base):
     __tablename__ = "favorites"
@@ -110,6 +174,10 @@ class Favorite(Base):
     user = relationship("User", back_populates="favorites")
     listing = relationship("Listing", back_populates="favorites")
 
+    __table_args__ = (
+        Index("ix_favorites_user_id_listing_id", "user_id", "listing_id"),
+    )
+
 
 class Order(Base):
     __tablename__ = "orders"
@@ -0,0 +1,92 @@
+"""
+Keyset (cursor) pagination for listing feeds.
+
+A cursor is an opaque base64 token holding the sort key of the last row on
+the page plus listing_id as a tie-break, so the next page is a single index
+range scan no matter how deep it is.
+"""
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+from fastapi import HTTPException, Response
+from sqlalchemy import tuple_, literal, String
+import models
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# sort_by -> (sort column, descending)
+SORT_KEYS = {
+    "newest": (models.Listing.created_at, True),
+    "oldest": (models.Listing.created_at, False),
+    "price_low": (models.Listing.price, False),
+    "price_high": (models.Listing.price, True),
+}
+
+
+def order_by_clause(sort_by: str):
+    """ORDER BY for a sort, with listing_id as a stable tie-break"""
+    column, descending = SORT_KEYS[sort_by]
+    if descending:
+        return [column.desc(), models.Listing.listing_id.desc()]
+    return [column.asc(), models.Listing.listing_id.asc()]
+
+
+def encode_cursor(sort_by: str, listing: models.Listing) -> str:
+    """Build the cursor pointing just past `listing`"""
+    column, _ = SORT_KEYS[sort_by]
+    value = getattr(listing, column.key)
+    if isinstance(value, (datetime, Decimal)):
+        value = str(value)
+    payload = json.dumps({"s": sort_by, "v": value, "id": listing.listing_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_by: str):
+    """Return (sort value, listing_id) from a cursor, or raise 400"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if payload["s"] != sort_by:
+            raise ValueError("cursor was issued for a different sort")
+        column, _ = SORT_KEYS[sort_by]
+        if column is models.Listing.price:
+            value = Decimal(payload["v"])
+        else:
+            value = datetime.fromisoformat(payload["v"])
+        return value, int(payload["id"])
+    except (ValueError, KeyError, TypeError, ArithmeticError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def apply_cursor(stmt, sort_by: str, cursor: str, dialect_name: str):
+    """Restrict an ordered Listing select to rows after `cursor`"""
+    column, descending = SORT_KEYS[sort_by]
+    value, listing_id = decode_cursor(cursor, sort_by)
+    if isinstance(value, datetime) and dialect_name == "sqlite":
+        # SQLite compares timestamps as stored text ("YYYY-MM-DD HH:MM:SS"),
+        # which str(datetime) matches but the DateTime bind format does not
+        value = literal(str(value), String)
+    key = tuple_(column, models.Listing.listing_id)
+    bound = tuple_(value, listing_id)
+    return stmt.where(key < bound if descending else key > bound)
+
+
+async def paginate(db, stmt, sort_by: str, limit: int, response: Response, cursor: str = None, offset: int = 0):
+    """
+    Fetch one page of an (unordered) Listing select sorted by `sort_by`.
+
+    Sets the X-Next-Cursor response header when more rows follow.
+    """
+    stmt = stmt.order_by(*order_by_clause(sort_by))
+    if cursor:
+        stmt = apply_cursor(stmt, sort_by, cursor, db.get_bind().dialect.name)
+    elif offset:
+        stmt = stmt.offset(offset)
+
+    # Fetch one extra row to know whether there is a next page
+    rows = (await db.execute(stmt.limit(limit + 1))).scalars().all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(sort_by, rows[-1])
+    return rows
@@ -0,0 +1,316 @@
+"""
+Sampling profiler for live requests.
+
+With PROFILER_ENABLED=true, a request is profiled when an admin sends
+"X-Profile: 1" with it, or at random with probability PROFILER_SAMPLE_RATE.
+While any profile is open, a background thread samples the event loop
+thread every PROFILER_INTERVAL_MS:
+
+- when the request's task is running, the stack of the loop thread, with
+  SQLAlchemy's greenlets stitched under the coroutine that started them, so
+  router code, ORM work and pydantic serialization appear in one tree;
+- otherwise the task's suspended coroutine stack under "(waiting)", which is
+  where it spends time on the database, the threadpool or a busy loop.
+
+While an X-Profile request is open, the process-wide GIL switch interval
+is lowered so the sampler thread can interrupt the loop. That slows every
+thread in the worker, the threadpool included, so sampled profiles leave it
+alone: their running stacks are coarser, mostly caught when the loop blocks.
+
+Profiles are capped at PROFILER_MAX_SECONDS and the last
+PROFILER_MAX_PROFILES are kept. Profiled responses carry X-Profile-Id;
+GET /internal/profiles/{id} downloads the collapsed stacks
+("frame;frame;frame count" lines) for flamegraph.pl, inferno or speedscope.
+"""
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+import greenlet
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from auth_utils import get_user_from_token
+from logger import log_context
+from sql_metrics import route_label
+
+load_dotenv()
+
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() in ("1", "true", "yes")
+# Random profiles run at the default GIL switch interval; lowering it for
+# them would slow the very traffic they measure
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", "0"))
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+PROFILER_MAX_PROFILES = int(os.getenv("PROFILER_MAX_PROFILES", "50"))
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "30"))
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+MAX_DEPTH = 256
+
+
+class Profile:
+    """Stack samples of one request"""
+
+    def __init__(self, method: str, path: str, trigger: str, task, loop, thread_id: int):
+        self.profile_id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.request_id = getattr(log_context.get(), "request_id", None)
+        self.task = task
+        self.loop = loop
+        self.thread_id = thread_id
+        self.started_at = time.time()
+        self.started = time.monotonic()
+        self.route = None
+        self.status = None
+        self.duration_ms = None
+        self.samples = Counter()  # root-first tuple of frames -> count
+        self.running_samples = 0
+        self.waiting_samples = 0
+
+    def summary(self) -> dict:
+        return {
+            "profile_id": self.profile_id,
+            "route": self.route,
+            "path": self.path,
+            "status": self.status,
+            "trigger": self.trigger,
+            "request_id": self.request_id,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "samples": self.running_samples + self.waiting_samples,
+            "running_samples": self.running_samples,
+            "waiting_samples": self.waiting_samples,
+        }
+
+    def folded(self) -> str:
+        """Collapsed stacks, one "root;...;leaf count" line per distinct stack"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+
+class SamplingProfiler:
+    """Samples the event loop thread on behalf of open profiles"""
+
+    def __init__(
+        self,
+        interval_ms: float = PROFILER_INTERVAL_MS,
+        max_profiles: int = PROFILER_MAX_PROFILES,
+        max_seconds: float = PROFILER_MAX_SECONDS
+    ):
+        self.interval = interval_ms / 1000
+        self.max_seconds = max_seconds
+        self.profiles = deque(maxlen=max_profiles)
+        self._active = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._greenlets = {}  # thread id -> greenlet running there
+        self._labels = {}  # code object -> frame label
+        self._switch_interval = None
+        self._header_profiles = 0  # open profiles that lowered the switch interval
+
+    # ----- on the event loop -----
+
+    def begin(self, scope, trigger: str) -> Profile:
+        profile = Profile(
+            scope["method"], scope["path"], trigger,
+            asyncio.current_task(), asyncio.get_running_loop(), threading.get_ident()
+        )
+        with self._lock:
+            if not self._active:
+                # Greenlet switches tell the sampler when SQLAlchemy runs ORM code off the task's stack
+                greenlet.settrace(self._trace_switch)
+            if trigger == "header":
+                if not self._header_profiles:
+                    # With the default 5 ms GIL switch interval the sampler would only get
+                    # in when the loop blocks on I/O, and never see the request running.
+                    # The interval is process-wide, so only explicit requests pay for it.
+                    self._switch_interval = sys.getswitchinterval()
+                    sys.setswitchinterval(min(self._switch_interval, self.interval / 10))
+                self._header_profiles += 1
+            self._active.append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+            self._wake.set()
+        return profile
+
+    def end(self, profile: Profile, scope, status: int):
+        profile.route = route_label(scope)
+        profile.status = status
+        profile.duration_ms = round((time.monotonic() - profile.started) * 1000, 2)
+        profile.task = None
+        with self._lock:
+            self._active.remove(profile)
+            if profile.trigger == "header":
+                self._header_profiles -= 1
+                if not self._header_profiles:
+                    sys.setswitchinterval(self._switch_interval)
+            if not self._active:
+                greenlet.settrace(None)
+                self._greenlets.pop(threading.get_ident(), None)
+                self._wake.clear()
+            self.profiles.append(profile)
+
+    def _trace_switch(self, event, args):
+        if event in ("switch", "throw"):
+            self._greenlets[threading.get_ident()] = args[1]
+
+    # ----- on the sampler thread -----
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._sample()
+            time.sleep(self.interval)
+
+    def _sample(self):
+        with self._lock:
+            active = list(self._active)
+        if not active:
+            return
+        frames = sys._current_frames()
+        now = time.monotonic()
+        for profile in active:
+            task = profile.task
+            if task is None or task.done() or now - profile.started > self.max_seconds:
+                continue
+            if asyncio.current_task(profile.loop) is task:
+                stack = self._running_stack(task, frames.get(profile.thread_id), profile.thread_id)
+                waiting = False
+            else:
+                stack = self._awaiting_stack(task) + ("(waiting)",)
+                waiting = True
+            if not stack:
+                continue
+            with self._lock:
+                if profile in self._active:
+                    profile.samples[stack] += 1
+                    if waiting:
+                        profile.waiting_samples += 1
+                    else:
+                        profile.running_samples += 1
+
+    def _running_stack(self, task, frame, thread_id: int) -> tuple:
+        frames = self._walk(frame)
+        current = self._greenlets.get(thread_id)
+        # In a SQLAlchemy greenlet the frames stop at the greenlet; the rest of
+        # the stack is where its parent (the task's coroutines) switched away
+        parent = getattr(current, "parent", None)
+        if parent is not None and parent.gr_frame is not None:
+            frames = self._walk(parent.gr_frame) + frames
+        # Start at the task's coroutine, like waiting stacks, so both form one tree
+        root = getattr(task.get_coro(), "cr_code", None)
+        for index, frame in enumerate(frames):
+            if frame.f_code is root:
+                frames = frames[index:]
+                break
+        return tuple(self._label(frame.f_code) for frame in frames)
+
+    def _awaiting_stack(self, task) -> tuple:
+        """Where the suspended task's coroutines are awaiting, outermost first"""
+        labels = []
+        awaitable = task.get_coro()
+        while awaitable is not None and len(labels) < MAX_DEPTH:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+            if frame is None:
+                break
+            labels.append(self._label(frame.f_code))
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+        return tuple(labels)
+
+    def _walk(self, frame) -> list:
+        """Frames from the thread's outermost call down to `frame`"""
+        frames = []
+        while frame is not None and len(frames) < MAX_DEPTH:
+            frames.append(frame)
+            frame = frame.f_back
+        frames.reverse()
+        return frames
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            if filename.startswith(BACKEND_DIR):
+                filename = filename[len(BACKEND_DIR):]
+            elif "site-packages" + os.sep in filename:
+                filename = filename.split("site-packages" + os.sep, 1)[1]
+            else:
+                filename = os.path.basename(filename)
+            label = self._labels[code] = f"{code.co_qualname} ({filename}:{code.co_firstlineno})".replace(";", ":")
+        return label
+
+    # ----- reports -----
+
+    def get(self, profile_id: str):
+        with self._lock:
+            return next((profile for profile in self.profiles if profile.profile_id == profile_id), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            profiles = [profile.summary() for profile in reversed(self.profiles)]
+            active = len(self._active)
+        return {
+            "enabled": PROFILER_ENABLED,
+            "sample_rate": PROFILER_SAMPLE_RATE,
+            "interval_ms": self.interval * 1000,
+            "active": active,
+            "profiles": profiles,
+        }
+
+
+profiler = SamplingProfiler()
+
+
+class ProfilerMiddleware:
+    """Profiles requests sent with X-Profile by an admin, or a random sample"""
+
+    def __init__(self, app, sample_rate: float = PROFILER_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def _requested_by_admin(self, scope) -> bool:
+        requested, authorization = False, ""
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                requested = value.lower() in (b"1", b"true", b"yes")
+            elif name == b"authorization":
+                authorization = value.decode("latin-1")
+        if not requested or not authorization.lower().startswith("bearer "):
+            return False
+        async with AsyncSessionLocal() as db:
+            user = await get_user_from_token(db, authorization[7:])
+        return user is not None and user.role == "admin"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if await self._requested_by_admin(scope):
+            trigger = "header"
+        elif self.sample_rate > 0 and random.random() < self.sample_rate:
+            trigger = "sampled"
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        profile = profiler.begin(scope, trigger)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.end(profile, scope, status)
@@ -0,0 +1,99 @@
+"""
+Per-endpoint SQL query budgets.
+
+Endpoints declare how many statements a request may run:
+
+    @router.get("")
+    @query_budget(3)
+    def get_listings(...): ...
+
+With QUERY_BUDGET_MODE=raise (tests) a request that goes over its budget
+fails with QueryBudgetExceeded; with "warn" it is only logged. The default
+("off") installs nothing.
+"""
+import os
+from contextvars import ContextVar
+from sqlalchemy import event
+from dotenv import load_dotenv
+from logger import logger
+
+load_dotenv()
+
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "off").lower()
+
+# Mutable per-request counter; sync endpoints run in a threadpool and async
+# sessions in a greenlet, both with the request context, so they increment
+# the same object
+_request_counter: ContextVar = ContextVar("query_budget_counter", default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised in "raise" mode when an endpoint runs more queries than declared"""
+
+
+class _Counter:
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+
+def query_budget(max_queries: int):
+    """Declare the maximum number of SQL statements an endpoint may run"""
+    def decorator(func):
+        func.query_budget = max_queries
+        return func
+    return decorator
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    counter = _request_counter.get()
+    if counter is not None:
+        counter.count += 1
+
+
+class QueryBudgetMiddleware:
+    """ASGI middleware that counts statements per request and checks the budget"""
+
+    def __init__(self, app, mode: str = QUERY_BUDGET_MODE):
+        self.app = app
+        self.mode = mode
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        counter = _Counter()
+        token = _request_counter.set(counter)
+
+        async def send_wrapper(message):
+            # The body is fully serialized (lazy loads included) by the time
+            # the response starts, so check before anything is sent
+            if message["type"] == "http.response.start":
+                self._check(scope, counter.count)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_counter.reset(token)
+
+    def _check(self, scope, count):
+        budget = getattr(scope.get("endpoint"), "query_budget", None)
+        if budget is None or count <= budget:
+            return
+        detail = f"{scope['method']} {scope['path']} ran {count} queries (budget {budget})"
+        if self.mode == "raise":
+            raise QueryBudgetExceeded(detail)
+        logger.warning(f"Query budget exceeded: {detail}")
+
+
+def setup_query_budget(app, *engines, mode: str = QUERY_BUDGET_MODE):
+    """Install statement counting on `engines` and the budget middleware on `app`"""
+    if mode not in ("warn", "raise"):
+        return
+    # The same engine may be passed twice (e.g. reads and writes share one)
+    for engine in dict.fromkeys(engines):
+        event.listen(engine, "before_cursor_execute", _count_statement)
+    app.add_middleware(QueryBudgetMiddleware, mode=mode)
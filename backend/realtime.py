@@ -0,0 +1,181 @@
+"""
+Pub/sub broker for real-time message events.
+
+Routers publish per-user events after committing (new messages, read
+receipts, unread-count changes); routers/realtime.py streams them to the
+user's open WebSocket / SSE connections.
+
+Backends (REALTIME_BACKEND):
+    memory   - in-process fan-out, enough for a single worker
+    postgres - LISTEN/NOTIFY, fans out across every worker and host
+
+Each subscription has a bounded queue. A consumer that falls
+REALTIME_QUEUE_SIZE events behind is dropped with a RESYNC marker, and the
+client is expected to reconnect and re-fetch instead of stalling publishers.
+"""
+import asyncio
+import json
+import os
+import select
+import threading
+from collections import defaultdict
+from sqlalchemy import text
+from dotenv import load_dotenv
+from logger import logger
+
+load_dotenv()
+
+REALTIME_BACKEND = os.getenv("REALTIME_BACKEND", "memory").lower()
+REALTIME_QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", "100"))
+REALTIME_CHANNEL = "marketplace_events"
+
+# Postgres NOTIFY payloads must stay under 8000 bytes
+NOTIFY_MAX_PAYLOAD = 7900
+
+# Queued in place of further events once a subscriber overflows
+RESYNC = {"type": "resync"}
+
+
+class Subscription:
+    """One open connection's event queue"""
+
+    def __init__(self, user_id: int, maxsize: int):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+
+class LocalBroker:
+    """In-process broker; publish() is awaited on the event loop after commit"""
+
+    name = "memory"
+
+    def __init__(self, queue_size: int = REALTIME_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+        self._loop = None
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+
+    def start(self, loop):
+        self._loop = loop
+
+    def stop(self):
+        self._loop = None
+
+    def subscribe(self, user_id: int) -> Subscription:
+        """Register a connection (call on the event loop)"""
+        subscription = Subscription(user_id, self.queue_size)
+        self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.user_id]
+
+    async def publish(self, user_id: int, event: dict):
+        """Send an event to every connection of `user_id`"""
+        if self._loop is None:
+            return
+        self.published += 1
+        await self._publish(user_id, event)
+
+    async def _publish(self, user_id, event):
+        self._deliver(user_id, event)
+
+    def _deliver(self, user_id, event):
+        """Fan an event out to local subscriptions (runs on the event loop)"""
+        for subscription in list(self._subscribers.get(user_id, ())):
+            try:
+                subscription.queue.put_nowait(event)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                # Slow consumer: drop what it has not read and tell it to resync
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                subscription.queue.put_nowait(RESYNC)
+                self.unsubscribe(subscription)
+                self.overflows += 1
+                logger.warning(f"Realtime subscriber for user {user_id} overflowed, forcing resync")
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "connections": sum(len(s) for s in self._subscribers.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+        }
+
+
+class PostgresNotifyBroker(LocalBroker):
+    """Fans events out across workers with Postgres LISTEN/NOTIFY"""
+
+    name = "postgres"
+
+    def __init__(self, engine, queue_size: int = REALTIME_QUEUE_SIZE):
+        super().__init__(queue_size)
+        self.engine = engine  # async engine: NOTIFY must not block the event loop
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self, loop):
+        super().start(loop)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._listen, name="realtime-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        super().stop()
+
+    async def _publish(self, user_id, event):
+        payload = json.dumps({"user_id": user_id, "event": event}, separators=(",", ":"), default=str)
+        if len(payload.encode("utf-8")) > NOTIFY_MAX_PAYLOAD:
+            # Too big for NOTIFY: tell clients to fetch it themselves
+            payload = json.dumps({"user_id": user_id, "event": {"type": event["type"], "partial": True}})
+        async with self.engine.begin() as conn:
+            await conn.execute(text("SELECT pg_notify(:channel, :payload)"), {
+                "channel": REALTIME_CHANNEL, "payload": payload
+            })
+
+    def _listen(self):
+        """Listener thread: one dedicated connection outside the pool"""
+        import psycopg2
+
+        dsn = self.engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        while not self._stopping.is_set():
+            try:
+                conn = psycopg2.connect(dsn)
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {REALTIME_CHANNEL}")
+                while not self._stopping.is_set():
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            notify = conn.notifies.pop(0)
+                            message = json.loads(notify.payload)
+                            self._loop.call_soon_threadsafe(self._deliver, message["user_id"], message["event"])
+                conn.close()
+            except Exception as e:
+                logger.error(f"Realtime listener error, reconnecting: {e}")
+                self._stopping.wait(2)
+
+
+def create_broker(backend: str = REALTIME_BACKEND):
+    if backend == "postgres":
+        from database import async_engine
+        return PostgresNotifyBroker(async_engine)
+    return LocalBroker()
+
+
+broker = create_broker()
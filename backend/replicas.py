@@ -0,0 +1,299 @@
+"""
+Read-replica routing.
+
+Safe read-only endpoints take their session from get_read_db, which binds
+it to a healthy replica (round-robin) from DATABASE_REPLICA_URLS; everything
+else stays on the primary. A client that committed a write is kept on the
+primary for REPLICA_STALENESS_SECONDS afterwards so it reads its own writes.
+The response to the write sets a short-lived last-write cookie holding the
+commit time, which keeps the client on the primary whichever worker serves
+its next read, signed in or not; clients that drop cookies are still kept
+there by the worker that served the write (keyed by a hash of their
+Authorization header).
+
+Replicas are health-checked every REPLICA_HEALTH_INTERVAL seconds; one that
+cannot be reached, or (Postgres) replays more than REPLICA_MAX_LAG_SECONDS
+behind, is skipped until it recovers. Connection errors seen by live traffic
+take a replica out immediately, and the statement that hit them is retried
+once on the primary, so the request still succeeds; with no healthy replica
+reads fall back to the primary.
+"""
+import asyncio
+import hashlib
+import itertools
+import math
+import os
+import threading
+import time
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from logger import logger
+
+load_dotenv()
+
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_STALENESS_SECONDS = float(os.getenv("REPLICA_STALENESS_SECONDS", "5"))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "30"))
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "5"))
+REPLICA_WRITE_COOKIE = "last_write"
+
+PG_REPLAY_LAG = text(
+    "SELECT CASE WHEN pg_is_in_recovery() "
+    "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) ELSE 0 END"
+)
+
+
+class Replica:
+    """One replica engine and its health"""
+
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.lag = None
+        self.last_error = None
+        self.reads = 0
+        self.failures = 0
+
+    def stats(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "reads": self.reads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class ReplicaRouter:
+    """Chooses the engine for read-only sessions"""
+
+    def __init__(
+        self,
+        staleness: float = REPLICA_STALENESS_SECONDS,
+        max_lag: float = REPLICA_MAX_LAG_SECONDS,
+        interval: float = REPLICA_HEALTH_INTERVAL
+    ):
+        self.staleness = staleness
+        self.max_lag = max_lag
+        self.interval = interval
+        self.primary = None
+        self.replicas = []
+        self._recent_writers = {}  # client -> monotonic time its window ends
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._task = None
+        self.primary_reads = {"sticky": 0, "fallback": 0}
+
+    def configure(self, primary, replicas: dict):
+        """Route between `primary` and {name: async engine} replicas"""
+        self.primary = primary
+        self.replicas = [Replica(name, engine) for name, engine in replicas.items()]
+        for replica in self.replicas:
+            event.listen(replica.engine.sync_engine, "handle_error", self._on_error(replica))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    @property
+    def sticky(self) -> bool:
+        return self.enabled and self.staleness > 0
+
+    @staticmethod
+    def _key(client: str) -> str:
+        # Never keep bearer tokens around in memory
+        return hashlib.sha256(client.encode()).hexdigest()
+
+    def mark_write(self, client: str):
+        """Keep `client` on the primary for the staleness window"""
+        if client and self.sticky:
+            now = time.monotonic()
+            with self._lock:
+                if len(self._recent_writers) >= 10000:
+                    self._recent_writers = {key: until for key, until in self._recent_writers.items() if until > now}
+                self._recent_writers[self._key(client)] = now + self.staleness
+
+    def wrote_recently(self, client: str = None, wrote_at: float = None) -> bool:
+        """Whether the client committed a write within the staleness window"""
+        if wrote_at is not None and 0 <= time.time() - wrote_at < self.staleness:
+            return True
+        return bool(client) and self._recent_writers.get(self._key(client), 0) > time.monotonic()
+
+    def pick(self, client: str = None, wrote_at: float = None):
+        """Engine for a read-only session; `wrote_at` is the client's last-write cookie"""
+        if not self.enabled:
+            return self.primary
+        if self.wrote_recently(client, wrote_at):
+            with self._lock:
+                self.primary_reads["sticky"] += 1
+            return self.primary
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        with self._lock:
+            if not healthy:
+                self.primary_reads["fallback"] += 1
+                return self.primary
+            replica = healthy[next(self._next) % len(healthy)]
+            replica.reads += 1
+        return replica.engine
+
+    def replica_for(self, sync_engine):
+        """The replica behind `sync_engine`, or None for the primary"""
+        return next((replica for replica in self.replicas if replica.engine.sync_engine is sync_engine), None)
+
+    def _on_error(self, replica: Replica):
+        def handle_error(context):
+            # Lost or refused connections take the replica out until the next health check
+            if context.is_disconnect or context.connection is None:
+                self._mark_down(replica, context.original_exception)
+        return handle_error
+
+    def _mark_down(self, replica: Replica, error):
+        replica.failures += 1
+        replica.last_error = str(error)[:200]
+        if replica.healthy:
+            logger.warning(f"Read replica {replica.name} marked down: {replica.last_error}")
+        replica.healthy = False
+
+    async def check(self):
+        """Probe every replica once"""
+        for replica in self.replicas:
+            try:
+                async with replica.engine.connect() as conn:
+                    if conn.dialect.name == "postgresql":
+                        replica.lag = float((await conn.execute(PG_REPLAY_LAG)).scalar() or 0)
+                    else:
+                        await conn.execute(text("SELECT 1"))
+                        replica.lag = None
+            except Exception as e:
+                self._mark_down(replica, e)
+                continue
+            if replica.lag is not None and replica.lag > self.max_lag:
+                if replica.healthy:
+                    logger.warning(f"Read replica {replica.name} is {replica.lag:.0f}s behind, skipping it")
+                replica.healthy = False
+            elif not replica.healthy:
+                logger.info(f"Read replica {replica.name} is back")
+                replica.healthy = True
+
+    async def _run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Start health checks on the running event loop"""
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "staleness_seconds": self.staleness,
+            "max_lag_seconds": self.max_lag,
+            "primary_reads": dict(self.primary_reads),
+            "replicas": {replica.name: replica.stats() for replica in self.replicas},
+        }
+
+
+replica_router = ReplicaRouter()
+
+
+class ReplicaReadSession(Session):
+    """
+    Sync session behind get_read_db: a statement whose replica connection is
+    lost or refused is retried once on the primary
+    """
+
+    def _on_primary_if_lost(self, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except DBAPIError:
+            # handle_error has already marked the replica down if the connection was the problem
+            replica = replica_router.replica_for(self.bind)
+            if replica is None or replica.healthy:
+                raise
+            self.rollback()
+            self.bind = replica_router.primary.sync_engine
+            with replica_router._lock:
+                replica_router.primary_reads["fallback"] += 1
+            return method(*args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        return self._on_primary_if_lost(super().execute, *args, **kwargs)
+
+    def scalar(self, *args, **kwargs):
+        return self._on_primary_if_lost(super().scalar, *args, **kwargs)
+
+    def scalars(self, *args, **kwargs):
+        return self._on_primary_if_lost(super().scalars, *args, **kwargs)
+
+
+# ============== Read-your-writes ==============
+
+@event.listens_for(Session, "after_flush")
+def _flushed(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _executed(orm_execute_state):
+    # Bulk UPDATE/DELETE/INSERT statements skip the flush
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_writer(session):
+    if session.info.pop("wrote", False):
+        replica_router.mark_write(session.info.get("client"))
+        state = session.info.get("request_state")
+        if state is not None:
+            state.db_wrote_at = time.time()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_write(session):
+    session.info.pop("wrote", None)
+
+
+def last_write(cookies) -> float:
+    """Commit time from the last-write cookie, or None"""
+    try:
+        return float(cookies[REPLICA_WRITE_COOKIE])
+    except (KeyError, ValueError):
+        return None
+
+
+class ReadYourWritesMiddleware:
+    """Sets the last-write cookie on responses to requests that committed a write"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not replica_router.sticky:
+            await self.app(scope, receive, send)
+            return
+        state = scope.setdefault("state", {})
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and "db_wrote_at" in state:
+                cookie = (
+                    f"{REPLICA_WRITE_COOKIE}={state['db_wrote_at']:.3f}; "
+                    f"Max-Age={math.ceil(replica_router.staleness)}; Path=/; HttpOnly; SameSite=Lax"
+                )
+                message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
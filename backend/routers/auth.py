@@ -1,13 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 import models
 import schemas
-from database import get_db
+from database import get_db, get_read_db
 from auth_utils import (
-    get_password_hash,
-    verify_password,
+    hash_password,
+    check_password,
     authenticate_user,
     create_access_token,
     get_user_by_username,
@@ -19,11 +19,10 @@ from auth_utils import (
 router = APIRouter()
 
 @router.post("/register", response_model=schemas.Token, status_code=status.HTTP_201_CREATED)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     """Register a new user"""
-    
     # check if username already exists
-    db_user = get_user_by_username(db, username=user.username)
+    db_user = await get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -31,26 +30,25 @@ def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
         )
     
     # check if email already exists
-    db_user = get_user_by_email(db, email=user.email)
+    db_user = await get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    # create new user
-    hashed_password = get_password_hash(user.password)
+    # create new user (bcrypt runs on its own pool)
     db_user = models.User(
         username=user.username,
         email=user.email,
-        password_hash=hashed_password,
+        password_hash=await hash_password(user.password),
         display_name=user.display_name or user.username,
         role=user.role
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     # create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -66,13 +64,13 @@ def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
     }
 
 @router.post("/login", response_model=schemas.Token)
-def login(
+async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Login with username and password"""
     
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -103,10 +101,10 @@ async def get_current_user_info(
 @router.get("/user/{user_id}", response_model=schemas.UserResponse)
 async def get_user_by_id(
     user_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Get user information by ID"""
-    user = db.query(models.User).filter(models.User.user_id == user_id).first()
+    user = await db.get(models.User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return schemas.UserResponse.model_validate(user)
@@ -115,7 +113,7 @@ async def get_user_by_id(
 async def update_current_user(
     updates: schemas.UserUpdate,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Update current user information"""
     
@@ -124,7 +122,7 @@ async def update_current_user(
     
     # check if new email is taken
     if "email" in update_data and update_data["email"] != current_user.email:
-        existing_user = get_user_by_email(db, update_data["email"])
+        existing_user = await get_user_by_email(db, update_data["email"])
         if existing_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -135,8 +133,8 @@ async def update_current_user(
     for field, value in update_data.items():
         setattr(current_user, field, value)
     
-    db.commit()
-    db.refresh(current_user)
+    await db.commit()
+    await db.refresh(current_user)
     
     return schemas.UserResponse.model_validate(current_user)
 
@@ -145,19 +143,21 @@ async def update_current_user(
 async def change_password(
     password_data: schemas.PasswordChange,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Change current user's password"""
+    # password_hash is not part of the cached user
+    await db.refresh(current_user, ["password_hash"])
     
     # Verify current password
-    if not verify_password(password_data.current_password, current_user.password_hash):
+    if not await check_password(password_data.current_password, current_user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Current password is incorrect"
         )
     
     # Hash and update new password
-    current_user.password_hash = get_password_hash(password_data.new_password)
-    db.commit()
+    current_user.password_hash = await hash_password(password_data.new_password)
+    await db.commit()
     
-    return {"message": "Password updated successfully"}
\ No newline at end of file
+    return {"message": "Password updated successfully"}
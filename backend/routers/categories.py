@@ -1,28 +1,40 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 import models
 import schemas
-from database import get_db
+from database import get_db, get_read_db
+from cache import response_cache, json_response
 
 router = APIRouter()
 
 
 @router.get("", response_model=List[schemas.CategoryResponse])
-def get_categories(db: Session = Depends(get_db)):
+async def get_categories(db: AsyncSession = Depends(get_read_db)):
     """Get all categories"""
-    categories = db.query(models.Category).order_by(models.Category.name).all()
-    return categories
+    cache_key = response_cache.key("categories")
+    cached = response_cache.get(cache_key)
+    if cached:
+        return json_response(*cached, hit=True)
+    version = response_cache.version()
+    
+    categories = (await db.execute(select(models.Category).order_by(models.Category.name))).scalars().all()
+    content = response_cache.serialize(List[schemas.CategoryResponse], categories)
+    response_cache.store(cache_key, content, {"categories"}, version=version)
+    return json_response(content)
 
 
 @router.post("", response_model=schemas.CategoryResponse, status_code=status.HTTP_201_CREATED)
-def create_category(
+async def create_category(
     category: schemas.CategoryCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Create a new category (admin only in production)"""
     # Check if category already exists
-    existing = db.query(models.Category).filter(models.Category.name == category.name).first()
+    existing = (await db.execute(
+        select(models.Category).where(models.Category.name == category.name)
+    )).scalars().first()
     if existing:
         raise HTTPException(status_code=400, detail="Category already exists")
     
@@ -32,15 +44,23 @@ def create_category(
     )
     
     db.add(db_category)
-    db.commit()
-    db.refresh(db_category)
+    await db.commit()
+    await db.refresh(db_category)
     return db_category
 
 
 @router.get("/{category_id}", response_model=schemas.CategoryResponse)
-def get_category(category_id: int, db: Session = Depends(get_db)):
+async def get_category(category_id: int, db: AsyncSession = Depends(get_read_db)):
     """Get a single category"""
-    category = db.query(models.Category).filter(models.Category.category_id == category_id).first()
+    cache_key = response_cache.key("category", category_id=category_id)
+    cached = response_cache.get(cache_key)
+    if cached:
+        return json_response(*cached, hit=True)
+    version = response_cache.version()
+    
+    category = await db.get(models.Category, category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
-    return category
+    content = response_cache.serialize(schemas.CategoryResponse, category)
+    response_cache.store(cache_key, content, {"categories"}, version=version)
+    return json_response(content)
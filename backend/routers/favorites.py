@@ -1,45 +1,52 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 import models
 import schemas
-from database import get_db
+from database import get_db, get_read_db
 from auth_utils import get_current_user
+from loaders import favorite_options, load_favorite
+from query_budget import query_budget
 
 router = APIRouter()
 
 
 @router.get("", response_model=List[schemas.FavoriteResponse])
-def get_favorites(
+@query_budget(4)
+async def get_favorites(
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Get current user's favorites"""
-    favorites = db.query(models.Favorite).filter(
-        models.Favorite.user_id == current_user.user_id
-    ).order_by(models.Favorite.created_at.desc()).all()
+    favorites = (await db.execute(
+        select(models.Favorite).options(*favorite_options()).where(
+            models.Favorite.user_id == current_user.user_id
+        ).order_by(models.Favorite.created_at.desc())
+    )).scalars().all()
     return favorites
 
 
 @router.post("", response_model=schemas.FavoriteResponse, status_code=status.HTTP_201_CREATED)
-def add_favorite(
+@query_budget(7)
+async def add_favorite(
     favorite: schemas.FavoriteCreate,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Add a listing to favorites"""
     # Check if listing exists
-    listing = db.query(models.Listing).filter(
-        models.Listing.listing_id == favorite.listing_id
-    ).first()
+    listing = await db.get(models.Listing, favorite.listing_id)
     if not listing:
         raise HTTPException(status_code=404, detail="Listing not found")
     
     # Check if already favorited
-    existing = db.query(models.Favorite).filter(
-        models.Favorite.user_id == current_user.user_id,
-        models.Favorite.listing_id == favorite.listing_id
-    ).first()
+    existing = (await db.execute(
+        select(models.Favorite).where(
+            models.Favorite.user_id == current_user.user_id,
+            models.Favorite.listing_id == favorite.listing_id
+        )
+    )).scalars().first()
     if existing:
         raise HTTPException(status_code=400, detail="Already in favorites")
     
@@ -49,41 +56,46 @@ def add_favorite(
     )
     
     db.add(db_favorite)
-    db.commit()
-    db.refresh(db_favorite)
-    return db_favorite
+    await db.flush()
+    favorite_id = db_favorite.favorite_id
+    await db.commit()
+    return await load_favorite(db, favorite_id)
 
 
 @router.delete("/{listing_id}", status_code=status.HTTP_204_NO_CONTENT)
-def remove_favorite(
+async def remove_favorite(
     listing_id: int,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Remove a listing from favorites"""
-    favorite = db.query(models.Favorite).filter(
-        models.Favorite.user_id == current_user.user_id,
-        models.Favorite.listing_id == listing_id
-    ).first()
+    favorite = (await db.execute(
+        select(models.Favorite).where(
+            models.Favorite.user_id == current_user.user_id,
+            models.Favorite.listing_id == listing_id
+        )
+    )).scalars().first()
     
     if not favorite:
         raise HTTPException(status_code=404, detail="Favorite not found")
     
-    db.delete(favorite)
-    db.commit()
+    await db.delete(favorite)
+    await db.commit()
     return None
 
 
 @router.get("/check/{listing_id}")
-def check_favorite(
+async def check_favorite(
     listing_id: int,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Check if a listing is in user's favorites"""
-    favorite = db.query(models.Favorite).filter(
-        models.Favorite.user_id == current_user.user_id,
-        models.Favorite.listing_id == listing_id
-    ).first()
+    favorite = (await db.execute(
+        select(models.Favorite).where(
+            models.Favorite.user_id == current_user.user_id,
+            models.Favorite.listing_id == listing_id
+        )
+    )).scalars().first()
     
     return {"is_favorite": favorite is not None}
@@ -1,93 +1,135 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
 import models
 import schemas
-from database import get_db
+from database import get_db, get_read_db
+from search import apply_search, tokenize
+from pagination import paginate, order_by_clause, SORT_KEYS, NEXT_CURSOR_HEADER
+from cache import response_cache, json_response
+from loaders import listing_options, load_listing
+from query_budget import query_budget
+from view_counter import view_counter
 from auth_utils import get_current_user
 
 router = APIRouter()
 
 
 @router.get("", response_model=List[schemas.ListingResponse])
-def get_listings(
+@query_budget(3)
+async def get_listings(
     search: Optional[str] = Query(None, description="Search in title and description"),
     category_id: Optional[int] = Query(None, description="Filter by category"),
     min_price: Optional[float] = Query(None, ge=0, description="Minimum price"),
     max_price: Optional[float] = Query(None, ge=0, description="Maximum price"),
     condition: Optional[str] = Query(None, description="Filter by condition"),
     status: str = Query("published", description="Filter by status"),
-    sort_by: str = Query("newest", description="Sort by: newest, oldest, price_low, price_high"),
+    sort_by: Optional[str] = Query(None, description="Sort by: relevance, newest, oldest, price_low, price_high (default: relevance when searching, else newest)"),
     limit: int = Query(50, ge=1, le=100),
     offset: int = Query(0, ge=0),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="Opaque cursor from X-Next-Cursor (replaces offset)"),
+    response: Response = None,
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Get all listings with optional filters and sorting"""
-    query = db.query(models.Listing).filter(models.Listing.status == status)
+    if cursor and offset:
+        raise HTTPException(status_code=400, detail="Use either cursor or offset, not both")
+    
+    if sort_by is None:
+        sort_by = "relevance" if search else "newest"
+    
+    cache_key = response_cache.key(
+        "listings",
+        search=" ".join(tokenize(search)) if search else None,
+        category_id=category_id, min_price=min_price, max_price=max_price,
+        condition=condition, status=status, sort_by=sort_by,
+        limit=limit, offset=offset, cursor=cursor
+    )
+    cached = response_cache.get(cache_key)
+    if cached:
+        return json_response(*cached, hit=True)
+    version = response_cache.version()
+    
+    query = select(models.Listing).options(*listing_options()).where(models.Listing.status == status)
     
+    rank = None
     if search:
-        search_term = f"%{search}%"
-        query = query.filter(
-            or_(
-                models.Listing.title.ilike(search_term),
-                models.Listing.description.ilike(search_term)
-            )
-        )
+        query, rank = await apply_search(db, query, search)
     
     if category_id:
-        query = query.filter(models.Listing.category_id == category_id)
+        query = query.where(models.Listing.category_id == category_id)
     
     if min_price is not None:
-        query = query.filter(models.Listing.price >= min_price)
+        query = query.where(models.Listing.price >= min_price)
     
     if max_price is not None:
-        query = query.filter(models.Listing.price <= max_price)
+        query = query.where(models.Listing.price <= max_price)
     
     if condition:
-        query = query.filter(models.Listing.condition == condition)
-    
-    # Apply sorting
-    if sort_by == "oldest":
-        query = query.order_by(models.Listing.created_at.asc())
-    elif sort_by == "price_low":
-        query = query.order_by(models.Listing.price.asc())
-    elif sort_by == "price_high":
-        query = query.order_by(models.Listing.price.desc())
-    else:  # newest (default)
-        query = query.order_by(models.Listing.created_at.desc())
-    
-    listings = query.offset(offset).limit(limit).all()
-    return listings
+        query = query.where(models.Listing.condition == condition)
+    
+    # Relevance order has no stable key to seek on, so it pages by offset only
+    if sort_by == "relevance" and rank is not None:
+        if cursor:
+            raise HTTPException(status_code=400, detail="Cursor pagination is not available for relevance sort")
+        query = query.order_by(rank, *order_by_clause("newest"))
+        listings = (await db.execute(query.offset(offset).limit(limit))).scalars().all()
+    else:
+        listings = await paginate(
+            db, query, sort_by if sort_by in SORT_KEYS else "newest", limit, response,
+            cursor=cursor, offset=offset
+        )
+    
+    content = response_cache.serialize(List[schemas.ListingResponse], listings)
+    headers = {}
+    if NEXT_CURSOR_HEADER in response.headers:
+        headers[NEXT_CURSOR_HEADER] = response.headers[NEXT_CURSOR_HEADER]
+    response_cache.store(cache_key, content, {"feed"}, headers, version=version)
+    return json_response(content, headers)
 
 
 @router.get("/{listing_id}", response_model=schemas.ListingResponse)
-def get_listing(listing_id: int, db: Session = Depends(get_db)):
-    """Get a single listing by ID and increment view count"""
-    listing = db.query(models.Listing).filter(models.Listing.listing_id == listing_id).first()
-    if not listing:
-        raise HTTPException(status_code=404, detail="Listing not found")
+@query_budget(2)
+async def get_listing(listing_id: int, db: AsyncSession = Depends(get_read_db)):
+    """Get a single listing by ID and count the view"""
+    cache_key = response_cache.key("listing", listing_id=listing_id)
+    cached = response_cache.get(cache_key)
+    if cached:
+        content, headers = cached
+        hit = True
+    else:
+        # Taken before the read: a commit landing between it and store()
+        # would otherwise leave the old row cached until the TTL
+        version = response_cache.version()
+        listing = await load_listing(db, listing_id)
+        if not listing:
+            raise HTTPException(status_code=404, detail="Listing not found")
+        content, headers = response_cache.serialize(schemas.ListingResponse, listing), {}
+        response_cache.store(
+            cache_key, content, {f"listing:{listing_id}", f"seller:{listing.seller_id}"},
+            version=version
+        )
+        hit = False
     
-    # Increment view count
-    listing.view_count = (listing.view_count or 0) + 1
-    db.commit()
-    db.refresh(listing)
+    # Views are buffered and written in batches, include the unflushed ones
+    view_counter.record(listing_id)
+    content = {**content, "view_count": (content["view_count"] or 0) + view_counter.pending(listing_id)}
     
-    return listing
+    return json_response(content, headers, hit=hit)
 
 
 @router.post("", response_model=schemas.ListingResponse, status_code=status.HTTP_201_CREATED)
-def create_listing(
+@query_budget(5)
+async def create_listing(
     listing: schemas.ListingCreate,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Create a new listing"""
     # Validate category if provided
     if listing.category_id:
-        category = db.query(models.Category).filter(
-            models.Category.category_id == listing.category_id
-        ).first()
+        category = await db.get(models.Category, listing.category_id)
         if not category:
             raise HTTPException(status_code=400, detail="Invalid category")
     
@@ -103,20 +145,22 @@ def create_listing(
     )
     
     db.add(db_listing)
-    db.commit()
-    db.refresh(db_listing)
-    return db_listing
+    await db.flush()
+    listing_id = db_listing.listing_id
+    await db.commit()
+    return await load_listing(db, listing_id)
 
 
 @router.put("/{listing_id}", response_model=schemas.ListingResponse)
-def update_listing(
+@query_budget(5)
+async def update_listing(
     listing_id: int,
     listing_update: schemas.ListingUpdate,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Update a listing (owner only)"""
-    db_listing = db.query(models.Listing).filter(models.Listing.listing_id == listing_id).first()
+    db_listing = await db.get(models.Listing, listing_id)
     
     if not db_listing:
         raise HTTPException(status_code=404, detail="Listing not found")
@@ -129,19 +173,18 @@ def update_listing(
     for field, value in update_data.items():
         setattr(db_listing, field, value)
     
-    db.commit()
-    db.refresh(db_listing)
-    return db_listing
+    await db.commit()
+    return await load_listing(db, listing_id)
 
 
 @router.delete("/{listing_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_listing(
+async def delete_listing(
     listing_id: int,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Delete a listing (owner only)"""
-    db_listing = db.query(models.Listing).filter(models.Listing.listing_id == listing_id).first()
+    db_listing = await db.get(models.Listing, listing_id)
     
     if not db_listing:
         raise HTTPException(status_code=404, detail="Listing not found")
@@ -149,38 +192,46 @@ def delete_listing(
     if db_listing.seller_id != current_user.user_id:
         raise HTTPException(status_code=403, detail="Not authorized to delete this listing")
     
-    db.delete(db_listing)
-    db.commit()
+    await db.delete(db_listing)
+    await db.commit()
     return None
 
 
 @router.get("/user/{user_id}", response_model=List[schemas.ListingResponse])
-def get_user_listings(
+@query_budget(2)
+async def get_user_listings(
     user_id: int,
     status: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from X-Next-Cursor"),
+    response: Response = None,
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """Get all listings by a specific user"""
-    query = db.query(models.Listing).filter(models.Listing.seller_id == user_id)
+    """Get listings by a specific user, newest first"""
+    query = select(models.Listing).options(*listing_options()).where(models.Listing.seller_id == user_id)
     
     if status:
-        query = query.filter(models.Listing.status == status)
+        query = query.where(models.Listing.status == status)
     
-    listings = query.order_by(models.Listing.created_at.desc()).all()
-    return listings
+    return await paginate(db, query, "newest", limit, response, cursor=cursor)
 
 
 @router.get("/me/listings", response_model=List[schemas.ListingResponse])
-def get_my_listings(
+@query_budget(3)
+async def get_my_listings(
     status: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from X-Next-Cursor"),
+    response: Response = None,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get current user's listings"""
-    query = db.query(models.Listing).filter(models.Listing.seller_id == current_user.user_id)
+    """Get current user's listings, newest first"""
+    query = select(models.Listing).options(*listing_options()).where(
+        models.Listing.seller_id == current_user.user_id
+    )
     
     if status:
-        query = query.filter(models.Listing.status == status)
+        query = query.where(models.Listing.status == status)
     
-    listings = query.order_by(models.Listing.created_at.desc()).all()
-    return listings
+    return await paginate(db, query, "newest", limit, response, cursor=cursor)
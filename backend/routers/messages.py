@@ -1,125 +1,162 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_, func
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from sqlalchemy.orm import aliased
+from sqlalchemy import or_, case, func, select, update, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from collections import Counter
+from datetime import datetime
+from pydantic import TypeAdapter
 import models
 import schemas
 from database import get_db
 from auth_utils import get_current_user
+from loaders import message_options, load_message
+from query_budget import query_budget
+from conversations import record_message, record_read, unread_counts
+from realtime import broker
 
 router = APIRouter()
 
 
 @router.get("/conversations", response_model=List[schemas.ConversationResponse])
-def get_conversations(
+@query_budget(2)
+async def get_conversations(
+    limit: int = Query(50, ge=1, le=100),
+    offset: int = Query(0, ge=0),
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all conversations for current user"""
+    """Get conversations for current user, most recent first"""
+    me = current_user.user_id
+    Conversation = models.Conversation
     
-    # Get the actual messages with their latest timestamps
-    messages = db.query(models.Message).filter(
-        or_(
-            models.Message.sender_id == current_user.user_id,
-            models.Message.receiver_id == current_user.user_id
-        )
-    ).order_by(models.Message.sent_at.desc()).all()  # Use sent_at
-    
-    # Build unique conversations
-    seen_conversations = set()
-    conversations = []
-    
-    for msg in messages:
-        other_user_id = msg.receiver_id if msg.sender_id == current_user.user_id else msg.sender_id
-        conv_key = (other_user_id, msg.listing_id)
-        
-        if conv_key not in seen_conversations:
-            seen_conversations.add(conv_key)
-            
-            other_user = db.query(models.User).filter(models.User.user_id == other_user_id).first()
-            listing = None
-            if msg.listing_id:
-                listing = db.query(models.Listing).filter(models.Listing.listing_id == msg.listing_id).first()
-            
-            # Count unread messages
-            unread_count = db.query(models.Message).filter(
-                models.Message.sender_id == other_user_id,
-                models.Message.receiver_id == current_user.user_id,
-                models.Message.is_read == False
-            ).count()
-            
-            conversations.append(schemas.ConversationResponse(
-                user=schemas.UserBrief(
-                    user_id=other_user.user_id,
-                    username=other_user.username,
-                    display_name=other_user.display_name
-                ),
-                listing=schemas.ListingBrief(
-                    listing_id=listing.listing_id,
-                    title=listing.title,
-                    price=listing.price
-                ) if listing else None,
-                last_message=schemas.MessageResponse(
-                    message_id=msg.message_id,
-                    sender_id=msg.sender_id,
-                    receiver_id=msg.receiver_id,
-                    listing_id=msg.listing_id,
-                    body=msg.body,  # Use body
-                    is_read=msg.is_read,
-                    sent_at=msg.sent_at,  # Use sent_at
-                    sender=schemas.UserBrief(
-                        user_id=msg.sender.user_id,
-                        username=msg.sender.username,
-                        display_name=msg.sender.display_name
-                    )
-                ),
-                unread_count=unread_count
-            ))
-    
-    return conversations
+    # Read from the summary table: cost depends on threads returned, not on
+    # how many messages the user has ever exchanged. Any query over messages
+    # (windowed or grouped) still has to scan the user's whole history to
+    # find the latest message and unread count of each thread.
+    is_low = Conversation.user_low_id == me
+    other_id = case((is_low, Conversation.user_high_id), else_=Conversation.user_low_id)
+    unread_count = case((is_low, Conversation.unread_low), else_=Conversation.unread_high)
+    
+    OtherUser = aliased(models.User)
+    rows = (await db.execute(select(models.Message, OtherUser, models.Listing, unread_count).select_from(
+        Conversation
+    ).join(
+        models.Message, models.Message.message_id == Conversation.last_message_id
+    ).join(
+        OtherUser, OtherUser.user_id == other_id
+    ).outerjoin(
+        models.Listing, models.Listing.listing_id == Conversation.listing_id
+    ).options(
+        *message_options()
+    ).where(
+        or_(Conversation.user_low_id == me, Conversation.user_high_id == me)
+    ).order_by(
+        Conversation.last_message_at.desc(), Conversation.conversation_id.desc()
+    ).offset(offset).limit(limit))).all()
+    
+    return [
+        schemas.ConversationResponse.model_validate({
+            "user": other_user,
+            "listing": listing,
+            "last_message": message,
+            "unread_count": unread or 0
+        }, from_attributes=True)
+        for message, other_user, listing, unread in rows
+    ]
 
 
 @router.get("/conversation/{user_id}", response_model=List[schemas.MessageResponse])
-def get_conversation_messages(
+@query_budget(6)
+async def get_conversation_messages(
     user_id: int,
+    response: Response,
     listing_id: int = Query(None, description="Filter by listing"),
+    before: Optional[int] = Query(None, description="Return messages older than this message_id"),
+    after: Optional[int] = Query(None, description="Return messages newer than this message_id"),
     limit: int = Query(50, ge=1, le=100),
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get messages between current user and another user"""
-    query = db.query(models.Message).filter(
-        or_(
-            and_(models.Message.sender_id == current_user.user_id, models.Message.receiver_id == user_id),
-            and_(models.Message.sender_id == user_id, models.Message.receiver_id == current_user.user_id)
+    """
+    Get a page of messages between current user and another user, oldest
+    to newest. Without a cursor this is the latest page; `before` loads
+    older messages and `after` newer ones. X-Has-More tells whether more
+    messages exist in that direction.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+    me = current_user.user_id
+    Message = models.Message
+    newest_first = after is None
+    
+    # One index range scan per direction, each stopping after limit + 1 rows,
+    # so the page costs the same however long the thread is
+    def one_direction(sender_id, receiver_id):
+        ids = select(Message.message_id).where(
+            Message.sender_id == sender_id, Message.receiver_id == receiver_id
         )
-    )
+        if listing_id:
+            ids = ids.where(Message.listing_id == listing_id)
+        if before:
+            ids = ids.where(Message.message_id < before)
+        if after:
+            ids = ids.where(Message.message_id > after)
+        ids = ids.order_by(Message.message_id.desc() if newest_first else Message.message_id.asc())
+        return select(ids.limit(limit + 1).subquery().c.message_id)
+    
+    page_ids = union_all(one_direction(me, user_id), one_direction(user_id, me))
+    page = (await db.execute(select(Message).options(*message_options()).where(
+        Message.message_id.in_(page_ids)
+    ).order_by(
+        Message.message_id.desc() if newest_first else Message.message_id.asc()
+    ).limit(limit + 1))).scalars().all()
     
-    if listing_id:
-        query = query.filter(models.Message.listing_id == listing_id)
+    response.headers["X-Has-More"] = "true" if len(page) > limit else "false"
+    page = sorted(page[:limit], key=lambda m: m.message_id)
     
-    messages = query.order_by(models.Message.sent_at.asc()).limit(limit).all()  # Use sent_at
+    # Serialize first: the UPDATE below bypasses the loaded rows
+    messages = [schemas.MessageResponse.model_validate(m) for m in page]
     
-    # Mark messages as read
-    db.query(models.Message).filter(
-        models.Message.sender_id == user_id,
-        models.Message.receiver_id == current_user.user_id,
-        models.Message.is_read == False
-    ).update({"is_read": True})
-    db.commit()
+    # Mark only the delivered messages as read; read_at comes from the
+    # database clock, like sent_at, so every endpoint returns one format
+    delivered = [m for m in messages if m.receiver_id == me and not m.is_read]
+    if delivered:
+        # Counted from the rows this UPDATE changed: a concurrent load of the
+        # same page (another tab, a realtime refresh) must not count them again
+        marked = (await db.execute(
+            update(Message).where(
+                Message.message_id.in_([m.message_id for m in delivered]),
+                Message.is_read.is_not(True)
+            )
+            .values(is_read=True, read_at=func.now())
+            .returning(Message.message_id, Message.listing_id, Message.read_at)
+            .execution_options(synchronize_session=False)
+        )).all()
+        read_at = {row.message_id: row.read_at for row in marked}
+        read_counts = Counter(row.listing_id for row in marked)
+        await record_read(db, me, user_id, read_counts)
+        await db.commit()
+        for m in delivered:
+            m.is_read = True
+            m.read_at = read_at.get(m.message_id, m.read_at)
+        if marked:
+            # One UPDATE, so one database timestamp for every row
+            await publish_read(db, me, user_id, list(read_counts), list(read_at), marked[0].read_at)
     
     return messages
 
 
 @router.post("", response_model=schemas.MessageResponse, status_code=status.HTTP_201_CREATED)
-def send_message(
+@query_budget(10)
+async def send_message(
     message: schemas.MessageCreate,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Send a message to another user"""
     # Validate receiver exists
-    receiver = db.query(models.User).filter(models.User.user_id == message.receiver_id).first()
+    receiver = await db.get(models.User, message.receiver_id)
     if not receiver:
         raise HTTPException(status_code=404, detail="Receiver not found")
     
@@ -128,7 +165,7 @@ def send_message(
     
     # Validate listing if provided
     if message.listing_id:
-        listing = db.query(models.Listing).filter(models.Listing.listing_id == message.listing_id).first()
+        listing = await db.get(models.Listing, message.listing_id)
         if not listing:
             raise HTTPException(status_code=404, detail="Listing not found")
     
@@ -140,27 +177,87 @@ def send_message(
     )
     
     db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
+    await db.flush()
+    message_id = db_message.message_id
+    await record_message(db, db_message)
+    await db.commit()
+    
+    db_message = await load_message(db, message_id)
+    await publish_message(db, db_message)
     return db_message
 
 
 @router.put("/{message_id}/read", response_model=schemas.MessageResponse)
-def mark_message_read(
+@query_budget(5)
+async def mark_message_read(
     message_id: int,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Mark a message as read"""
-    message = db.query(models.Message).filter(
-        models.Message.message_id == message_id,
-        models.Message.receiver_id == current_user.user_id
-    ).first()
-    
-    if not message:
-        raise HTTPException(status_code=404, detail="Message not found")
-    
-    message.is_read = True
-    db.commit()
-    db.refresh(message)
-    return message
+    Message = models.Message
+    mine = (Message.message_id == message_id, Message.receiver_id == current_user.user_id)
+    
+    # Only the request whose UPDATE flips is_read lowers the unread count
+    marked = (await db.execute(
+        update(Message).where(*mine, Message.is_read.is_not(True))
+        .values(is_read=True, read_at=func.now())
+        .returning(Message.sender_id, Message.listing_id, Message.read_at)
+        .execution_options(synchronize_session=False)
+    )).first()
+    
+    if marked:
+        await record_read(db, current_user.user_id, marked.sender_id, {marked.listing_id: 1})
+        await db.commit()
+        await publish_read(
+            db, current_user.user_id, marked.sender_id, [marked.listing_id], [message_id], marked.read_at
+        )
+    else:
+        # Nothing changed: give up the write turn before checking why
+        await db.rollback()
+        if (await db.execute(select(Message.message_id).where(*mine))).first() is None:
+            raise HTTPException(status_code=404, detail="Message not found")
+    return await load_message(db, message_id)
+
+
+# ============== Real-time events ==============
+
+async def publish_message(db: AsyncSession, message: models.Message):
+    """Push a committed message to both participants and the receiver's new unread count"""
+    payload = schemas.MessageResponse.model_validate(message).model_dump(mode="json")
+    event = {"type": "message", "message": payload}
+    await broker.publish(message.receiver_id, event)
+    await broker.publish(message.sender_id, event)
+    
+    counts = await unread_counts(db, message.receiver_id, message.sender_id, [message.listing_id])
+    await broker.publish(message.receiver_id, {
+        "type": "unread",
+        "user_id": message.sender_id,
+        "listing_id": message.listing_id,
+        "unread_count": counts[message.listing_id]
+    })
+
+
+_timestamp = TypeAdapter(Optional[datetime])
+
+
+async def publish_read(
+    db: AsyncSession, reader_id: int, sender_id: int, listing_ids: list,
+    message_ids: list = None, read_at: datetime = None
+):
+    """Send a read receipt to the sender and the updated unread counts to the reader"""
+    await broker.publish(sender_id, {
+        "type": "read",
+        "reader_id": reader_id,
+        "listing_ids": listing_ids,
+        "message_ids": message_ids,
+        # Serialized like MessageResponse.read_at
+        "read_at": _timestamp.dump_python(read_at, mode="json")
+    })
+    for listing_id, count in (await unread_counts(db, reader_id, sender_id, listing_ids)).items():
+        await broker.publish(reader_id, {
+            "type": "unread",
+            "user_id": sender_id,
+            "listing_id": listing_id,
+            "unread_count": count
+        })
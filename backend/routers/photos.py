@@ -1,49 +1,79 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Request, Query
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 import models
 import schemas
 import os
-import uuid
-import shutil
-from database import get_db
+from database import get_db, get_read_db
 from auth_utils import get_current_user
+from storage import Upload, save_upload_file, save_request_body, upload_url, source_path
 
 router = APIRouter()
 
-# Create uploads directory
-UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "..", "uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+async def _check_listing_owner(db: AsyncSession, listing_id: int, user_id: int):
+    """404/403 unless the listing exists and belongs to the user"""
+    seller_id = (await db.execute(
+        select(models.Listing.seller_id).where(models.Listing.listing_id == listing_id)
+    )).scalar()
+    if seller_id is None:
+        raise HTTPException(status_code=404, detail="Listing not found")
+    if seller_id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+
+async def _attach_photo(db: AsyncSession, listing_id: int, upload: Upload, alt_text: Optional[str]) -> dict:
+    """Insert the Photo row for a stored upload (storage.py counts the reference)"""
+    # Get current photo count for sort order
+    photo_count = (await db.execute(
+        select(func.count()).select_from(models.Photo).where(models.Photo.listing_id == listing_id)
+    )).scalar()
+    
+    photo = models.Photo(
+        listing_id=listing_id,
+        url=upload_url(upload.filename),
+        content_hash=upload.content_hash,
+        alt_text=alt_text,
+        sort_order=photo_count
+    )
+    db.add(photo)
+    await db.flush()
+    # The last other reference to these bytes may have been deleted mid-upload
+    if not os.path.exists(source_path(photo.url)):
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Upload expired, please upload the photo again")
+    await db.commit()
+    return {"photo_id": photo.photo_id, "url": photo.url, "alt_text": photo.alt_text}
 
 
 @router.post("/upload", status_code=status.HTTP_201_CREATED)
 async def upload_photo(
     file: UploadFile = File(...),
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Upload a photo file and return the URL"""
-    # Validate file type
-    allowed_types = ["image/jpeg", "image/png", "image/gif", "image/webp"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File type {file.content_type} not allowed. Use: {allowed_types}"
-        )
-    
-    # Generate unique filename
-    ext = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-    unique_filename = f"{uuid.uuid4()}.{ext}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
+    # Return the connection to the pool while the file is written
+    await db.close()
     
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # Return URL path
-    url = f"/uploads/{unique_filename}"
+    # Type comes from the file's magic bytes, not the client's content_type
+    upload = await save_upload_file(file)
+    return {"url": upload_url(upload.filename), "filename": upload.filename}
+
+
+@router.post("/upload/stream", status_code=status.HTTP_201_CREATED)
+async def upload_photo_stream(
+    request: Request,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Upload a photo sent as the raw request body and return the URL"""
+    # Return the connection to the pool while the body streams in
+    await db.close()
     
-    return {"url": url, "filename": unique_filename}
+    upload = await save_request_body(request)
+    return {"url": upload_url(upload.filename), "filename": upload.filename}
 
 
 @router.post("/listing/{listing_id}", status_code=status.HTTP_201_CREATED)
@@ -51,85 +81,66 @@ async def add_photo_to_listing(
     listing_id: int,
     file: UploadFile = File(...),
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Upload and attach a photo to a listing"""
     # Verify listing exists and user owns it
-    listing = db.query(models.Listing).filter(models.Listing.listing_id == listing_id).first()
-    if not listing:
-        raise HTTPException(status_code=404, detail="Listing not found")
-    if listing.seller_id != current_user.user_id:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    
-    # Validate file type
-    allowed_types = ["image/jpeg", "image/png", "image/gif", "image/webp"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="Invalid file type")
-    
-    # Generate unique filename
-    ext = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-    unique_filename = f"{uuid.uuid4()}.{ext}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    await _check_listing_owner(db, listing_id, current_user.user_id)
+    # Return the connection to the pool while the file is written
+    await db.close()
     
-    # Get current photo count for sort order
-    photo_count = db.query(models.Photo).filter(models.Photo.listing_id == listing_id).count()
-    
-    # Create photo record
-    photo = models.Photo(
-        listing_id=listing_id,
-        url=f"/uploads/{unique_filename}",
-        alt_text=file.filename,
-        sort_order=photo_count
-    )
-    db.add(photo)
-    db.commit()
-    db.refresh(photo)
+    upload = await save_upload_file(file)
+    return await _attach_photo(db, listing_id, upload, file.filename)
+
+
+@router.post("/listing/{listing_id}/stream", status_code=status.HTTP_201_CREATED)
+async def add_photo_to_listing_stream(
+    listing_id: int,
+    request: Request,
+    alt_text: Optional[str] = Query(None, max_length=255),
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Attach a photo sent as the raw request body to a listing"""
+    # Checked before reading the body, so rejected uploads are never stored
+    await _check_listing_owner(db, listing_id, current_user.user_id)
+    # Return the connection to the pool while the body streams in
+    await db.close()
     
-    return {
-        "photo_id": photo.photo_id,
-        "url": photo.url,
-        "alt_text": photo.alt_text
-    }
+    upload = await save_request_body(request)
+    return await _attach_photo(db, listing_id, upload, alt_text)
 
 
 @router.get("/listing/{listing_id}")
-def get_listing_photos(listing_id: int, db: Session = Depends(get_db)):
+async def get_listing_photos(listing_id: int, db: AsyncSession = Depends(get_read_db)):
     """Get all photos for a listing"""
-    photos = db.query(models.Photo).filter(
-        models.Photo.listing_id == listing_id
-    ).order_by(models.Photo.sort_order).all()
+    photos = (await db.execute(
+        select(models.Photo).where(models.Photo.listing_id == listing_id).order_by(models.Photo.sort_order)
+    )).scalars().all()
     
     return [
-        {"photo_id": p.photo_id, "url": p.url, "alt_text": p.alt_text}
+        {"photo_id": p.photo_id, "url": p.url, "alt_text": p.alt_text, "variants": p.variants}
         for p in photos
     ]
 
 
 @router.delete("/{photo_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_photo(
+async def delete_photo(
     photo_id: int,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Delete a photo"""
-    photo = db.query(models.Photo).filter(models.Photo.photo_id == photo_id).first()
+    photo = await db.get(models.Photo, photo_id)
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
     
     # Verify ownership
-    listing = db.query(models.Listing).filter(models.Listing.listing_id == photo.listing_id).first()
+    listing = await db.get(models.Listing, photo.listing_id)
     if listing.seller_id != current_user.user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    # Delete file from disk
-    file_path = os.path.join(UPLOAD_DIR, os.path.basename(photo.url))
-    if os.path.exists(file_path):
-        os.remove(file_path)
-    
-    db.delete(photo)
-    db.commit()
+    # The file and its variants go once no other photo shares them (see storage.py)
+    await db.delete(photo)
+    await db.commit()
     return None
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import os
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from auth_utils import get_user_from_token
+from realtime import broker, RESYNC
+
+load_dotenv()
+
+router = APIRouter()
+
+# Seconds between keepalives on an idle stream
+REALTIME_KEEPALIVE = float(os.getenv("REALTIME_KEEPALIVE", "25"))
+# A client that cannot take one event within this many seconds is dropped
+REALTIME_SEND_TIMEOUT = float(os.getenv("REALTIME_SEND_TIMEOUT", "10"))
+
+
+async def _authenticate(token: Optional[str]) -> Optional[int]:
+    """Resolve a JWT to a user id with a short-lived session"""
+    if not token:
+        return None
+    async with AsyncSessionLocal() as db:
+        user = await get_user_from_token(db, token)
+        return user.user_id if user else None
+
+
+def _bearer_token(request: Request, token: Optional[str]) -> Optional[str]:
+    """Token from ?token= (EventSource cannot set headers) or Authorization"""
+    if token:
+        return token
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:]
+    return None
+
+
+@router.websocket("/ws")
+async def websocket_events(websocket: WebSocket, token: Optional[str] = Query(None)):
+    """Push message events to the user over a WebSocket (?token=<JWT>)"""
+    user_id = await _authenticate(token)
+    if user_id is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    subscription = broker.subscribe(user_id)
+
+    async def push():
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), timeout=REALTIME_KEEPALIVE)
+            except asyncio.TimeoutError:
+                event = {"type": "ping"}
+            await asyncio.wait_for(websocket.send_json(event), timeout=REALTIME_SEND_TIMEOUT)
+            if event is RESYNC:
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                return
+
+    async def drain():
+        # Incoming frames are ignored; this only notices the disconnect
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.create_task(push()), asyncio.create_task(drain())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        broker.unsubscribe(subscription)
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, asyncio.TimeoutError, WebSocketDisconnect, RuntimeError):
+                pass
+
+
+@router.get("/events")
+async def event_stream(request: Request, token: Optional[str] = Query(None)):
+    """Server-Sent Events fallback for the same message events"""
+    user_id = await _authenticate(_bearer_token(request, token))
+    if user_id is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+
+    subscription = broker.subscribe(user_id)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=REALTIME_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                if event is RESYNC:
+                    return
+        finally:
+            broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
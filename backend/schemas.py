@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field, field_validator
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 from decimal import Decimal
 
@@ -97,6 +97,7 @@ class PhotoResponse(BaseModel):
     url: str
     alt_text: Optional[str] = None
     sort_order: int = 0
+    variants: Optional[Dict[str, Dict[str, str]]] = None
 
     class Config:
         from_attributes = True
@@ -169,6 +170,7 @@ class MessageResponse(BaseModel):
     body: str  # Match DB column name
     is_read: bool
     sent_at: datetime  # Match DB column name
+    read_at: Optional[datetime] = None
     sender: UserBrief
 
     class Config:
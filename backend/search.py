@@ -0,0 +1,82 @@
+"""
+Full-text search for listings.
+
+Postgres uses a GIN index over a tsvector expression, SQLite uses an FTS5
+external-content table kept in sync by triggers (both created by migration
+0002_listing_search). Any other backend falls back to ILIKE matching.
+"""
+import re
+from sqlalchemy import text, literal_column, func, Integer, Float
+import models
+
+# tsvector expression - the query must use exactly the same expression as the
+# index definition (migration 0002) for Postgres to pick the GIN index
+PG_VECTOR = "to_tsvector('simple', coalesce({t}title, '') || ' ' || coalesce({t}description, ''))"
+
+# Indexes created by the search migration but not declared in models.py
+SEARCH_INDEXES = {"listings.ix_listings_search"}
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# engine -> whether listings_fts exists
+_fts_ready = {}
+
+
+def tokenize(search: str) -> list:
+    """Split a search string into plain word tokens (drops query operators)"""
+    return _TOKEN_RE.findall(search.lower())[:16]
+
+
+async def apply_search(db, stmt, search: str):
+    """
+    Restrict a Listing select to rows matching `search`.
+
+    Returns (stmt, rank) where rank is an expression to order by for
+    relevance (best match first), or None if the backend cannot rank.
+    """
+    tokens = tokenize(search)
+    if not tokens:
+        return stmt, None
+    dialect_name = db.get_bind().dialect.name
+
+    if dialect_name == "postgresql":
+        vector = literal_column(PG_VECTOR.format(t="listings."))
+        # Prefix match on every token so search-as-you-type works
+        tsquery = func.to_tsquery(
+            literal_column("'simple'"), " & ".join(f"{t}:*" for t in tokens)
+        )
+        stmt = stmt.where(vector.op("@@")(tsquery))
+        return stmt, func.ts_rank_cd(vector, tsquery).desc()
+
+    if dialect_name == "sqlite" and await _sqlite_fts_ready(db):
+        match = " ".join(f'"{t}"*' for t in tokens)
+        fts = (
+            text(
+                "SELECT rowid AS listing_id, bm25(listings_fts) AS rank "
+                "FROM listings_fts WHERE listings_fts MATCH :match"
+            )
+            .bindparams(match=match)
+            .columns(listing_id=Integer, rank=Float)
+            .subquery("fts")
+        )
+        stmt = stmt.join(fts, fts.c.listing_id == models.Listing.listing_id)
+        # bm25() is lower-is-better
+        return stmt, fts.c.rank.asc()
+
+    # Fallback: substring match on every token
+    for token in tokens:
+        term = f"%{token}%"
+        stmt = stmt.where(
+            models.Listing.title.ilike(term) | models.Listing.description.ilike(term)
+        )
+    return stmt, None
+
+
+async def _sqlite_fts_ready(db) -> bool:
+    """Cache per-engine whether the FTS5 table exists"""
+    bind = db.get_bind()
+    if bind not in _fts_ready:
+        _fts_ready[bind] = (await db.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'listings_fts'")
+        )).first() is not None
+    return _fts_ready[bind]
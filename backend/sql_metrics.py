@@ -0,0 +1,246 @@
+"""
+Per-request SQL instrumentation.
+
+Cursor events on every engine count the statements, DB time and rows of the
+request being served. The totals go out in a Server-Timing header:
+
+    Server-Timing: db;dur=12.40;desc="7 queries, 53 rows", app;dur=31.02
+
+Statements slower than SQL_SLOW_QUERY_MS are logged as JSON with the route
+and the normalized statement (literals and IN lists collapsed to "?"), and
+every statement is aggregated per route so GET /internal/sql can show the
+top SQL_METRICS_TOP statements by total time for each endpoint, which is
+where N+1 patterns show up. SQL_METRICS=false installs nothing.
+"""
+import json
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+from sqlalchemy import event
+from dotenv import load_dotenv
+from logger import logger
+
+load_dotenv()
+
+SQL_METRICS = os.getenv("SQL_METRICS", "true").lower() in ("1", "true", "yes")
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "200"))
+SQL_METRICS_TOP = int(os.getenv("SQL_METRICS_TOP", "10"))
+# Distinct statements kept per route; the rest are summed under "(other)"
+SQL_METRICS_MAX_STATEMENTS = int(os.getenv("SQL_METRICS_MAX_STATEMENTS", "200"))
+
+# The current request's _RequestSQL (see query_budget.py on why one object
+# is shared by the threadpool and greenlets)
+_request_sql: ContextVar = ContextVar("sql_metrics_request", default=None)
+
+_PLACEHOLDER = re.compile(r"\$\d+|%\(\w+\)s|%s")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN \(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def normalize_statement(statement: str) -> str:
+    """SQL with placeholders, literals and IN lists reduced to one shape"""
+    statement = _SPACE.sub(" ", statement).strip()
+    statement = _STRING.sub("?", statement)
+    statement = _PLACEHOLDER.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    return _IN_LIST.sub("IN (?, ...)", statement)
+
+
+def _row_count(cursor) -> int:
+    """Rows returned or affected; the async drivers fetch SELECT rows up front"""
+    if cursor.rowcount is not None and cursor.rowcount >= 0:
+        return cursor.rowcount
+    try:
+        return len(cursor._rows)
+    except (AttributeError, TypeError):
+        return 0
+
+
+_route_paths = {}  # endpoint -> path template
+
+
+def route_path(scope) -> str:
+    """Path template of the endpoint serving `scope`, e.g. /api/listings/{listing_id}"""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "(unmatched)"
+    path = _route_paths.get(endpoint)
+    if path is None:
+        path = next(
+            (route.path for route in scope["app"].routes if getattr(route, "endpoint", None) is endpoint),
+            scope["path"]
+        )
+        _route_paths[endpoint] = path
+    return path
+
+
+def route_label(scope) -> str:
+    """Method and path template, or "background" outside a request"""
+    if scope is None:
+        return "background"
+    return f"{scope.get('method', 'WS')} {route_path(scope)}"
+
+
+class _RequestSQL:
+    """Statements run while serving one request"""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.statements = {}  # normalized SQL -> [calls, seconds, rows, max seconds]
+
+    def add(self, statement: str, seconds: float, rows: int):
+        self.count += 1
+        self.seconds += seconds
+        self.rows += rows
+        entry = self.statements.get(statement)
+        if entry is None:
+            entry = self.statements[statement] = [0, 0.0, 0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] += rows
+        entry[3] = max(entry[3], seconds)
+
+
+class SQLMetrics:
+    """Per-route statement aggregates"""
+
+    def __init__(self, slow_ms: float = SQL_SLOW_QUERY_MS, max_statements: int = SQL_METRICS_MAX_STATEMENTS):
+        self.slow_ms = slow_ms
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self._routes = {}  # route -> {"requests", "queries", "seconds", "rows", "statements"}
+        self.slow_queries = 0
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context.sql_metrics_started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "sql_metrics_started", None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        rows = _row_count(cursor)
+        request = _request_sql.get()
+        if request is not None:
+            request.add(normalize_statement(statement), seconds, rows)
+        if seconds * 1000 >= self.slow_ms:
+            self._log_slow(request, statement, seconds, rows)
+
+    def _log_slow(self, request, statement: str, seconds: float, rows: int):
+        with self._lock:
+            self.slow_queries += 1
+        logger.warning("Slow query: " + json.dumps({
+            "route": route_label(request.scope if request else None),
+            "duration_ms": round(seconds * 1000, 2),
+            "rows": rows,
+            "statement": normalize_statement(statement),
+        }))
+
+    def record(self, request: _RequestSQL):
+        """Fold a finished request into its route's totals"""
+        route = route_label(request.scope)
+        with self._lock:
+            totals = self._routes.get(route)
+            if totals is None:
+                totals = self._routes[route] = {"requests": 0, "queries": 0, "seconds": 0.0, "rows": 0, "statements": {}}
+            totals["requests"] += 1
+            totals["queries"] += request.count
+            totals["seconds"] += request.seconds
+            totals["rows"] += request.rows
+            statements = totals["statements"]
+            for statement, (calls, seconds, rows, slowest) in request.statements.items():
+                if statement not in statements and len(statements) >= self.max_statements:
+                    statement = "(other)"
+                entry = statements.get(statement)
+                if entry is None:
+                    entry = statements[statement] = [0, 0.0, 0, 0.0]
+                entry[0] += calls
+                entry[1] += seconds
+                entry[2] += rows
+                entry[3] = max(entry[3], slowest)
+
+    def stats(self, top: int = SQL_METRICS_TOP) -> dict:
+        """Routes by total DB time, each with its `top` statements"""
+        with self._lock:
+            routes = {
+                route: (dict(totals), {statement: list(entry) for statement, entry in totals["statements"].items()})
+                for route, totals in self._routes.items()
+            }
+            slow_queries = self.slow_queries
+        result = {}
+        for route, (totals, statements) in sorted(routes.items(), key=lambda item: -item[1][0]["seconds"]):
+            requests = totals["requests"]
+            ranked = sorted(statements.items(), key=lambda item: -item[1][1])[:top]
+            result[route] = {
+                "requests": requests,
+                "queries_per_request": round(totals["queries"] / requests, 2) if requests else 0.0,
+                "db_ms_per_request": round(totals["seconds"] / requests * 1000, 2) if requests else 0.0,
+                "rows_per_request": round(totals["rows"] / requests, 2) if requests else 0.0,
+                "top_statements": [
+                    {
+                        "statement": statement,
+                        "calls": calls,
+                        "calls_per_request": round(calls / requests, 2) if requests else 0.0,
+                        "total_ms": round(seconds * 1000, 2),
+                        "avg_ms": round(seconds / calls * 1000, 3) if calls else 0.0,
+                        "max_ms": round(slowest * 1000, 2),
+                        "rows": rows,
+                    }
+                    for statement, (calls, seconds, rows, slowest) in ranked
+                ],
+            }
+        return {"slow_query_ms": self.slow_ms, "slow_queries": slow_queries, "routes": result}
+
+
+sql_metrics = SQLMetrics()
+
+
+class SQLMetricsMiddleware:
+    """Collects each request's statements and adds the Server-Timing header"""
+
+    def __init__(self, app, metrics: SQLMetrics = sql_metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = _RequestSQL(scope)
+        token = _request_sql.set(request)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                timing = (
+                    f'db;dur={request.seconds * 1000:.2f};desc="{request.count} queries, {request.rows} rows", '
+                    f"app;dur={(time.perf_counter() - started) * 1000:.2f}"
+                )
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_sql.reset(token)
+            self.metrics.record(request)
+
+
+def setup_sql_metrics(app, *engines, enabled: bool = SQL_METRICS):
+    """Install cursor timing on `engines` and the request middleware on `app`"""
+    if not enabled:
+        return
+    for engine in dict.fromkeys(engines):
+        event.listen(engine, "before_cursor_execute", sql_metrics.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", sql_metrics.after_cursor_execute)
+    app.add_middleware(SQLMetricsMiddleware)
@@ -0,0 +1,171 @@
+"""
+Production settings for SQLite databases.
+
+With SQLITE_MODE=production (the default) every connection to a SQLite
+file gets WAL journaling, synchronous=NORMAL, a memory map, a larger page
+cache, a busy timeout and foreign key enforcement. In WAL mode readers never
+block on the writer, so the remaining contention is between writers:
+API sessions therefore take turns through a per-process FIFO queue
+(sqlite_writer) from their first write until they commit or roll back,
+instead of spinning in SQLite's busy handler and failing with "database is
+locked". Read-only endpoints get their own query_only connection pool (see
+database.py), so they never wait behind queued writers either.
+
+Writers in other processes (more uvicorn workers, CLIs) and the sync engine
+are still covered by busy_timeout. SQLITE_MODE=default keeps SQLAlchemy's
+defaults, for comparison (benchmarks/sqlite_concurrency.py).
+"""
+import asyncio
+import os
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SQLITE_MODE = os.getenv("SQLITE_MODE", "production").lower()
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE_MB = int(os.getenv("SQLITE_MMAP_SIZE_MB", "256"))
+# NORMAL is durable in WAL mode except for the last commits before a power loss
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+
+
+def sqlite_production(url: str) -> bool:
+    """Whether `url` is a SQLite file that gets the production settings"""
+    url = make_url(url)
+    return (
+        SQLITE_MODE == "production"
+        and url.get_backend_name() == "sqlite"
+        and url.database not in (None, "", ":memory:")
+    )
+
+
+def pragmas(read_only: bool = False) -> list:
+    statements = [
+        "PRAGMA journal_mode=WAL",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE_MB * 1024 * 1024}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        "PRAGMA foreign_keys=ON",
+    ]
+    if read_only:
+        statements.append("PRAGMA query_only=ON")
+    return statements
+
+
+def configure_sqlite(engine, read_only: bool = False):
+    """Apply the pragmas to each new connection of a (sync) engine"""
+    if not sqlite_production(engine.url.render_as_string(hide_password=False)):
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in pragmas(read_only):
+            cursor.execute(statement)
+        cursor.close()
+
+
+class SQLiteWriter:
+    """FIFO turn-taking for sessions that write"""
+
+    def __init__(self):
+        self._lock = None
+        self.writes = 0
+        self.waited = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def start(self):
+        """Create the queue on the running event loop"""
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self._lock is None:
+            self.start()
+        started = time.perf_counter()
+        if self._lock.locked():
+            self.waited += 1
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            await self._lock.acquire()
+        finally:
+            self.queued -= 1
+        waited = time.perf_counter() - started
+        self.writes += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def release(self):
+        self._lock.release()
+
+    def stats(self) -> dict:
+        return {
+            "mode": SQLITE_MODE,
+            "writes": self.writes,
+            "waited": self.waited,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "wait_avg_ms": round(self.wait_total / self.writes * 1000, 2) if self.writes else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 2),
+            "pragmas": pragmas(),
+        }
+
+
+sqlite_writer = SQLiteWriter()
+
+
+class WriteQueuedSession(AsyncSession):
+    """AsyncSession that waits for its turn in sqlite_writer before writing"""
+
+    async def _start_writing(self):
+        if not self.sync_session.info.get("sqlite_writer"):
+            # Check out the connection first: a session holding the turn must
+            # never wait for the pool, whose connections may all be queued here
+            await self.connection()
+            await sqlite_writer.acquire()
+            self.sync_session.info["sqlite_writer"] = True
+
+    def _stop_writing(self):
+        if self.sync_session.info.pop("sqlite_writer", False):
+            sqlite_writer.release()
+
+    def _has_changes(self) -> bool:
+        return bool(self.sync_session.new or self.sync_session.dirty or self.sync_session.deleted)
+
+    async def execute(self, statement, *args, **kwargs):
+        if getattr(statement, "is_dml", False):
+            await self._start_writing()
+        return await super().execute(statement, *args, **kwargs)
+
+    async def flush(self, objects=None):
+        if self._has_changes():
+            await self._start_writing()
+        await super().flush(objects)
+
+    async def commit(self):
+        if self._has_changes():
+            await self._start_writing()
+        try:
+            await super().commit()
+        finally:
+            self._stop_writing()
+
+    async def rollback(self):
+        try:
+            await super().rollback()
+        finally:
+            self._stop_writing()
+
+    async def close(self):
+        try:
+            await super().close()
+        finally:
+            self._stop_writing()
@@ -0,0 +1,430 @@
+"""
+Upload storage: streamed, size-limited, type-sniffed, content-addressed.
+
+Request bodies are consumed chunk by chunk on the event loop while every
+file operation runs in the threadpool, so a slow upload never blocks other
+requests. Files are written to a hidden temp file in UPLOAD_DIR and renamed
+into place only once complete and valid.
+
+Files are named by the SHA-256 of their bytes, so identical uploads are
+stored once. stored_files keeps a reference count per hash, maintained by
+session events whenever Photo rows are added or deleted (including listing
+cascades and admin edits); a file and its variants are deleted when the
+last reference is committed away.
+
+    python storage.py report    # space used and saved by deduplication
+    python storage.py recount   # recompute reference counts from photos
+"""
+import hashlib
+import json
+import os
+import tempfile
+from collections import Counter
+from typing import NamedTuple
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event, select, update, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+import models
+from thumbnails import VARIANTS, FORMATS, variant_filename
+from logger import logger
+
+load_dotenv()
+
+UPLOAD_DIR = os.path.abspath(os.getenv("UPLOAD_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads"))
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 256 * 1024
+# Room for multipart boundaries and part headers around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+TEMP_PREFIX = ".upload-"
+
+# content type -> file extension
+IMAGE_TYPES = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+}
+
+
+def sniff_image_type(head: bytes):
+    """Detect the image type from magic bytes, or None if not a supported image"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+class Upload(NamedTuple):
+    filename: str
+    content_hash: str
+    size: int
+    content_type: str
+
+
+class UploadWriter:
+    """Writes one upload to a temp file, hashing it, and commits it with an atomic rename"""
+
+    def __init__(self, max_bytes: int = MAX_UPLOAD_BYTES, upload_dir: str = UPLOAD_DIR):
+        self.max_bytes = max_bytes
+        self.upload_dir = upload_dir
+        self.size = 0
+        self.content_type = None
+        self._head = b""
+        self._hash = hashlib.sha256()
+        self._file = None
+        self._temp_path = None
+
+    async def __aenter__(self):
+        fd, self._temp_path = await run_in_threadpool(
+            tempfile.mkstemp, dir=self.upload_dir, prefix=TEMP_PREFIX
+        )
+        self._file = os.fdopen(fd, "wb")
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # Anything still in the temp file was not committed
+        if self._file is not None:
+            await run_in_threadpool(self._discard)
+
+    def _discard(self):
+        self._file.close()
+        self._file = None
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+    async def write(self, chunk: bytes):
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File too large (max {self.max_bytes // (1024 * 1024)} MB)"
+            )
+        if self.content_type is None and len(self._head) < 16:
+            self._head += chunk[:16]
+            if len(self._head) >= 12:
+                self._check_type()
+        await run_in_threadpool(self._write, chunk)
+
+    def _write(self, chunk: bytes):
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def _check_type(self):
+        self.content_type = sniff_image_type(self._head)
+        if self.content_type is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"File is not a supported image. Use: {list(IMAGE_TYPES)}"
+            )
+
+    async def commit(self) -> Upload:
+        """Move the finished file into place under its content hash"""
+        if self.content_type is None:
+            self._check_type()
+        content_hash = self._hash.hexdigest()
+        filename = f"{content_hash}.{IMAGE_TYPES[self.content_type]}"
+        await run_in_threadpool(self._finish, os.path.join(self.upload_dir, filename))
+        return Upload(filename, content_hash, self.size, self.content_type)
+
+    def _finish(self, final_path: str):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        if os.path.exists(final_path):
+            # Same bytes are already stored; touch them so upload_gc's grace period applies
+            os.remove(self._temp_path)
+            os.utime(final_path)
+        else:
+            os.replace(self._temp_path, final_path)
+
+
+async def save_upload_file(file) -> Upload:
+    """Stream a multipart UploadFile into storage"""
+    async with UploadWriter() as writer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await writer.write(chunk)
+        return await writer.commit()
+
+
+async def save_request_body(request) -> Upload:
+    """Stream a raw request body into storage"""
+    async with UploadWriter() as writer:
+        async for chunk in request.stream():
+            await writer.write(chunk)
+        return await writer.commit()
+
+
+def upload_url(filename: str) -> str:
+    return f"/uploads/{filename}"
+
+
+def source_path(url: str):
+    """Local file behind an /uploads/ URL, or None for external URLs"""
+    if not url or not url.startswith("/uploads/"):
+        return None
+    return os.path.join(UPLOAD_DIR, os.path.basename(url))
+
+
+def stored_paths(url: str) -> list:
+    """An upload and every variant that may have been rendered from it"""
+    path = source_path(url)
+    if path is None:
+        return []
+    filename = os.path.basename(path)
+    return [path] + [
+        os.path.join(UPLOAD_DIR, variant_filename(filename, variant, extension))
+        for variant in VARIANTS
+        for extension, _ in FORMATS.values()
+    ]
+
+
+def remove_files(paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+# ============== Request size limit ==============
+
+class _BodyTooLarge(HTTPException):
+    # An HTTPException, so FastAPI lets it through request.form() (which turns
+    # other errors into a 400) and answers 413 even for chunked bodies
+    def __init__(self):
+        super().__init__(status_code=413, detail="Request body too large")
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject upload requests whose body exceeds the limit while it is still
+    arriving - before Starlette has buffered a multipart body to disk.
+    """
+
+    def __init__(self, app, path_prefix: str = "/api/photos",
+                 max_bytes: int = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT") \
+                or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None:
+            try:
+                content_length = int(content_length)
+            except ValueError:
+                await self._reject(send, 400, "Invalid Content-Length header")
+                return
+            if content_length > self.max_bytes:
+                await self._reject(send)
+                return
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise _BodyTooLarge()
+            return message
+
+        async def tracking_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except _BodyTooLarge:
+            if not started:
+                await self._reject(send)
+
+    async def _reject(self, send, status: int = 413, detail: str = "Request body too large"):
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+# ============== Reference counting ==============
+
+stored_files = models.StoredFile.__table__
+
+
+def _upsert(dialect_name: str):
+    insert = pg_insert if dialect_name == "postgresql" else sqlite_insert
+    stmt = insert(stored_files)
+    return stmt.on_conflict_do_update(
+        index_elements=[stored_files.c.content_hash],
+        set_={"refcount": stored_files.c.refcount + stmt.excluded.refcount}
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _count_references(session, flush_context):
+    added, removed = Counter(), Counter()
+    urls = {}
+    released = session.info.setdefault("released_files", [])
+    for obj in session.new:
+        if isinstance(obj, models.Photo) and obj.content_hash:
+            added[obj.content_hash] += 1
+            urls[obj.content_hash] = obj.url
+    for obj in session.deleted:
+        if not isinstance(obj, models.Photo):
+            continue
+        if obj.content_hash:
+            removed[obj.content_hash] += 1
+            urls[obj.content_hash] = obj.url
+        else:
+            # Uploads from before content addressing belong to one photo
+            released.append((None, obj.url))
+    if not added and not removed:
+        return
+
+    conn = session.connection()
+    rows = []
+    for content_hash, count in sorted(added.items()):
+        path = source_path(urls[content_hash])
+        size = os.path.getsize(path) if path and os.path.exists(path) else 0
+        rows.append({"content_hash": content_hash, "size": size, "refcount": count})
+    if rows:
+        conn.execute(_upsert(conn.dialect.name), rows)
+    # Sorted so concurrent deletes lock rows in the same order
+    for content_hash, count in sorted(removed.items()):
+        remaining = conn.execute(
+            update(stored_files).where(stored_files.c.content_hash == content_hash)
+            .values(refcount=stored_files.c.refcount - count)
+            .returning(stored_files.c.refcount)
+        ).scalar()
+        if remaining is not None and remaining <= 0:
+            conn.execute(delete(stored_files).where(stored_files.c.content_hash == content_hash))
+            released.append((content_hash, urls[content_hash]))
+
+
+@event.listens_for(Session, "after_commit")
+def _remove_released(session):
+    released = session.info.pop("released_files", None)
+    if not released:
+        return
+    hashes = [content_hash for content_hash, _ in released if content_hash]
+    revived = set()
+    if hashes:
+        # Re-uploaded and attached again since the last reference went
+        with session.get_bind().connect() as conn:
+            revived = set(conn.execute(
+                select(stored_files.c.content_hash).where(stored_files.c.content_hash.in_(hashes))
+            ).scalars())
+    for content_hash, url in released:
+        if content_hash not in revived:
+            try:
+                remove_files(stored_paths(url))
+            except OSError as e:
+                logger.error(f"Could not remove {url}: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _keep_released(session):
+    session.info.pop("released_files", None)
+
+
+def usage_report(bind) -> dict:
+    """Stored vs referenced bytes; the difference is what deduplication saved"""
+    with bind.connect() as conn:
+        files, stored, referenced = conn.execute(select(
+            func.count(),
+            func.coalesce(func.sum(stored_files.c.size), 0),
+            func.coalesce(func.sum(stored_files.c.size * stored_files.c.refcount), 0)
+        )).one()
+        references = conn.execute(select(func.coalesce(func.sum(stored_files.c.refcount), 0))).scalar()
+    return {
+        "files": files,
+        "references": int(references),
+        "stored_bytes": int(stored),
+        "referenced_bytes": int(referenced),
+        "saved_bytes": int(referenced - stored),
+    }
+
+
+def recount(bind) -> dict:
+    """Recompute stored_files from the photos table (repairs drift from raw SQL deletes)"""
+    photos = models.Photo.__table__
+    with bind.begin() as conn:
+        counts = dict(conn.execute(
+            select(photos.c.content_hash, func.count())
+            .where(photos.c.content_hash.isnot(None))
+            .group_by(photos.c.content_hash)
+        ).all())
+        existing = dict(conn.execute(select(stored_files.c.content_hash, stored_files.c.refcount)).all())
+        report = {"fixed": 0, "added": 0, "removed": 0}
+        for content_hash, refcount in existing.items():
+            if content_hash not in counts:
+                conn.execute(delete(stored_files).where(stored_files.c.content_hash == content_hash))
+                report["removed"] += 1
+            elif counts[content_hash] != refcount:
+                conn.execute(update(stored_files).where(stored_files.c.content_hash == content_hash)
+                             .values(refcount=counts[content_hash]))
+                report["fixed"] += 1
+        missing = set(counts) - set(existing)
+        urls = {}
+        if missing:
+            urls = dict(conn.execute(
+                select(photos.c.content_hash, func.min(photos.c.url))
+                .where(photos.c.content_hash.in_(missing))
+                .group_by(photos.c.content_hash)
+            ).all())
+        for content_hash, url in urls.items():
+            path = source_path(url)
+            conn.execute(stored_files.insert().values(
+                content_hash=content_hash,
+                size=os.path.getsize(path) if path and os.path.exists(path) else 0,
+                refcount=counts[content_hash]
+            ))
+            report["added"] += 1
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Upload storage maintenance")
+    parser.add_argument("command", choices=["report", "recount"])
+    args = parser.parse_args()
+
+    if args.command == "recount":
+        result = recount(engine)
+        print(f"{result['fixed']} fixed, {result['added']} added, {result['removed']} removed")
+    else:
+        result = usage_report(engine)
+        print(
+            f"{result['files']} files for {result['references']} photos: "
+            f"{result['stored_bytes'] / 2**20:.1f} MB stored, "
+            f"{result['referenced_bytes'] / 2**20:.1f} MB referenced, "
+            f"{result['saved_bytes'] / 2**20:.1f} MB saved"
+        )
@@ -0,0 +1,71 @@
+"""
+Shared test setup.
+
+The API runs against a throwaway SQLite database migrated to head and a
+throwaway upload directory, with QUERY_BUDGET_MODE=raise (an endpoint over
+its budget fails the test) and the response cache off, so every request
+runs its queries. Run from backend/:
+
+    python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+TEST_DIR = tempfile.mkdtemp(prefix="marketplace-tests-")
+
+# Settings are read at import time, so they must be in place before the app is imported
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{TEST_DIR}/app.db",
+    "UPLOAD_DIR": f"{TEST_DIR}/uploads",
+    "DATABASE_REPLICA_URLS": "",
+    "SECRET_KEY": "test-secret-key",
+    "BCRYPT_ROUNDS": "4",
+    "QUERY_BUDGET_MODE": "raise",
+    "RESPONSE_CACHE_TTL": "0",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = "test-password"
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    import migrations
+    from database import engine
+    from main import app
+
+    migrations.upgrade(engine)
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def register(client):
+    """Create a user; returns (user_id, auth headers)"""
+    def register(prefix: str = "user"):
+        name = f"{prefix}_{uuid.uuid4().hex[:8]}"
+        response = client.post("/api/auth/register", json={
+            "username": name, "email": f"{name}@example.com", "password": PASSWORD
+        })
+        assert response.status_code == 201, response.text
+        body = response.json()
+        return body["user"]["user_id"], {"Authorization": f"Bearer {body['access_token']}"}
+    return register
+
+
+@pytest.fixture
+def create_listing(client):
+    """Create a published listing as `headers`; returns its id"""
+    def create_listing(headers: dict, title: str = "Calculus textbook", **fields):
+        response = client.post("/api/listings", headers=headers, json={
+            "title": title, "description": "Lightly used", "price": 25,
+            "condition": "good", "quantity": 1, "status": "published", **fields
+        })
+        assert response.status_code == 201, response.text
+        return response.json()["listing_id"]
+    return create_listing
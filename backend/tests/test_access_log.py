@@ -0,0 +1,85 @@
+import logging
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import access_log
+from access_log import AccessLogMiddleware, access_logger
+from logger import log_context
+
+
+class _Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def access_lines():
+    """Access log records written during the test"""
+    handler = _Collect()
+    access_logger.addHandler(handler)
+    yield handler.records
+    access_logger.removeHandler(handler)
+
+
+def make_client(sample_rate: float, route_rates: dict = None) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    def item(item_id: int):
+        # Anything logged while serving the request carries its id
+        return {"request_id": log_context.get().request_id}
+
+    @app.get("/broken")
+    def broken():
+        raise HTTPException(status_code=503, detail="Down")
+
+    app.add_middleware(AccessLogMiddleware, sample_rate=sample_rate, route_rates=route_rates or {})
+    return TestClient(app)
+
+
+def test_requests_are_sampled_per_route(access_lines):
+    client = make_client(0, {"GET /items/{item_id}": 1})
+
+    response = client.get("/items/1", headers={"X-Request-ID": "abc-123"})
+    assert response.headers["X-Request-ID"] == response.json()["request_id"] == "abc-123"
+    client.get("/missing")
+
+    [line] = access_lines
+    assert (line.path, line.status, line.sample_rate) == ("/items/1", 200, 1)
+    assert line.getMessage().startswith("GET /items/1 200 ")
+
+
+def test_sample_rate_is_recorded_on_each_line(access_lines, monkeypatch):
+    client = make_client(0.25)
+    draws = iter([0.1, 0.3, 0.2, 0.9])
+    monkeypatch.setattr(access_log.random, "random", lambda: next(draws))
+
+    for item_id in range(4):
+        client.get(f"/items/{item_id}")
+    assert [(line.path, line.sample_rate) for line in access_lines] == [("/items/0", 0.25), ("/items/2", 0.25)]
+
+
+def test_errors_and_slow_requests_are_always_logged(access_lines, monkeypatch):
+    client = make_client(0)
+
+    client.get("/broken")
+    assert [(line.status, line.sample_rate) for line in access_lines] == [(503, 1.0)]
+
+    monkeypatch.setattr(access_log, "ACCESS_LOG_SLOW_MS", 0)
+    client.get("/items/1")
+    assert [(line.status, line.sample_rate) for line in access_lines] == [(503, 1.0), (200, 1.0)]
+
+
+def test_malformed_request_ids_are_replaced(access_lines):
+    client = make_client(1)
+
+    response = client.get("/items/1", headers={"X-Request-ID": "no spaces or\tcontrol chars"})
+    request_id = response.headers["X-Request-ID"]
+    assert request_id != "no spaces or\tcontrol chars" and len(request_id) == 32
+    assert response.json()["request_id"] == request_id
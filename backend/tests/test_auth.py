@@ -0,0 +1,44 @@
+import re
+
+import models
+from auth_cache import auth_cache
+from database import SessionLocal
+
+
+def queries(response) -> int:
+    """Statements the request ran, from its Server-Timing header"""
+    assert response.status_code == 200, response.text
+    return int(re.search(r'desc="(\d+) queries', response.headers["Server-Timing"]).group(1))
+
+
+def test_authenticated_requests_reuse_the_cached_user(client, register):
+    _, headers = register("buyer")
+
+    first = client.get("/api/auth/me", headers=headers)
+    hits = auth_cache.users.hits
+    second = client.get("/api/auth/me", headers=headers)
+    assert (queries(first), queries(second)) == (1, 0)
+    assert auth_cache.users.hits == hits + 1
+    assert second.json() == first.json()
+
+
+def test_user_changes_drop_the_cached_user(client, register):
+    user_id, headers = register("buyer")
+    client.get("/api/auth/me", headers=headers)
+
+    response = client.put("/api/auth/me", headers=headers, json={"display_name": "New name"})
+    assert response.status_code == 200, response.text
+    me = client.get("/api/auth/me", headers=headers)
+    assert queries(me) == 1
+    assert me.json()["display_name"] == "New name"
+
+    # Edits outside the API (admin panel, scripts) go through the same session events
+    with SessionLocal() as db:
+        db.get(models.User, user_id).role = "seller"
+        db.commit()
+    assert client.get("/api/auth/me", headers=headers).json()["role"] == "seller"
+
+    with SessionLocal() as db:
+        db.delete(db.get(models.User, user_id))
+        db.commit()
+    assert client.get("/api/auth/me", headers=headers).status_code == 401
@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+
+import models
+from cache import response_cache
+from database import SessionLocal
+
+
+@pytest.fixture
+def cache_on(monkeypatch):
+    """Turn the response cache on (tests run with it off) with no entries"""
+    monkeypatch.setattr(response_cache, "ttl", 30)
+    response_cache.backend.clear()
+    yield response_cache
+    response_cache.backend.clear()
+
+
+def test_a_commit_during_the_read_is_not_cached(client, register, create_listing, cache_on, monkeypatch):
+    _, headers = register("seller")
+    listing_id = create_listing(headers, "Old title")
+
+    import routers.listings
+    load_listing = routers.listings.load_listing
+
+    def rename():
+        with SessionLocal() as session:
+            session.get(models.Listing, listing_id).title = "New title"
+            session.commit()
+
+    async def load_then_commit(db, listing_id):
+        # The read returns the old row, then another request commits a change
+        # (in its own thread, outside this request's query budget)
+        listing = await load_listing(db, listing_id)
+        writer = threading.Thread(target=rename)
+        writer.start()
+        writer.join()
+        return listing
+
+    monkeypatch.setattr(routers.listings, "load_listing", load_then_commit)
+    raced = cache_on.raced_stores
+    response = client.get(f"/api/listings/{listing_id}")
+    assert response.json()["title"] == "Old title"
+    assert cache_on.raced_stores == raced + 1
+
+    monkeypatch.setattr(routers.listings, "load_listing", load_listing)
+    response = client.get(f"/api/listings/{listing_id}")
+    assert response.headers["X-Cache"] == "MISS"
+    assert response.json()["title"] == "New title"
+    assert client.get(f"/api/listings/{listing_id}").headers["X-Cache"] == "HIT"
+
+
+def test_writes_drop_the_cached_responses_they_change(client, register, create_listing, cache_on):
+    _, headers = register("seller")
+    listing_id = create_listing(headers, "Bookshelf")
+    other_id = create_listing(headers, "Armchair")
+    _, stranger = register("stranger")
+    unrelated_id = create_listing(stranger, "Rug")
+
+    def cached(path):
+        response = client.get(path)
+        assert response.status_code == 200, response.text
+        return response.headers["X-Cache"] == "HIT", response.json()
+
+    paths = ["/api/listings", f"/api/listings/{listing_id}", f"/api/listings/{other_id}", f"/api/listings/{unrelated_id}"]
+    for path in paths:
+        cached(path)
+    assert all(cached(path)[0] for path in paths)
+
+    response = client.put(f"/api/listings/{listing_id}", headers=headers, json={"title": "Tall bookshelf"})
+    assert response.status_code == 200, response.text
+    hit, listing = cached(f"/api/listings/{listing_id}")
+    assert not hit and listing["title"] == "Tall bookshelf"
+    hit, feed = cached("/api/listings")
+    assert not hit and "Tall bookshelf" in [listing["title"] for listing in feed]
+    assert cached(f"/api/listings/{other_id}")[0]
+
+    # The seller is embedded in each of their listings, and only theirs
+    response = client.put("/api/auth/me", headers=headers, json={"display_name": "Renamed seller"})
+    assert response.status_code == 200, response.text
+    hit, listing = cached(f"/api/listings/{other_id}")
+    assert not hit and listing["seller"]["display_name"] == "Renamed seller"
+    assert cached(f"/api/listings/{unrelated_id}")[0]
@@ -0,0 +1,142 @@
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, select
+
+import models
+from database import engine
+from search import _fts_ready
+from view_counter import ViewCounter, view_counter
+
+
+@pytest.fixture
+def category(client):
+    """A fresh category, so a feed filtered by it holds only this test's listings"""
+    response = client.post("/api/categories", json={"name": f"category_{uuid.uuid4().hex[:8]}"})
+    assert response.status_code == 201, response.text
+    return response.json()["category_id"]
+
+
+def search(client, text: str, **params):
+    response = client.get("/api/listings", params={"search": text, **params})
+    assert response.status_code == 200, response.text
+    return [listing["listing_id"] for listing in response.json()]
+
+
+def pages(client, **params):
+    """Follow X-Next-Cursor from the first page; returns the listing ids of each page"""
+    result, cursor = [], None
+    while True:
+        response = client.get("/api/listings", params={**params, "cursor": cursor} if cursor else params)
+        assert response.status_code == 200, response.text
+        result.append([listing["listing_id"] for listing in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return result
+
+
+def test_cursor_pages_do_not_shift_when_listings_are_added(client, register, create_listing, category):
+    _, headers = register("seller")
+    # Created within the same second: created_at ties, listing_id breaks them
+    ids = [create_listing(headers, f"Lamp {i}", category_id=category) for i in range(5)]
+
+    first = client.get("/api/listings", params={"category_id": category, "limit": 2})
+    assert [listing["listing_id"] for listing in first.json()] == ids[:-3:-1]
+
+    # A new listing sorts first; with offset paging the next page would repeat a row
+    create_listing(headers, "Lamp 5", category_id=category)
+    rest = pages(client, category_id=category, limit=2, cursor=first.headers["X-Next-Cursor"])
+    assert [listing_id for page in rest for listing_id in page] == ids[-3::-1]
+
+
+def test_cursor_breaks_price_ties_by_id(client, register, create_listing, category):
+    _, headers = register("seller")
+    ids = [create_listing(headers, f"Chair {i}", category_id=category, price=price)
+           for i, price in enumerate([10, 5, 10, 10, 5])]
+
+    result = pages(client, category_id=category, sort_by="price_low", limit=2)
+    assert [len(page) for page in result] == [2, 2, 1]
+    assert [listing_id for page in result for listing_id in page] == [
+        ids[1], ids[4], ids[0], ids[2], ids[3]
+    ]
+
+
+def test_cursor_is_rejected_for_another_sort(client, register, create_listing, category):
+    _, headers = register("seller")
+    for i in range(3):
+        create_listing(headers, f"Desk {i}", category_id=category)
+    cursor = client.get("/api/listings", params={"category_id": category, "limit": 1}).headers["X-Next-Cursor"]
+
+    response = client.get("/api/listings", params={"sort_by": "price_low", "cursor": cursor})
+    assert response.status_code == 400
+    assert client.get("/api/listings", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_search_uses_fts5_and_ranks_by_relevance(client, register, create_listing):
+    _, headers = register("seller")
+    word = f"zeb{uuid.uuid4().hex[:8]}"
+    # Created first, so only the ranking (not the newest-first order) puts it first
+    in_both = create_listing(headers, f"{word.title()} lamp", description=f"Genuine {word}, barely used")
+    in_description = create_listing(headers, "Old bicycle", description=f"Comes with a {word} bell and lights")
+    create_listing(headers, "Unrelated desk")
+
+    assert search(client, word) == [in_both, in_description]
+    # Served by the FTS5 table, not the LIKE fallback
+    assert _fts_ready and all(_fts_ready.values())
+    # Prefix match on every token, case-insensitive, operators dropped
+    assert search(client, word[:-3].upper()) == [in_both, in_description]
+    assert search(client, f'{word} "lamp" -') == [in_both]
+    assert search(client, f"{word} nothing_matches_this") == []
+
+
+def test_search_follows_edits_and_deletes(client, register, create_listing):
+    _, headers = register("seller")
+    before, after = f"old{uuid.uuid4().hex[:8]}", f"new{uuid.uuid4().hex[:8]}"
+    listing_id = create_listing(headers, f"Kettle {before}")
+
+    assert search(client, before) == [listing_id]
+    response = client.put(f"/api/listings/{listing_id}", headers=headers, json={"title": f"Kettle {after}"})
+    assert response.status_code == 200, response.text
+    assert search(client, before) == []
+    assert search(client, after) == [listing_id]
+
+    assert client.delete(f"/api/listings/{listing_id}", headers=headers).status_code == 204
+    assert search(client, after) == []
+
+
+def stored_views(listing_id: int) -> int:
+    with engine.connect() as conn:
+        return conn.execute(
+            select(models.Listing.view_count).where(models.Listing.listing_id == listing_id)
+        ).scalar() or 0
+
+
+def test_views_are_counted_in_memory_and_written_in_one_flush(client, register, create_listing):
+    _, headers = register("seller")
+    listing_id = create_listing(headers)
+
+    # Unflushed views are included in the response straight away
+    counts = [client.get(f"/api/listings/{listing_id}").json()["view_count"] for _ in range(3)]
+    assert counts == [1, 2, 3]
+
+    view_counter.flush()
+    assert view_counter.pending(listing_id) == 0
+    assert stored_views(listing_id) == 3
+    assert client.get(f"/api/listings/{listing_id}").json()["view_count"] == 4
+
+
+def test_failed_flush_keeps_the_views(client, register, create_listing, tmp_path):
+    _, headers = register("seller")
+    listing_id = create_listing(headers)
+    # No listings table in this database: the UPDATE fails
+    counter = ViewCounter(create_engine(f"sqlite:///{tmp_path}/empty.db"))
+    counter.record(listing_id)
+    counter.record(listing_id)
+
+    assert counter.flush() == 0
+    assert counter.pending(listing_id) == 2
+
+    counter.bind = engine
+    assert counter.flush() == 1
+    assert counter.pending(listing_id) == 0
+    assert stored_views(listing_id) == 2
@@ -0,0 +1,179 @@
+"""Messages and the conversations summary table (conversations.py)"""
+import asyncio
+
+import httpx
+from sqlalchemy import func, select, update
+
+import conversations
+import models
+from database import SessionLocal, engine
+from sqlite_mode import sqlite_writer
+
+
+def unread_in_inbox(client, headers, other_id: int) -> int:
+    """The inbox's unread count for the thread with other_id (from the summary table)"""
+    inbox = client.get("/api/messages/conversations", headers=headers).json()
+    return next(thread["unread_count"] for thread in inbox if thread["user"]["user_id"] == other_id)
+
+
+def unread_in_messages(reader_id: int, sender_id: int) -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).where(
+            models.Message.sender_id == sender_id, models.Message.receiver_id == reader_id,
+            models.Message.is_read.is_not(True)
+        )).scalar()
+
+
+def send(client, headers, receiver_id: int, body: str = "Is this still available?", listing_id: int = None):
+    response = client.post("/api/messages", headers=headers, json={
+        "receiver_id": receiver_id, "listing_id": listing_id, "body": body
+    })
+    assert response.status_code == 201, response.text
+    return response.json()
+
+
+def test_concurrent_page_loads_count_each_read_once(client, register):
+    seller_id, seller = register("seller")
+    buyer_id, buyer = register("buyer")
+    for n in range(3):
+        send(client, buyer, seller_id, f"Question {n}")
+    page = f"/api/messages/conversation/{buyer_id}?limit=2"
+
+    async def load_twice():
+        # Two tabs loading the same page at once: hold the write turn until both
+        # have read the page and queued to mark it read
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=client.app), base_url="http://testserver") as http:
+            await sqlite_writer.acquire()
+            try:
+                loads = [asyncio.ensure_future(http.get(page, headers=seller)) for _ in range(2)]
+                async with asyncio.timeout(5):
+                    while sqlite_writer.queued < 2:
+                        await asyncio.sleep(0.01)
+            finally:
+                sqlite_writer.release()
+            return await asyncio.gather(*loads)
+
+    assert all(response.status_code == 200 for response in client.portal.call(load_twice))
+    assert unread_in_messages(seller_id, buyer_id) == 1
+    assert unread_in_inbox(client, seller, buyer_id) == 1
+
+    send(client, buyer, seller_id, "Hello?")
+    assert unread_in_inbox(client, seller, buyer_id) == unread_in_messages(seller_id, buyer_id) == 2
+
+
+def test_marking_a_message_read_twice_counts_once(client, register):
+    seller_id, seller = register("seller")
+    buyer_id, buyer = register("buyer")
+    first = send(client, buyer, seller_id)
+    send(client, buyer, seller_id)
+
+    for _ in range(2):
+        response = client.put(f"/api/messages/{first['message_id']}/read", headers=seller)
+        assert response.status_code == 200
+        assert response.json()["is_read"] is True
+    assert unread_in_inbox(client, seller, buyer_id) == 1
+    # Only the receiver can mark a message read
+    assert client.put(f"/api/messages/{first['message_id']}/read", headers=buyer).status_code == 404
+
+
+def thread_with(client, headers, other_id: int):
+    inbox = client.get("/api/messages/conversations", headers=headers).json()
+    return [thread for thread in inbox if thread["user"]["user_id"] == other_id]
+
+
+def assert_summary_matches_messages():
+    with engine.begin() as conn:
+        report = conversations.rebuild(conn, dry_run=True)
+    assert (report["missing"], report["stale"], report["orphaned"]) == (0, 0, 0)
+
+
+def test_deleting_a_listing_keeps_its_thread_in_the_inbox(client, register, create_listing):
+    seller_id, seller = register("seller")
+    buyer_id, buyer = register("buyer")
+    listing_id = create_listing(seller)
+    send(client, buyer, seller_id, "Is this still available?", listing_id=listing_id)
+
+    assert client.delete(f"/api/listings/{listing_id}", headers=seller).status_code == 204
+
+    # The messages now belong to the thread without a listing
+    [thread] = thread_with(client, seller, buyer_id)
+    assert thread["listing"] is None
+    assert thread["last_message"]["body"] == "Is this still available?"
+    assert thread["unread_count"] == 1
+    assert_summary_matches_messages()
+
+
+def test_deleting_the_last_message_falls_back_to_the_previous_one(client, register):
+    seller_id, seller = register("seller")
+    buyer_id, buyer = register("buyer")
+    send(client, buyer, seller_id, "First")
+    last = send(client, buyer, seller_id, "Second")
+
+    with SessionLocal() as db:
+        db.delete(db.get(models.Message, last["message_id"]))
+        db.commit()
+
+    [thread] = thread_with(client, seller, buyer_id)
+    assert thread["last_message"]["body"] == "First"
+    assert thread["unread_count"] == 1
+    assert_summary_matches_messages()
+
+
+def test_sender_gets_a_read_receipt(client, register):
+    seller_id, seller = register("seller")
+    buyer_id, buyer = register("buyer")
+    sent = send(client, buyer, seller_id)
+    token = buyer["Authorization"].split()[1]
+
+    with client.websocket_connect(f"/api/realtime/ws?token={token}") as websocket:
+        [read] = client.get(f"/api/messages/conversation/{buyer_id}", headers=seller).json()
+        event = websocket.receive_json()
+        while event["type"] == "ping":
+            event = websocket.receive_json()
+
+    assert event["type"] == "read"
+    assert event["reader_id"] == seller_id
+    assert event["message_ids"] == [sent["message_id"]]
+    assert event["read_at"] == read["read_at"]
+
+
+def test_inbox_is_read_from_the_summary_table(client, register, create_listing):
+    me_id, me = register("seller")
+    alice_id, alice = register("alice")
+    bob_id, bob = register("bob")
+    lamp, desk = create_listing(me, "Lamp"), create_listing(me, "Desk")
+
+    send(client, alice, me_id, "Lamp still there?", listing_id=lamp)
+    send(client, bob, me_id, "Desk price?", listing_id=desk)
+    send(client, alice, me_id, "Desk too?", listing_id=desk)
+    send(client, alice, me_id, "I can pick both up today", listing_id=lamp)
+    send(client, me, alice_id, "Sure", listing_id=lamp)
+
+    # One thread per (user, listing); sent_at ties within a second, so compare unordered
+    def threads(headers):
+        return sorted(
+            (thread["user"]["user_id"], thread["listing"]["listing_id"], thread["last_message"]["body"], thread["unread_count"])
+            for thread in client.get("/api/messages/conversations", headers=headers).json()
+        )
+
+    assert threads(me) == sorted([
+        (alice_id, lamp, "Sure", 2),
+        (alice_id, desk, "Desk too?", 1),
+        (bob_id, desk, "Desk price?", 1),
+    ])
+    assert threads(alice) == sorted([(me_id, lamp, "Sure", 1), (me_id, desk, "Desk too?", 0)])
+    assert_summary_matches_messages()
+
+    # The counts come from the summary row, not from counting messages
+    low, high = sorted((me_id, alice_id))
+    unread = models.Conversation.unread_low if me_id == low else models.Conversation.unread_high
+    with engine.begin() as conn:
+        conn.execute(update(models.Conversation).where(
+            models.Conversation.user_low_id == low, models.Conversation.user_high_id == high,
+            models.Conversation.listing_id == lamp
+        ).values({unread: 7}))
+    assert (alice_id, lamp, "Sure", 7) in threads(me)
+
+    with engine.begin() as conn:
+        assert conversations.rebuild(conn)["stale"] == 1
+    assert (alice_id, lamp, "Sure", 2) in threads(me)
@@ -0,0 +1,18 @@
+"""GET /metrics is only served with METRICS_TOKEN set, and then only to that token"""
+import main
+
+
+def test_metrics_off_without_token(client, monkeypatch):
+    monkeypatch.setattr(main, "METRICS_TOKEN", None)
+
+    assert client.get("/metrics").status_code == 404
+
+
+def test_metrics_require_token(client, monkeypatch):
+    monkeypatch.setattr(main, "METRICS_TOKEN", "scrape-token")
+
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Bearer scrape-token"})
+    assert response.status_code == 200
+    assert "http_requests_total" in response.text
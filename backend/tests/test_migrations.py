@@ -0,0 +1,78 @@
+"""Frozen migrations (migrations/versions) against models.py"""
+import importlib
+
+import pytest
+from sqlalchemy import create_engine, insert, inspect
+
+import conversations
+import migrations
+import models
+from search import SEARCH_INDEXES
+
+
+def migrated(tmp_path, until: str = None):
+    """A fresh database with every migration (or those before `until`) applied"""
+    engine = create_engine(f"sqlite:///{tmp_path}/migrated.db")
+    if until is None:
+        migrations.upgrade(engine)
+        return engine
+    for version, module_name in migrations.discover():
+        if version >= until:
+            break
+        with engine.begin() as conn:
+            importlib.import_module(f"migrations.versions.{module_name}").upgrade(conn)
+    return engine
+
+
+def shape(engine, table_names) -> dict:
+    """Columns (type, nullable), indexes and unique constraints per table"""
+    inspector = inspect(engine)
+    return {
+        name: {
+            "columns": {
+                column["name"]: (str(column["type"]), column["nullable"])
+                for column in inspector.get_columns(name)
+            },
+            "indexes": sorted(
+                (index["name"], tuple(index["column_names"]), bool(index["unique"]))
+                for index in inspector.get_indexes(name)
+            ),
+            "unique": sorted(tuple(unique["column_names"]) for unique in inspector.get_unique_constraints(name)),
+        }
+        for name in table_names
+    }
+
+
+def test_fresh_database_matches_models(tmp_path):
+    replayed = migrated(tmp_path)
+    declared = create_engine(f"sqlite:///{tmp_path}/declared.db")
+    models.Base.metadata.create_all(declared)
+    tables = sorted(models.Base.metadata.tables)
+
+    assert shape(replayed, tables) == shape(declared, tables)
+    report = migrations.check_indexes(replayed, models.Base.metadata)
+    assert report["missing"] == []
+    assert [name for name in report["undeclared"] if name not in SEARCH_INDEXES] == []
+
+
+@pytest.mark.parametrize("listing", [None, "listing"])
+def test_conversations_backfill_matches_rebuild(tmp_path, listing):
+    engine = migrated(tmp_path, until="0004")
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"user_id": user_id, "username": f"user{user_id}", "email": f"user{user_id}@example.com",
+             "password_hash": "-", "role": "buyer"}
+            for user_id in (1, 2, 3)
+        ])
+        listing_id = None
+        if listing:
+            listing_id = conn.execute(insert(models.Listing).values(
+                seller_id=1, title="Desk lamp", price=10, status="published"
+            ).returning(models.Listing.listing_id)).scalar()
+        conn.execute(insert(models.Message), [
+            {"sender_id": sender, "receiver_id": receiver, "listing_id": listing_id, "body": "Hi", "is_read": is_read}
+            for sender, receiver, is_read in [(2, 1, False), (1, 2, True), (2, 1, None), (3, 1, False), (1, 3, False)]
+        ])
+        importlib.import_module("migrations.versions.0004_conversations").upgrade(conn)
+
+        assert conversations.rebuild(conn, dry_run=True) == {"threads": 2, "missing": 0, "stale": 0, "orphaned": 0}
@@ -0,0 +1,71 @@
+import sys
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from profiler import ProfilerMiddleware, profiler
+
+
+def make_app(sample_rate: float = 0) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/work")
+    async def work():
+        # Keep the loop busy long enough for the sampler to see it
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            sum(range(1000))
+        return {"switch_interval": sys.getswitchinterval()}
+
+    app.add_middleware(ProfilerMiddleware, sample_rate=sample_rate)
+    return app
+
+
+def get(client, app: FastAPI, headers: dict = None) -> httpx.Response:
+    """GET /work on the test client's event loop, where the database engine lives"""
+    async def request():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            return await http.get("/work", headers=headers)
+    response = client.portal.call(request)
+    assert response.status_code == 200, response.text
+    return response
+
+
+@pytest.fixture
+def admin(client, register):
+    _, headers = register("admin")
+    response = client.put("/api/auth/me", headers=headers, json={"role": "admin"})
+    assert response.status_code == 200, response.text
+    return headers
+
+
+def test_x_profile_is_only_honoured_for_admins(client, register, admin):
+    _, user = register("buyer")
+    app = make_app()
+
+    assert "X-Profile-Id" not in get(client, app, {**user, "X-Profile": "1"}).headers
+    assert "X-Profile-Id" not in get(client, app, {"X-Profile": "1"}).headers
+    assert "X-Profile-Id" not in get(client, app, {"Authorization": "Bearer not-a-token", "X-Profile": "1"}).headers
+    assert "X-Profile-Id" not in get(client, app, admin).headers
+
+    default_interval = sys.getswitchinterval()
+    response = get(client, app, {**admin, "X-Profile": "1"})
+    # Lowered for the request only
+    assert response.json()["switch_interval"] < default_interval
+    assert sys.getswitchinterval() == default_interval
+
+    profile = profiler.get(response.headers["X-Profile-Id"])
+    assert (profile.trigger, profile.route, profile.status) == ("header", "GET /work", 200)
+    assert profile.running_samples > 0
+    # Collapsed stacks reach down into the endpoint
+    assert "make_app.<locals>.work (tests/test_profiler.py:" in profile.folded()
+
+
+def test_sampled_profiles_keep_the_switch_interval(client):
+    default_interval = sys.getswitchinterval()
+    response = get(client, make_app(sample_rate=1))
+
+    assert response.json()["switch_interval"] == default_interval
+    assert profiler.get(response.headers["X-Profile-Id"]).trigger == "sampled"
@@ -0,0 +1,90 @@
+"""Per-endpoint query budgets (query_budget.py), enforced with QUERY_BUDGET_MODE=raise"""
+import re
+
+import pytest
+from sqlalchemy import insert
+
+import models
+from database import engine
+from query_budget import QueryBudgetExceeded
+from routers import favorites, listings, messages
+
+
+def query_count(response) -> int:
+    """Statements the request ran, from its Server-Timing header (sql_metrics.py)"""
+    return int(re.search(r"(\d+) queries", response.headers["server-timing"]).group(1))
+
+
+def test_endpoint_within_budget_passes(client, register, create_listing):
+    _, seller = register("seller")
+    listing_id = create_listing(seller)
+
+    response = client.get(f"/api/listings/{listing_id}")
+
+    assert response.status_code == 200
+    assert query_count(response) <= listings.get_listing.query_budget
+
+
+def test_endpoint_over_budget_raises(client, register, create_listing, monkeypatch):
+    _, seller = register("seller")
+    listing_id = create_listing(seller)
+    monkeypatch.setattr(listings.get_listing, "query_budget", 0)
+
+    with pytest.raises(QueryBudgetExceeded, match=r"GET /api/listings/\d+ ran \d+ queries \(budget 0\)"):
+        client.get(f"/api/listings/{listing_id}")
+
+
+@pytest.fixture
+def marketplace(client, register, create_listing):
+    """
+    A seller with `size` listings (category and two photos each) and a buyer
+    who favorited and asked about every one of them
+    """
+    def marketplace(size: int) -> dict:
+        seller_id, seller = register("seller")
+        buyer_id, buyer = register("buyer")
+        with engine.begin() as conn:
+            category_id = conn.execute(
+                insert(models.Category).values(name=f"Books {seller_id}").returning(models.Category.category_id)
+            ).scalar()
+        listing_ids = [create_listing(seller, f"Textbook {i}", category_id=category_id) for i in range(size)]
+        with engine.begin() as conn:
+            conn.execute(insert(models.Photo), [
+                {"listing_id": listing_id, "url": f"https://example.com/{listing_id}-{n}.jpg", "sort_order": n}
+                for listing_id in listing_ids for n in range(2)
+            ])
+        for listing_id in listing_ids:
+            assert client.post("/api/favorites", headers=buyer, json={"listing_id": listing_id}).status_code == 201
+            assert client.post("/api/messages", headers=buyer, json={
+                "receiver_id": seller_id, "listing_id": listing_id, "body": "Is this still available?"
+            }).status_code == 201
+        return {"seller_id": seller_id, "seller": seller, "buyer_id": buyer_id, "buyer": buyer}
+    return marketplace
+
+
+# (path template, whose session, endpoint)
+LIST_ENDPOINTS = [
+    ("/api/listings/user/{seller_id}", None, listings.get_user_listings),
+    ("/api/listings/me/listings", "seller", listings.get_my_listings),
+    ("/api/favorites", "buyer", favorites.get_favorites),
+    ("/api/messages/conversations", "seller", messages.get_conversations),
+    ("/api/messages/conversation/{buyer_id}", "seller", messages.get_conversation_messages),
+]
+
+
+@pytest.mark.parametrize("path, user, endpoint", LIST_ENDPOINTS, ids=[path for path, _, _ in LIST_ENDPOINTS])
+def test_list_queries_do_not_grow_with_rows(client, marketplace, path, user, endpoint):
+    counts = []
+    for size in (2, 12):
+        data = marketplace(size)
+        url = path.format(**data)
+        headers = data[user] if user else {}
+        # The first request may also authenticate from the DB or mark messages read
+        client.get(url, headers=headers)
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        assert len(response.json()) == size
+        counts.append(query_count(response))
+
+    assert counts[0] == counts[1], f"{path} ran {counts} queries for 2 and 12 rows"
+    assert counts[1] <= endpoint.query_budget
@@ -0,0 +1,112 @@
+"""Read-replica routing (replicas.py) with a second SQLite database as the replica"""
+import pytest
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+import migrations
+import models
+from database import async_database_url
+from replicas import replica_router
+
+REPLICA_ONLY_LISTING_ID = 1_000_000
+
+
+def bind_replica(url: str):
+    """Make `url` the only replica; NullPool leaves no connections tied to the test client's loop"""
+    replica_router.configure(replica_router.primary, {
+        "test-replica": create_async_engine(async_database_url(url), poolclass=NullPool)
+    })
+
+
+@pytest.fixture
+def replica(client, tmp_path):
+    """A migrated second database holding one listing the primary does not have"""
+    url = f"sqlite:///{tmp_path}/replica.db"
+    replica_db = create_engine(url)
+    migrations.upgrade(replica_db)
+    with replica_db.begin() as conn:
+        conn.execute(insert(models.User).values(
+            user_id=REPLICA_ONLY_LISTING_ID, username="replica_seller",
+            email="replica_seller@example.com", password_hash="-", role="seller"
+        ))
+        conn.execute(insert(models.Listing).values(
+            listing_id=REPLICA_ONLY_LISTING_ID, seller_id=REPLICA_ONLY_LISTING_ID,
+            title="Only on the replica", price=1, status="published"
+        ))
+    bind_replica(url)
+    yield replica_db
+    replica_router.configure(replica_router.primary, {})
+    replica_router._recent_writers.clear()
+    client.cookies.clear()
+    replica_db.dispose()
+
+
+def test_reads_go_to_the_replica(client, register, create_listing, replica):
+    _, seller = register("seller")
+    primary_listing = create_listing(seller)
+    client.cookies.clear()
+
+    assert client.get(f"/api/listings/{REPLICA_ONLY_LISTING_ID}").status_code == 200
+    assert client.get(f"/api/listings/{primary_listing}").status_code == 404
+    assert replica_router.replicas[0].reads == 2
+
+
+def test_writes_and_reads_after_write_stay_on_the_primary(client, register, create_listing, replica):
+    _, seller = register("seller")
+    client.cookies.clear()
+    listing_id = create_listing(seller)
+    assert "last_write" in client.cookies
+
+    # The write went to the primary only
+    with replica.connect() as conn:
+        assert conn.execute(select(models.Listing).where(models.Listing.listing_id == listing_id)).first() is None
+
+    # The writer reads its own write from the primary for the staleness window...
+    assert client.get(f"/api/listings/{listing_id}", headers=seller).status_code == 200
+    assert client.get(f"/api/listings/{REPLICA_ONLY_LISTING_ID}", headers=seller).status_code == 404
+    assert replica_router.primary_reads["sticky"] >= 2
+    # ...on any worker, through the last-write cookie...
+    replica_router._recent_writers.clear()
+    assert client.get(f"/api/listings/{listing_id}").status_code == 200
+    # ...while other clients keep reading the replica
+    client.cookies.clear()
+    assert client.get(f"/api/listings/{listing_id}").status_code == 404
+
+
+def test_writer_without_cookies_stays_on_the_primary_in_its_worker(client, register, create_listing, replica):
+    _, seller = register("seller")
+    listing_id = create_listing(seller)
+    client.cookies.clear()
+
+    assert client.get(f"/api/listings/{listing_id}", headers=seller).status_code == 200
+    # Writers are remembered by a hash of their Authorization header, not the token
+    token = seller["Authorization"].split()[1]
+    assert replica_router._recent_writers
+    assert not any(token in key for key in replica_router._recent_writers)
+
+
+def test_failing_replica_falls_back_to_the_primary(client, register, create_listing, replica, tmp_path):
+    _, seller = register("seller")
+    listing_id = create_listing(seller)
+    client.cookies.clear()
+    bind_replica(f"sqlite:///{tmp_path}/missing/replica.db")
+    fallbacks = replica_router.primary_reads["fallback"]
+
+    # The request that finds the replica down takes it out and is retried on the primary...
+    assert client.get(f"/api/listings/{listing_id}").status_code == 200
+    assert not replica_router.replicas[0].healthy
+    assert replica_router.primary_reads["fallback"] == fallbacks + 1
+
+    # ...and the next reads go straight to the primary
+    assert client.get(f"/api/listings/{listing_id}").status_code == 200
+    assert replica_router.primary_reads["fallback"] == fallbacks + 2
+
+
+def test_health_check_takes_a_failing_replica_out(client, replica, tmp_path):
+    bind_replica(f"sqlite:///{tmp_path}/missing/replica.db")
+
+    client.portal.call(replica_router.check)
+
+    assert not replica_router.replicas[0].healthy
+    assert replica_router.pick() is replica_router.primary
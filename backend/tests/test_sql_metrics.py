@@ -0,0 +1,69 @@
+import json
+import logging
+import re
+
+import pytest
+
+from sql_metrics import normalize_statement, sql_metrics
+
+
+@pytest.fixture
+def admin(client, register):
+    """Auth headers of an admin user"""
+    _, headers = register("admin")
+    response = client.put("/api/auth/me", headers=headers, json={"role": "admin"})
+    assert response.status_code == 200, response.text
+    return headers
+
+
+def test_statements_are_normalized_to_one_shape():
+    assert normalize_statement(
+        "SELECT *\n  FROM listings WHERE listing_id IN (?, ?, ?) AND title = 'it''s' AND price > 10.5"
+    ) == "SELECT * FROM listings WHERE listing_id IN (?, ...) AND title = ? AND price > ?"
+    assert normalize_statement("SELECT * FROM users WHERE user_id = $1 LIMIT %(param_1)s") == (
+        "SELECT * FROM users WHERE user_id = ? LIMIT ?"
+    )
+
+
+def test_server_timing_counts_the_request_statements(client, register, create_listing, admin):
+    _, headers = register("seller")
+    listing_id, other_id = create_listing(headers), create_listing(headers)
+
+    response = client.get(f"/api/listings/{listing_id}")
+    timing = re.fullmatch(
+        r'db;dur=[\d.]+;desc="(\d+) queries, (\d+) rows", app;dur=[\d.]+', response.headers["Server-Timing"]
+    )
+    assert timing, response.headers["Server-Timing"]
+    assert int(timing.group(1)) >= 1 and int(timing.group(2)) >= 1
+
+    def route():
+        stats = client.get("/internal/sql", headers=admin, params={"top": 100}).json()
+        return stats["routes"]["GET /api/listings/{listing_id}"]
+
+    before = route()
+    assert before["requests"] >= 1 and before["queries_per_request"] >= 1
+    # Another listing runs the same statement shapes, so no new entries
+    client.get(f"/api/listings/{other_id}")
+    after = route()
+    assert after["requests"] == before["requests"] + 1
+    assert {s["statement"] for s in after["top_statements"]} == {s["statement"] for s in before["top_statements"]}
+
+    assert client.get("/internal/sql", headers=headers).status_code == 403
+
+
+def test_slow_statements_are_logged_with_their_route(client, register, create_listing, monkeypatch, caplog):
+    _, headers = register("seller")
+    listing_id = create_listing(headers)
+    monkeypatch.setattr(sql_metrics, "slow_ms", 0)
+
+    slow_queries = sql_metrics.slow_queries
+    with caplog.at_level(logging.WARNING):
+        client.get(f"/api/listings/{listing_id}")
+    assert sql_metrics.slow_queries > slow_queries
+
+    entries = [
+        json.loads(record.getMessage().removeprefix("Slow query: "))
+        for record in caplog.records if record.getMessage().startswith("Slow query: ")
+    ]
+    assert entries and {entry["route"] for entry in entries} == {"GET /api/listings/{listing_id}"}
+    assert all("?" in entry["statement"] for entry in entries)
@@ -0,0 +1,134 @@
+"""Photo uploads (storage.py): size limits, content addressing and reference counts"""
+import asyncio
+import io
+import os
+import random
+
+import pytest
+
+from PIL import Image
+from sqlalchemy import select
+
+import models
+from database import SessionLocal, engine
+from storage import MAX_UPLOAD_BYTES, MULTIPART_OVERHEAD, UploadSizeLimitMiddleware, source_path, stored_files
+
+BOUNDARY = "upload-test-boundary"
+
+
+def chunked_multipart(size: int, chunk_size: int = 256 * 1024):
+    """A multipart body with one `size`-byte file part, sent without Content-Length"""
+    yield (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="big.png"\r\n'
+        "Content-Type: image/png\r\n\r\n"
+    ).encode()
+    yield b"\x89PNG\r\n\x1a\n"
+    for sent in range(0, size, chunk_size):
+        yield b"\0" * min(chunk_size, size - sent)
+    yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def test_oversized_upload_with_content_length_is_rejected_early(client, register):
+    _, user = register()
+
+    response = client.post("/api/photos/upload/stream", headers={
+        **user, "Content-Length": str(MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD + 1)
+    }, content=b"")
+
+    assert response.status_code == 413
+
+
+def test_oversized_chunked_multipart_upload_is_413(client, register):
+    _, user = register()
+
+    response = client.post(
+        "/api/photos/upload",
+        headers={**user, "Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+        content=chunked_multipart(MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD),
+    )
+
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Request body too large"}
+
+
+def test_malformed_content_length_is_400():
+    async def app(scope, receive, send):
+        raise AssertionError("the request should not reach the app")
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/api/photos/upload", "headers": [(b"content-length", b"ten")]}
+    asyncio.run(UploadSizeLimitMiddleware(app)(scope, None, send))
+
+    assert sent[0]["status"] == 400
+
+
+def png() -> bytes:
+    """A small PNG whose bytes no other test uploads"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), tuple(random.randrange(256) for _ in range(3))).save(buffer, "PNG")
+    buffer.write(os.urandom(8))  # after IEND: still a valid PNG, never the same hash
+    return buffer.getvalue()
+
+
+def refcount(content_hash: str):
+    with engine.connect() as conn:
+        return conn.execute(
+            select(stored_files.c.refcount).where(stored_files.c.content_hash == content_hash)
+        ).scalar()
+
+
+@pytest.fixture
+def shared_photo(client, register, create_listing):
+    """The same image attached to two listings of one seller"""
+    _, seller = register("seller")
+    image = png()
+    photos = [
+        client.post(f"/api/photos/listing/{create_listing(seller)}/stream", headers=seller, content=image).json()
+        for _ in range(2)
+    ]
+    return seller, photos
+
+
+def test_identical_uploads_are_stored_once(shared_photo):
+    _, (first, second) = shared_photo
+
+    assert first["url"] == second["url"]
+    path = source_path(first["url"])
+    assert os.path.exists(path)
+    assert refcount(os.path.basename(path).split(".")[0]) == 2
+
+
+def test_file_is_removed_with_its_last_reference(client, shared_photo):
+    seller, (first, second) = shared_photo
+    path = source_path(first["url"])
+    content_hash = os.path.basename(path).split(".")[0]
+
+    assert client.delete(f"/api/photos/{first['photo_id']}", headers=seller).status_code == 204
+    assert refcount(content_hash) == 1
+    assert os.path.exists(path)
+
+    assert client.delete(f"/api/photos/{second['photo_id']}", headers=seller).status_code == 204
+    assert refcount(content_hash) is None
+    assert not os.path.exists(path)
+
+
+def test_file_is_only_removed_after_commit(shared_photo):
+    _, photos = shared_photo
+    path = source_path(photos[0]["url"])
+    content_hash = os.path.basename(path).split(".")[0]
+
+    with SessionLocal() as db:
+        for photo in photos:
+            db.delete(db.get(models.Photo, photo["photo_id"]))
+        db.flush()
+        # The last reference is gone in this transaction, but it may still roll back
+        assert os.path.exists(path)
+        db.rollback()
+
+    assert os.path.exists(path)
+    assert refcount(content_hash) == 2
@@ -0,0 +1,107 @@
+"""
+Photo variant rendering.
+
+render_variants() runs inside image_processor's worker processes, so this
+module imports nothing from the app. Every variant is written as WebP plus
+the original's format (GIF becomes PNG, WebP originals only get WebP),
+oriented by and then stripped of EXIF metadata.
+"""
+import os
+import uuid
+
+# Variant name -> longest side in pixels (never upscaled)
+VARIANTS = {
+    "thumb": 200,
+    "card": 480,
+    "full": 1600,
+}
+
+TEMP_PREFIX = ".variant-"
+
+# Pillow format -> (file extension, save options)
+FORMATS = {
+    "WEBP": ("webp", {"quality": 80, "method": 4}),
+    "JPEG": ("jpg", {"quality": 85, "optimize": True, "progressive": True}),
+    "PNG": ("png", {"optimize": True}),
+}
+
+# Original format -> fallback format written next to the WebP
+FALLBACK_FORMATS = {
+    "JPEG": "JPEG",
+    "PNG": "PNG",
+    "GIF": "PNG",
+    "WEBP": None,
+}
+
+
+def variant_filename(source_filename: str, variant: str, extension: str) -> str:
+    stem = os.path.splitext(source_filename)[0]
+    return f"{stem}.{variant}.{extension}"
+
+
+def _prepare(image, image_format: str):
+    """Convert to a mode the target format can store"""
+    from PIL import Image
+
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    if image_format == "JPEG":
+        if has_alpha:
+            rgba = image.convert("RGBA")
+            flattened = Image.new("RGB", rgba.size, (255, 255, 255))
+            flattened.paste(rgba, mask=rgba.getchannel("A"))
+            return flattened
+        return image.convert("RGB")
+    if image_format == "WEBP":
+        return image.convert("RGBA" if has_alpha else "RGB")
+    if image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+        return image.convert("RGBA" if has_alpha else "RGB")
+    return image
+
+
+def render_variants(source_path: str, output_dir: str) -> dict:
+    """
+    Write every variant of one image into output_dir.
+
+    Returns {variant: {extension: filename}}. Each file is written to its own
+    temp file and renamed, so readers never see a partial variant, and two
+    renders of the same content can run at once without clobbering each other.
+    """
+    from PIL import Image, ImageOps
+
+    source_filename = os.path.basename(source_path)
+    with Image.open(source_path) as opened:
+        original_format = opened.format
+        if original_format not in FALLBACK_FORMATS:
+            raise ValueError(f"Unsupported image format {original_format}")
+        # JPEG can decode straight at a reduced scale
+        largest = max(VARIANTS.values())
+        opened.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(opened)
+        image.load()
+
+    # Keep nothing from the source's metadata except palette transparency
+    transparency = image.info.get("transparency")
+    image.info = {} if transparency is None else {"transparency": transparency}
+
+    formats = ["WEBP"]
+    if FALLBACK_FORMATS[original_format]:
+        formats.append(FALLBACK_FORMATS[original_format])
+
+    written = {}
+    for variant, size in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        written[variant] = {}
+        for image_format in formats:
+            extension, options = FORMATS[image_format]
+            filename = variant_filename(source_filename, variant, extension)
+            # Unique per render; mkstemp would leave the published variant mode 0600
+            temp_path = os.path.join(output_dir, f"{TEMP_PREFIX}{uuid.uuid4().hex}-{filename}")
+            try:
+                _prepare(resized, image_format).save(temp_path, image_format, **options)
+                os.replace(temp_path, os.path.join(output_dir, filename))
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            written[variant][extension] = filename
+    return written
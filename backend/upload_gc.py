@@ -0,0 +1,172 @@
+"""
+Garbage collection of unreferenced files in the uploads directory.
+
+Files written by POST /api/photos/upload that were never attached, files
+left behind by raw SQL deletes or crashes, and stale temp files are removed
+once they are older than the grace period. Variants are kept as long as the
+file they were rendered from is referenced.
+
+The directory listing and the photos table are each streamed in batches and
+sorted with a bounded external sort, then merge-joined, so memory stays flat
+at millions of files:
+
+    python upload_gc.py [--dry-run] [--grace-hours H] [--max-deletes-per-second N] [--batch-size N]
+"""
+import heapq
+import os
+import tempfile
+import time
+from sqlalchemy import select
+from dotenv import load_dotenv
+import models
+from storage import UPLOAD_DIR
+from logger import logger
+
+load_dotenv()
+
+UPLOAD_GC_GRACE_HOURS = float(os.getenv("UPLOAD_GC_GRACE_HOURS", "24"))
+
+photos_table = models.Photo.__table__
+
+
+def file_key(filename: str) -> str:
+    """What a file belongs to: "<hash>.jpg" and "<hash>.thumb.webp" both map to "<hash>" """
+    return filename.split(".", 1)[0] if not filename.startswith(".") else filename
+
+
+def _write_run(batch) -> object:
+    run = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+    run.writelines(f"{key}\t{name}\n" for key, name in batch)
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    for line in run:
+        key, name = line.rstrip("\n").split("\t", 1)
+        yield key, name
+
+
+def external_sort(items, batch_size: int):
+    """Sort (key, name) pairs keeping at most batch_size of them in memory"""
+    runs, batch = [], []
+    try:
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                batch.sort()
+                runs.append(_write_run(batch))
+                batch = []
+        batch.sort()
+        if not runs:
+            yield from batch
+            return
+        runs.append(_write_run(batch))
+        batch = []
+        yield from heapq.merge(*(_read_run(run) for run in runs))
+    finally:
+        for run in runs:
+            run.close()
+
+
+def _directory_files(upload_dir: str):
+    with os.scandir(upload_dir) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            if "\t" in entry.name or "\n" in entry.name:
+                logger.warning(f"Upload GC skipping unexpected file name {entry.name!r}")
+                continue
+            yield file_key(entry.name), entry.name
+
+
+def _referenced_files(bind, batch_size: int):
+    """Basenames of every local photo URL, read in primary-key batches"""
+    last_id = 0
+    while True:
+        with bind.connect() as conn:
+            rows = conn.execute(
+                select(photos_table.c.photo_id, photos_table.c.url)
+                .where(photos_table.c.photo_id > last_id, photos_table.c.url.like("/uploads/%"))
+                .order_by(photos_table.c.photo_id)
+                .limit(batch_size)
+            ).all()
+        if not rows:
+            return
+        for row in rows:
+            name = os.path.basename(row.url)
+            yield file_key(name), name
+        last_id = rows[-1].photo_id
+
+
+def collect(
+    bind,
+    upload_dir: str = UPLOAD_DIR,
+    grace_hours: float = UPLOAD_GC_GRACE_HOURS,
+    dry_run: bool = False,
+    max_deletes_per_second: float = 0,
+    batch_size: int = 10000
+) -> dict:
+    """Remove unreferenced upload files older than the grace period"""
+    report = {"scanned": 0, "referenced": 0, "recent": 0, "removed": 0, "removed_bytes": 0}
+    cutoff = time.time() - grace_hours * 3600
+    delay = 1 / max_deletes_per_second if max_deletes_per_second > 0 else 0
+
+    referenced = external_sort(_referenced_files(bind, batch_size), batch_size)
+    current = next(referenced, None)
+    for key, name in external_sort(_directory_files(upload_dir), batch_size):
+        report["scanned"] += 1
+        while current is not None and current[0] < key:
+            current = next(referenced, None)
+        if current is not None and current[0] == key:
+            report["referenced"] += 1
+            continue
+
+        path = os.path.join(upload_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        # Young files may belong to an upload that is about to be attached
+        if stat.st_mtime > cutoff:
+            report["recent"] += 1
+            continue
+
+        report["removed"] += 1
+        report["removed_bytes"] += stat.st_size
+        if dry_run:
+            logger.info(f"Upload GC would remove {name}")
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        if delay:
+            time.sleep(delay)
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Remove unreferenced upload files")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be removed")
+    parser.add_argument("--grace-hours", type=float, default=UPLOAD_GC_GRACE_HOURS)
+    parser.add_argument("--max-deletes-per-second", type=float, default=0, help="0 = unlimited")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    result = collect(
+        engine,
+        grace_hours=args.grace_hours,
+        dry_run=args.dry_run,
+        max_deletes_per_second=args.max_deletes_per_second,
+        batch_size=args.batch_size
+    )
+    print(
+        f"{result['scanned']} files scanned: {result['referenced']} referenced, "
+        f"{result['recent']} within grace period, "
+        f"{result['removed']} {'would be ' if args.dry_run else ''}removed "
+        f"({result['removed_bytes'] / 2**20:.1f} MB)"
+    )
@@ -0,0 +1,101 @@
+"""
+Write-behind view counter for listings.
+
+GET /api/listings/{id} only records a view in memory; a background task
+flushes the collapsed counts every VIEW_FLUSH_INTERVAL seconds as one
+UPDATE per listing. Pending views are flushed on shutdown, and the cached
+detail responses of flushed listings are invalidated.
+"""
+import asyncio
+import os
+import threading
+from collections import Counter
+from sqlalchemy import update, bindparam, func
+from dotenv import load_dotenv
+import models
+from database import engine
+from cache import response_cache
+from logger import logger
+
+load_dotenv()
+
+VIEW_FLUSH_INTERVAL = float(os.getenv("VIEW_FLUSH_INTERVAL", "10"))
+
+listings_table = models.Listing.__table__
+
+_increment_stmt = (
+    update(listings_table)
+    .where(listings_table.c.listing_id == bindparam("b_listing_id"))
+    .values(view_count=func.coalesce(listings_table.c.view_count, 0) + bindparam("b_views"))
+)
+
+
+class ViewCounter:
+    """In-process accumulator of listing views"""
+
+    def __init__(self, bind, interval: float = VIEW_FLUSH_INTERVAL):
+        self.bind = bind
+        self.interval = interval
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._task = None
+
+    def record(self, listing_id: int):
+        """Count one view (called from request threads)"""
+        with self._lock:
+            self._pending[listing_id] += 1
+
+    def pending(self, listing_id: int) -> int:
+        """Views recorded but not yet written for a listing"""
+        with self._lock:
+            return self._pending.get(listing_id, 0)
+
+    def flush(self) -> int:
+        """Write all pending views to the database; returns listings updated"""
+        with self._lock:
+            batch, self._pending = self._pending, Counter()
+        if not batch:
+            return 0
+
+        # Sorted ids give every worker the same lock order
+        params = [
+            {"b_listing_id": listing_id, "b_views": views}
+            for listing_id, views in sorted(batch.items())
+        ]
+        try:
+            with self.bind.begin() as conn:
+                conn.execute(_increment_stmt, params)
+        except Exception as e:
+            # Put the views back so the next flush retries them
+            with self._lock:
+                self._pending.update(batch)
+            logger.error(f"View count flush failed: {e}")
+            return 0
+        # Cached detail responses carry the old stored count; a count read
+        # from a lagging replica is harmless, so no need to hold the tags
+        response_cache.invalidate(*(f"listing:{listing_id}" for listing_id in batch), hold=False)
+        return len(params)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await asyncio.to_thread(self.flush)
+
+    def start(self):
+        """Start the periodic flush task on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush task and write out whatever is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+
+view_counter = ViewCounter(engine)
@@ -2,6 +2,8 @@ import axios from 'axios'
 
 const api = axios.create({
     baseURL: 'http://localhost:8000',
+    // Send the API's cookies back, e.g. the one that keeps reads on the primary after a write
+    withCredentials: true,
     headers: {
     'Content-Type': 'application/json'
     }
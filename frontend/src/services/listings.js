@@ -16,6 +16,7 @@ async function getListings(filters = {}) {
     if (filters.sort_by) params.append('sort_by', filters.sort_by)
     if (filters.limit) params.append('limit', filters.limit)
     if (filters.offset) params.append('offset', filters.offset)
+    if (filters.cursor) params.append('cursor', filters.cursor)
 
     const res = await api.get(`/api/listings?${params.toString()}`)
     return res.data
@@ -40,16 +41,29 @@ async function deleteListing(listingId) {
     await api.delete(`/api/listings/${listingId}`)
 }
 
-async function getMyListings(status = null) {
-    const params = status ? `?status=${status}` : ''
-    const res = await api.get(`/api/listings/me/listings${params}`)
-    return res.data
+function listingPageParams(status, cursor) {
+    const params = new URLSearchParams()
+    if (status) params.append('status', status)
+    if (cursor) params.append('cursor', cursor)
+    return params.toString()
 }
 
-async function getUserListings(userId, status = null) {
-    const params = status ? `?status=${status}` : ''
-    const res = await api.get(`/api/listings/user/${userId}${params}`)
-    return res.data
+/**
+ * Fetch one page of the current user's listings, newest first.
+ * Returns { listings, nextCursor }; pass nextCursor back to load the next page.
+ */
+async function getMyListings(status = null, cursor = null) {
+    const res = await api.get(`/api/listings/me/listings?${listingPageParams(status, cursor)}`)
+    return { listings: res.data, nextCursor: res.headers['x-next-cursor'] || null }
+}
+
+/**
+ * Fetch one page of a user's listings, newest first.
+ * Returns { listings, nextCursor }; pass nextCursor back to load the next page.
+ */
+async function getUserListings(userId, status = null, cursor = null) {
+    const res = await api.get(`/api/listings/user/${userId}?${listingPageParams(status, cursor)}`)
+    return { listings: res.data, nextCursor: res.headers['x-next-cursor'] || null }
 }
 
 export default {
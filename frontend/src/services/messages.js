@@ -9,10 +9,16 @@ async function getConversations() {
     return res.data
 }
 
-async function getConversationMessages(userId, listingId = null) {
-    const params = listingId ? `?listing_id=${listingId}` : ''
-    const res = await api.get(`/api/messages/conversation/${userId}${params}`)
-    return res.data
+/**
+ * Fetch one page of a thread (latest first; pass `before` to load older).
+ * Returns { messages, hasMore } with messages oldest to newest.
+ */
+async function getConversationPage(userId, listingId = null, before = null) {
+    const params = new URLSearchParams()
+    if (listingId) params.append('listing_id', listingId)
+    if (before) params.append('before', before)
+    const res = await api.get(`/api/messages/conversation/${userId}?${params.toString()}`)
+    return { messages: res.data, hasMore: res.headers['x-has-more'] === 'true' }
 }
 
 async function sendMessage(receiverId, body, listingId = null) {
@@ -32,9 +38,56 @@ async function markAsRead(messageId) {
     return res.data
 }
 
+/**
+ * Subscribe to pushed message events (message, read, unread, resync).
+ * Uses a WebSocket and falls back to Server-Sent Events.
+ * Returns a function that closes the subscription.
+ */
+function subscribe(token, onEvent) {
+    const base = api.defaults.baseURL
+    const query = `token=${encodeURIComponent(token)}`
+    let closed = false
+    let source = null
+    let retryTimer = null
+
+    function connectSSE() {
+        source = new EventSource(`${base}/api/realtime/events?${query}`)
+        for (const type of ['message', 'read', 'unread', 'resync']) {
+            source.addEventListener(type, (e) => onEvent(JSON.parse(e.data)))
+        }
+    }
+
+    function connectWebSocket() {
+        const socket = new WebSocket(`${base.replace(/^http/, 'ws')}/api/realtime/ws?${query}`)
+        let opened = false
+        socket.onopen = () => { opened = true }
+        socket.onmessage = (e) => {
+            const event = JSON.parse(e.data)
+            if (event.type !== 'ping') onEvent(event)
+        }
+        socket.onclose = () => {
+            if (closed) return
+            // Never connected: WebSockets are blocked, use SSE instead
+            if (!opened) connectSSE()
+            else retryTimer = setTimeout(connectWebSocket, 3000)
+        }
+        source = socket
+    }
+
+    if (typeof WebSocket !== 'undefined') connectWebSocket()
+    else connectSSE()
+
+    return () => {
+        closed = true
+        clearTimeout(retryTimer)
+        if (source) source.close()
+    }
+}
+
 export default {
     getConversations,
-    getConversationMessages,
+    getConversationPage,
     sendMessage,
-    markAsRead
+    markAsRead,
+    subscribe
 }